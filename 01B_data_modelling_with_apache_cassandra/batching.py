@@ -0,0 +1,96 @@
+DEFAULT_BATCH_SIZE = 20
+DEFAULT_BATCH_WINDOW = 1000
+
+
+class CrossPartitionBatchError(ValueError):
+    """Raised when a row is added to a batch for another partition."""
+
+
+class PartitionBatch:
+    """Rows of one table that all go to the same partition.
+
+    UNLOGGED batches skip the batch log, which is only safe, and only faster
+    than single writes, when the whole batch lands on one partition: the
+    coordinator then sends it to a single replica set as one mutation. A batch
+    spanning partitions would make the coordinator fan it out instead, so
+    adding a row for another partition is an error.
+    """
+
+    def __init__(self, table, statement, key):
+        self.table = table
+        self.statement = statement
+        self.key = key
+        self.rows = []
+
+    def add(self, key, values):
+        """Adds a row to the batch.
+
+        :param key: the row's partition key
+        :param values: tuple - values to bind to `statement`
+        """
+        if key != self.key:
+            raise CrossPartitionBatchError(
+                f"{self.table}: can't add a row for partition {key!r} to a batch "
+                f"for partition {self.key!r}"
+            )
+        self.rows.append(values)
+
+    def to_statement(self, batch):
+        """Adds the rows to an empty batch statement and returns it.
+
+        :param batch: an empty UNLOGGED BatchStatement, or the batch of another
+            session backend, see `loader.new_batch`
+        """
+        for values in self.rows:
+            batch.add(self.statement, values)
+        return batch
+
+    def __len__(self):
+        return len(self.rows)
+
+
+class PartitionBatcher:
+    """Groups the rows of a table by partition key into batches of at most
+    `max_size` rows.
+
+    Rows are held for a window of `window` rows across all partitions; a
+    partition's batch goes out as soon as it's full, and whatever is left is
+    flushed when the window is over. A longer window gives rows of the same
+    partition more chances to end up in the same batch, at the cost of
+    memory and of writes starting later.
+    """
+
+    def __init__(self, table, statement, max_size, window):
+        self.table = table
+        self.statement = statement
+        self.max_size = max_size
+        self.window = window
+        self.batches = {}
+        self.held = 0
+
+    def add(self, key, values):
+        """Adds a row, and returns the batches that are ready to be written.
+
+        :param key: the row's partition key
+        :param values: tuple - values to bind to `statement`
+        """
+        batch = self.batches.get(key)
+        if batch is None:
+            batch = self.batches[key] = PartitionBatch(self.table, self.statement, key)
+        batch.add(key, values)
+        self.held += 1
+
+        if self.held >= self.window:
+            return self.flush()
+        if len(batch) >= self.max_size:
+            del self.batches[key]
+            self.held -= len(batch)
+            return [batch]
+        return []
+
+    def flush(self):
+        """Returns every batch that's still held, and empties the batcher."""
+        batches = list(self.batches.values())
+        self.batches = {}
+        self.held = 0
+        return batches
@@ -0,0 +1,310 @@
+import json
+import optparse
+import random
+import sys
+import time
+from decimal import Decimal
+
+import loader
+from batching import DEFAULT_BATCH_SIZE, DEFAULT_BATCH_WINDOW
+from fake_cassandra import FakeSession
+from log import config_log
+from metrics import WriteMetrics
+
+logging = config_log()
+
+# Allowed drop in writes/sec against a baseline before it counts as a regression
+DEFAULT_TOLERANCE = 0.1
+
+# Roughly the shape of the sample data in `event_data/`
+USERS = 96
+SONGS = 2000
+ITEMS_PER_SESSION = 20
+
+FIRST_NAMES = ["Walter", "Kaylee", "Celeste", "Sylvie", "Jacob", "Lily", "Aleena"]
+LAST_NAMES = ["Frye", "Summers", "Williams", "Cruz", "Klein", "Koch", "Kirby"]
+LOCATIONS = [
+    "San Francisco-Oakland-Hayward, CA",
+    "Phoenix-Mesa-Scottsdale, AZ",
+    "Houston-The Woodlands-Sugar Land, TX",
+]
+WORDS = ["Broken", "Night", "Fire", "Blue", "Ashes", "Place", "Streets", "Girls"]
+
+
+def generate_events(number_of_events, seed=0):
+    """Yields random song play events, session by session.
+
+    The same seed always gives the same events, so every write mode is run on
+    the same data.
+
+    :param number_of_events: int
+    :param seed: int
+    """
+    rng = random.Random(seed)
+    songs = [
+        (
+            " ".join(rng.choices(WORDS, k=rng.randint(1, 4))) + f" {i}",
+            f"{rng.choice(WORDS)} {rng.choice(WORDS)}",
+            Decimal(rng.randint(60_000, 600_000)) / 1000,
+        )
+        for i in range(SONGS)
+    ]
+    users = [
+        (user_id, rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), rng.choice("FM"))
+        for user_id in range(1, USERS + 1)
+    ]
+
+    session = None
+    item_in_session = 0
+    for _ in range(number_of_events):
+        # sessions are ITEMS_PER_SESSION events long on average
+        if session is None or rng.random() < 1 / ITEMS_PER_SESSION:
+            session = (
+                session[0] + 1 if session else 1,
+                *rng.choice(users),
+                rng.choice(["free", "paid"]),
+                rng.choice(LOCATIONS),
+            )
+            item_in_session = 0
+        session_id, user_id, first_name, last_name, gender, level, location = session
+
+        song, artist, length = rng.choice(songs)
+        yield loader.Event(
+            artist=artist,
+            first_name=first_name,
+            gender=gender,
+            item_in_session=item_in_session,
+            last_name=last_name,
+            length=length,
+            level=level,
+            location=location,
+            session_id=session_id,
+            song=song,
+            user_id=user_id,
+        )
+        item_in_session += 1
+
+
+def run_point(write_mode, number_of_events, latency, options):
+    """Loads generated events into a fresh fake backend with one write mode, and
+    times it.
+
+    Returns a dict of results for the point.
+
+    :param write_mode: str - sync | concurrent | batched
+    :param number_of_events: int
+    :param latency: float - seconds per request
+    :param options: dict - concurrency, batch_size, batch_window and seed
+    """
+    session = FakeSession(latency=latency)
+    tables = list(loader.QUERY_TABLES)
+    metrics = WriteMetrics()
+
+    try:
+        statements = loader.prepare_session(session, "sparkify", tables)
+        requests_before = session.requests
+
+        start = time.perf_counter()
+        loader.load_events(
+            session,
+            statements,
+            generate_events(number_of_events, options["seed"]),
+            options["concurrency"],
+            metrics,
+            write_mode,
+            options["batch_size"],
+            options["batch_window"],
+        )
+        wall_seconds = time.perf_counter() - start
+        requests = session.requests - requests_before
+        stored = {table: session.row_count(table) for table in tables}
+    finally:
+        session.shutdown()
+
+    writes = sum(metrics.writes.values())
+    return {
+        "write_mode": write_mode,
+        "events": number_of_events,
+        "latency_ms": latency * 1000,
+        "wall_seconds": wall_seconds,
+        "writes": writes,
+        "errors": sum(metrics.errors.values()),
+        "requests": requests,
+        "writes_per_second": writes / wall_seconds if wall_seconds else 0.0,
+        "stored_rows": stored,
+    }
+
+
+def find_regressions(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Compares writes/sec per point against a baseline run.
+
+    Points are matched on write mode, number of events and latency. Returns a
+    list of (write mode, events, baseline writes/sec, writes/sec) for every
+    point that got slower by more than `tolerance`.
+
+    :param results: list[dict] - from `run_point`
+    :param baseline: list[dict] - results of an earlier benchmark
+    :param tolerance: float - allowed relative drop, e.g. 0.1 for 10%
+    """
+    baseline_by_point = {
+        (point["write_mode"], point["events"], point["latency_ms"]): point
+        for point in baseline
+    }
+    regressions = []
+    for point in results:
+        before = baseline_by_point.get(
+            (point["write_mode"], point["events"], point["latency_ms"])
+        )
+        if before and point["writes_per_second"] < before["writes_per_second"] * (
+            1 - tolerance
+        ):
+            regressions.append(
+                (
+                    point["write_mode"],
+                    point["events"],
+                    before["writes_per_second"],
+                    point["writes_per_second"],
+                )
+            )
+    return regressions
+
+
+def log_results(results):
+    """Logs one line per point.
+
+    :param results: list[dict] - from `run_point`
+    """
+    for point in results:
+        logging.info(
+            f"{point['events']} events [{point['write_mode']}, "
+            f"{point['latency_ms']:g} ms latency]: {point['writes']} writes in "
+            f"{point['requests']} requests, {point['wall_seconds']:.2f}s, "
+            f"{point['writes_per_second']:.0f} writes/sec, "
+            f"{point['errors']} errors"
+        )
+
+
+def main(events, write_modes, latency_ms, output, baseline, tolerance, **options):
+    """Runs every write mode at every number of events against the fake backend
+    and writes the results.
+
+    Exits with status 1 if a baseline was given and throughput regressed.
+    """
+    results = [
+        run_point(write_mode, number_of_events, latency_ms / 1000, options)
+        for number_of_events in events
+        for write_mode in write_modes
+    ]
+    log_results(results)
+
+    with open(output, "w", encoding="utf8") as f:
+        json.dump(results, f, indent=2)
+    logging.info(f"Results written to {output}")
+
+    if baseline:
+        with open(baseline, encoding="utf8") as f:
+            regressions = find_regressions(results, json.load(f), tolerance)
+        for write_mode, number_of_events, before, after in regressions:
+            logging.error(
+                f"{number_of_events} events [{write_mode}] regressed: "
+                f"{before:.0f} -> {after:.0f} writes/sec"
+            )
+        if regressions:
+            sys.exit(1)
+
+
+def get_opt_parser():
+    """
+    Returns an option parser instance for the benchmark's command line options.
+    """
+    optparser = optparse.OptionParser()
+    optparser.add_option(
+        "--events",
+        dest="events",
+        default="1000,10000",
+        help="Comma separated numbers of events to generate and load "
+        "(default: 1000,10000)",
+    )
+    optparser.add_option(
+        "--write-modes",
+        dest="write_modes",
+        default=",".join(loader.WRITE_MODES),
+        help="Comma separated write modes to compare "
+        f"(default: {','.join(loader.WRITE_MODES)})",
+    )
+    optparser.add_option(
+        "--latency-ms",
+        dest="latency_ms",
+        type="float",
+        default=1.0,
+        help="Latency of every request to the fake backend, in ms (default: 1)",
+    )
+    optparser.add_option(
+        "--concurrency",
+        dest="concurrency",
+        type="int",
+        default=loader.DEFAULT_CONCURRENCY,
+        help=f"Max writes in flight (default: {loader.DEFAULT_CONCURRENCY})",
+    )
+    optparser.add_option(
+        "--batch-size",
+        dest="batch_size",
+        type="int",
+        default=DEFAULT_BATCH_SIZE,
+        help=f"Max rows per batch (default: {DEFAULT_BATCH_SIZE})",
+    )
+    optparser.add_option(
+        "--batch-window",
+        dest="batch_window",
+        type="int",
+        default=DEFAULT_BATCH_WINDOW,
+        help="Rows of each table held while grouping them by partition "
+        f"(default: {DEFAULT_BATCH_WINDOW})",
+    )
+    optparser.add_option(
+        "--seed", dest="seed", type="int", default=0, help="Random seed (default: 0)"
+    )
+    optparser.add_option(
+        "--output",
+        "-o",
+        dest="output",
+        default="benchmark_results.json",
+        help="Results file (default: benchmark_results.json)",
+    )
+    optparser.add_option(
+        "--baseline",
+        dest="baseline",
+        default=None,
+        help="Results file of an earlier run to check for regressions against",
+    )
+    optparser.add_option(
+        "--tolerance",
+        dest="tolerance",
+        type="float",
+        default=DEFAULT_TOLERANCE,
+        help="Allowed writes/sec drop against the baseline (default: 0.1)",
+    )
+    return optparser
+
+
+if __name__ == "__main__":
+    optparser = get_opt_parser()
+    options, args = optparser.parse_args()
+
+    write_modes = options.write_modes.split(",")
+    unknown = set(write_modes) - set(loader.WRITE_MODES)
+    if unknown:
+        optparser.error(f"unknown write modes: {', '.join(sorted(unknown))}")
+
+    main(
+        [int(number) for number in options.events.split(",")],
+        write_modes,
+        options.latency_ms,
+        options.output,
+        options.baseline,
+        options.tolerance,
+        concurrency=options.concurrency,
+        batch_size=options.batch_size,
+        batch_window=options.batch_window,
+        seed=options.seed,
+    )
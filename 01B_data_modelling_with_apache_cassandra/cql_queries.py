@@ -0,0 +1,104 @@
+# KEYSPACE
+
+# Filled in with str.format, hence the doubled braces
+keyspace_create = """
+CREATE KEYSPACE IF NOT EXISTS {keyspace}
+WITH REPLICATION = {{ 'class' : 'SimpleStrategy', 'replication_factor' : 1 }}
+"""
+
+# DROP TABLES
+
+session_items_drop = "DROP TABLE IF EXISTS session_items"
+songs_by_user_session_drop = "DROP TABLE IF EXISTS songs_by_user_session"
+users_by_song_drop = "DROP TABLE IF EXISTS users_by_song"
+
+# CREATE TABLES
+
+# Songs by session and item in session
+session_items_create = """
+CREATE TABLE IF NOT EXISTS session_items (
+    session_id int,
+    item_in_session int,
+    artist text,
+    song_title text,
+    song_length decimal,
+    PRIMARY KEY (session_id, item_in_session)
+)
+"""
+
+# Songs by user session, ordered by item in session then by the user's name
+songs_by_user_session_create = """
+CREATE TABLE IF NOT EXISTS songs_by_user_session (
+    user_id int,
+    session_id int,
+    item_in_session int,
+    user_first_name text,
+    user_last_name text,
+    artist text,
+    song_title text,
+    PRIMARY KEY (
+        (user_id, session_id), item_in_session, user_first_name, user_last_name
+    )
+)
+"""
+
+# Users who listened to a song
+users_by_song_create = """
+CREATE TABLE IF NOT EXISTS users_by_song (
+    song text,
+    user_id int,
+    user_first_name text,
+    user_last_name text,
+    PRIMARY KEY (song, user_id)
+)
+"""
+
+# INSERT RECORDS
+
+# Prepared once per session by the loader, hence the ? markers
+session_items_insert = """
+INSERT INTO session_items (session_id, item_in_session, artist, song_title, song_length)
+VALUES (?, ?, ?, ?, ?)
+"""
+
+songs_by_user_session_insert = """
+INSERT INTO songs_by_user_session (user_id, session_id, item_in_session,
+    user_first_name, user_last_name, artist, song_title)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+users_by_song_insert = """
+INSERT INTO users_by_song (song, user_id, user_first_name, user_last_name)
+VALUES (?, ?, ?, ?)
+"""
+
+# SELECTS
+
+session_item_select = """
+SELECT artist, song_title, song_length FROM session_items
+WHERE session_id = ? AND item_in_session = ?
+"""
+
+user_session_songs_select = """
+SELECT item_in_session, user_first_name, user_last_name, artist, song_title
+FROM songs_by_user_session
+WHERE user_id = ? AND session_id = ?
+"""
+
+song_users_select = """
+SELECT user_id, user_first_name, user_last_name FROM users_by_song
+WHERE song = ?
+"""
+
+# QUERY LISTS
+
+create_table_queries = [
+    session_items_create,
+    songs_by_user_session_create,
+    users_by_song_create,
+]
+drop_table_queries = [
+    session_items_drop,
+    songs_by_user_session_drop,
+    users_by_song_drop,
+]
@@ -0,0 +1,78 @@
+import csv
+import glob
+import os
+
+DEFAULT_EVENT_DIR = "event_data"
+
+# The columns of the source files that the query tables use, in the order of
+# the merged event data file
+EVENT_COLUMNS = [
+    "artist",
+    "firstName",
+    "gender",
+    "itemInSession",
+    "lastName",
+    "length",
+    "level",
+    "location",
+    "sessionId",
+    "song",
+    "userId",
+]
+
+csv.register_dialect("myDialect", quoting=csv.QUOTE_ALL, skipinitialspace=True)
+
+
+def get_event_files(directory):
+    """Returns the event CSV files in a directory, sorted.
+
+    :param directory: str
+    """
+    return sorted(glob.glob(os.path.join(directory, "*.csv")))
+
+
+def stream_event_rows(filepaths):
+    """Yields the rows of the source event files one by one, as dicts of the
+    `EVENT_COLUMNS`. Rows without an artist aren't song plays and are dropped.
+
+    Only the file being read is open, and no more than one row is held at a
+    time, so memory doesn't grow with the input.
+
+    :param filepaths: list[str]
+    """
+    for filepath in filepaths:
+        with open(filepath, encoding="utf8", newline="") as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if header is None:
+                continue
+            indices = [header.index(column) for column in EVENT_COLUMNS]
+
+            for row in reader:
+                if not row or row[indices[0]] == "":
+                    continue
+                yield {column: row[i] for column, i in zip(EVENT_COLUMNS, indices)}
+
+
+def read_event_lines(filepath):
+    """Yields the rows of a merged event data file as dicts.
+
+    :param filepath: str
+    """
+    with open(filepath, encoding="utf8", newline="") as f:
+        yield from csv.DictReader(f)
+
+
+def write_merged(rows, filepath):
+    """Passes rows through while also writing them to a merged event data file,
+    in the same format as the notebook's `event_datafile_new.csv`.
+
+    :param rows: Iterable[dict] - e.g. from `stream_event_rows`
+    :param filepath: str
+    """
+    with open(filepath, "w", encoding="utf8", newline="") as f:
+        writer = csv.writer(f, dialect="myDialect")
+        writer.writerow(EVENT_COLUMNS)
+        for row in rows:
+            writer.writerow([row[column] for column in EVENT_COLUMNS])
+            yield row
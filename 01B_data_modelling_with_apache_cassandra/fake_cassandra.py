@@ -0,0 +1,503 @@
+import heapq
+import itertools
+import re
+import threading
+import time
+from collections import namedtuple
+from decimal import Decimal
+
+from log import config_log
+
+logging = config_log()
+
+CREATE_KEYSPACE_RE = re.compile(r"^\s*CREATE\s+KEYSPACE\s", re.I)
+CREATE_TABLE_RE = re.compile(
+    r"^\s*CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)\s*\((.*)\)\s*;?\s*$",
+    re.I | re.S,
+)
+PRIMARY_KEY_RE = re.compile(r"PRIMARY\s+KEY\s*\((.*)\)", re.I | re.S)
+DROP_TABLE_RE = re.compile(
+    r"^\s*DROP\s+TABLE\s+(IF\s+EXISTS\s+)?(\w+)\s*;?\s*$", re.I | re.S
+)
+INSERT_RE = re.compile(
+    r"^\s*INSERT\s+INTO\s+(\w+)\s*\(([^)]*)\)\s*VALUES\s*\(([^)]*)\)\s*;?\s*$",
+    re.I | re.S,
+)
+SELECT_RE = re.compile(
+    r"^\s*SELECT\s+(.*?)\s+FROM\s+(\w+)(?:\s+WHERE\s+(.*?))?\s*;?\s*$", re.I | re.S
+)
+# col = ? | col = %s | col = 'text' | col = 123
+RESTRICTION_RE = re.compile(
+    r"^\s*(\w+)\s*=\s*(\?|%s|'(?:[^']|'')*'|-?\d+(?:\.\d+)?)\s*$", re.S
+)
+MARKERS = ("?", "%s")
+
+
+class InvalidRequest(Exception):
+    """Raised for a query that Cassandra would refuse, or that the fake doesn't
+    support."""
+
+
+class FakeTable:
+    """Rows of a table, by partition key and then by clustering key."""
+
+    def __init__(self, name, columns, partition_key, clustering):
+        self.name = name
+        self.columns = columns
+        self.partition_key = partition_key
+        self.clustering = clustering
+        self.partitions = {}
+
+    def upsert(self, row):
+        """Writes a row, over the existing one with the same primary key, if any.
+
+        :param row: dict - column -> value, every primary key column included
+        """
+        try:
+            key = tuple(row[column] for column in self.partition_key)
+            clustering = tuple(row[column] for column in self.clustering)
+        except KeyError as e:
+            raise InvalidRequest(f"{self.name}: missing primary key column {e}")
+        if None in key or None in clustering:
+            raise InvalidRequest(f"{self.name}: primary key columns can't be null")
+
+        partition = self.partitions.setdefault(key, {})
+        partition.setdefault(clustering, {}).update(row)
+
+    def row_count(self):
+        """Returns the number of rows in the table."""
+        return sum(len(partition) for partition in self.partitions.values())
+
+
+def parse_literal(token):
+    """Converts a CQL literal to its value.
+
+    :param token: str - e.g. 'text' or 123
+    """
+    if token.startswith("'"):
+        return token[1:-1].replace("''", "'")
+    if "." in token:
+        return Decimal(token)
+    return int(token)
+
+
+def parse_create_table(name, body):
+    """Returns a `FakeTable` for the body of a CREATE TABLE.
+
+    :param name: str
+    :param body: str - what's between the outer parentheses
+    """
+    primary_key = PRIMARY_KEY_RE.search(body)
+    if not primary_key:
+        raise InvalidRequest(f"{name}: only a separate PRIMARY KEY (...) is supported")
+
+    columns = [
+        definition.split()[0]
+        for definition in body[: primary_key.start()].split(",")
+        if definition.strip()
+    ]
+
+    key = primary_key.group(1).strip()
+    if key.startswith("("):
+        partition, _, rest = key[1:].partition(")")
+        partition_key = [column.strip() for column in partition.split(",")]
+        clustering = [column.strip() for column in rest.split(",") if column.strip()]
+    else:
+        partition_key, *clustering = [column.strip() for column in key.split(",")]
+        partition_key = [partition_key]
+
+    return FakeTable(name, columns, partition_key, clustering)
+
+
+class FakePreparedStatement:
+    """A statement parsed once by `FakeSession.prepare`."""
+
+    def __init__(self, query_string, run):
+        self.query_string = query_string
+        self.run = run
+
+
+class FakeBatch:
+    """Statements sent together as a single request, see
+    `FakeSession.new_batch`."""
+
+    def __init__(self):
+        self.statements = []
+
+    def add(self, statement, parameters=None):
+        """Adds a statement to the batch.
+
+        :param statement: FakePreparedStatement | str
+        :param parameters: tuple - values to bind
+        """
+        self.statements.append((statement, parameters))
+
+    def __len__(self):
+        return len(self.statements)
+
+
+class FakeResultSet(list):
+    """The rows a query returned, as named tuples like the driver's default row
+    factory."""
+
+    def one(self):
+        """Returns the first row, or None."""
+        return self[0] if self else None
+
+
+class FakeResponseFuture:
+    """The pending result of `FakeSession.execute_async`, with the parts of
+    `cassandra.cluster.ResponseFuture` that callers and
+    `cassandra.concurrent` use."""
+
+    has_more_pages = False
+    # read by the driver's ResultSet, which cassandra.concurrent wraps results in
+    _col_names = None
+    _col_types = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+        self._callbacks = []
+        self._errbacks = []
+
+    def set_outcome(self, result=None, error=None):
+        """Completes the future and runs its callbacks, or errbacks.
+
+        :param result: FakeResultSet
+        :param error: Exception - if the request failed
+        """
+        with self._lock:
+            self._result = result
+            self._error = error
+            self._done.set()
+            handlers = self._errbacks if error else self._callbacks
+            self._callbacks, self._errbacks = [], []
+
+        for fn, args, kwargs in handlers:
+            fn(error if error else result, *args, **kwargs)
+
+    def add_callback(self, fn, *args, **kwargs):
+        """Calls `fn(rows, *args, **kwargs)` when the request succeeds."""
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append((fn, args, kwargs))
+                return
+        if not self._error:
+            fn(self._result, *args, **kwargs)
+
+    def add_errback(self, fn, *args, **kwargs):
+        """Calls `fn(error, *args, **kwargs)` if the request fails."""
+        with self._lock:
+            if not self._done.is_set():
+                self._errbacks.append((fn, args, kwargs))
+                return
+        if self._error:
+            fn(self._error, *args, **kwargs)
+
+    def add_callbacks(
+        self,
+        callback,
+        errback,
+        callback_args=(),
+        callback_kwargs=None,
+        errback_args=(),
+        errback_kwargs=None,
+    ):
+        """Adds a callback and an errback at once."""
+        self.add_callback(callback, *callback_args, **(callback_kwargs or {}))
+        self.add_errback(errback, *errback_args, **(errback_kwargs or {}))
+
+    def clear_callbacks(self):
+        """Drops the callbacks and errbacks that haven't run yet."""
+        with self._lock:
+            self._callbacks, self._errbacks = [], []
+
+    def result(self):
+        """Waits for the request and returns its rows, or raises its error."""
+        self._done.wait()
+        if self._error:
+            raise self._error
+        return self._result
+
+
+class Scheduler:
+    """A thread that completes requests when their latency is up, standing in
+    for the network and the server. Completions, and so the callbacks of the
+    futures, run on this thread, like the driver's event loop thread."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._queue = []
+        self._order = itertools.count()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def call_at(self, when, fn):
+        """Runs `fn()` on the scheduler thread at `when`.
+
+        :param when: float - a `time.perf_counter()` time
+        :param fn: function()
+        """
+        with self._condition:
+            heapq.heappush(self._queue, (when, next(self._order), fn))
+            self._condition.notify()
+
+    def _run(self):
+        """Runs due calls in time order until stopped."""
+        with self._condition:
+            while True:
+                if not self._queue:
+                    if self._stopped:
+                        return
+                    self._condition.wait()
+                    continue
+
+                when, _, fn = self._queue[0]
+                delay = when - time.perf_counter()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+
+                heapq.heappop(self._queue)
+                self._condition.release()
+                try:
+                    fn()
+                except Exception:
+                    # like the driver's event loop, a failing callback doesn't
+                    # stop the other requests from completing
+                    logging.exception("Error in a request callback")
+                finally:
+                    self._condition.acquire()
+
+    def stop(self):
+        """Stops the thread once the requests already scheduled are done."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join()
+
+
+class FakeSession:
+    """An in-process stand-in for `cassandra.cluster.Session`, for running the
+    loader and benchmarks without a Cassandra server.
+
+    Supports the statements this project uses: CREATE KEYSPACE (ignored),
+    CREATE and DROP TABLE, INSERT, and SELECTs that restrict the whole
+    partition key, and optionally a prefix of the clustering columns, with
+    `=`. Like Cassandra, INSERTs are upserts by primary key and SELECTs return
+    rows in clustering order; any other SELECT is an `InvalidRequest`, since it
+    would need ALLOW FILTERING.
+
+    Every request (an execute, a batch or a prepare) takes `latency` seconds.
+    Async requests take effect and complete on a scheduler thread when their
+    latency is up, so concurrent requests overlap like they would over a
+    network.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.keyspace = None
+        self.tables = {}
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._scheduler = Scheduler()
+
+    def set_keyspace(self, keyspace):
+        """Records the keyspace; the fake has a single set of tables."""
+        self.keyspace = keyspace
+
+    def new_batch(self):
+        """Returns an empty batch, used by the loader instead of the driver's
+        `BatchStatement`."""
+        return FakeBatch()
+
+    def prepare(self, query):
+        """Parses a query once, so executing it doesn't parse it again.
+
+        :param query: str - with ? markers
+        """
+        self._wait()
+        return FakePreparedStatement(query, self._compile(query))
+
+    def execute(self, query, parameters=None, **kwargs):
+        """Runs a request and waits for it.
+
+        :param query: str | FakePreparedStatement | FakeBatch
+        :param parameters: tuple - values to bind
+        """
+        self._wait()
+        return self._run(query, parameters)
+
+    def execute_async(self, query, parameters=None, **kwargs):
+        """Sends a request, returns a `FakeResponseFuture` for its result.
+
+        :param query: str | FakePreparedStatement | FakeBatch
+        :param parameters: tuple - values to bind
+        """
+        future = FakeResponseFuture()
+        with self._lock:
+            self.requests += 1
+
+        def complete():
+            try:
+                result = self._run(query, parameters)
+            except Exception as e:
+                future.set_outcome(error=e)
+            else:
+                future.set_outcome(result=result)
+
+        self._scheduler.call_at(time.perf_counter() + self.latency, complete)
+        return future
+
+    def row_count(self, table):
+        """Returns the number of rows stored in a table.
+
+        :param table: str
+        """
+        return self._table(table).row_count()
+
+    def shutdown(self):
+        """Stops the scheduler thread once pending requests are done."""
+        self._scheduler.stop()
+
+    def _wait(self):
+        """Counts a synchronous request and waits out its latency."""
+        with self._lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _table(self, name):
+        """Returns a table by name, or raises `InvalidRequest`."""
+        try:
+            return self.tables[name]
+        except KeyError:
+            raise InvalidRequest(f"unconfigured table {name}")
+
+    def _run(self, query, parameters):
+        """Applies a statement or a batch and returns its rows."""
+        if isinstance(query, FakeBatch):
+            for statement, values in query.statements:
+                self._run(statement, values)
+            return FakeResultSet()
+
+        run = query.run if isinstance(query, FakePreparedStatement) else None
+        if run is None:
+            run = self._compile(query)
+        with self._lock:
+            return run(tuple(parameters or ()))
+
+    def _compile(self, query):
+        """Parses a query into a function(values) that runs it against the
+        tables.
+
+        :param query: str
+        """
+        if CREATE_KEYSPACE_RE.match(query):
+            return lambda values: FakeResultSet()
+
+        match = CREATE_TABLE_RE.match(query)
+        if match:
+            table = parse_create_table(match.group(1), match.group(2))
+
+            def create(values):
+                self.tables.setdefault(table.name, table)
+                return FakeResultSet()
+
+            return create
+
+        match = DROP_TABLE_RE.match(query)
+        if match:
+            if_exists, name = match.groups()
+
+            def drop(values):
+                if name not in self.tables and not if_exists:
+                    raise InvalidRequest(f"unconfigured table {name}")
+                self.tables.pop(name, None)
+                return FakeResultSet()
+
+            return drop
+
+        match = INSERT_RE.match(query)
+        if match:
+            return self._compile_insert(*match.groups())
+
+        match = SELECT_RE.match(query)
+        if match:
+            return self._compile_select(*match.groups())
+
+        raise InvalidRequest(f"unsupported query: {query.strip()}")
+
+    def _compile_insert(self, name, columns, markers):
+        """Returns a function(values) that upserts a row."""
+        columns = [column.strip() for column in columns.split(",")]
+        markers = [marker.strip() for marker in markers.split(",")]
+        if len(markers) != len(columns) or any(m not in MARKERS for m in markers):
+            raise InvalidRequest(f"{name}: INSERT values must all be bind markers")
+
+        def insert(values):
+            if len(values) != len(columns):
+                raise InvalidRequest(
+                    f"{name}: expected {len(columns)} values, got {len(values)}"
+                )
+            self._table(name).upsert(dict(zip(columns, values)))
+            return FakeResultSet()
+
+        return insert
+
+    def _compile_select(self, selected, name, where):
+        """Returns a function(values) that reads rows of a partition."""
+        selected = [column.strip() for column in selected.split(",")]
+        restrictions = []
+        for clause in re.split(r"\s+AND\s+", where or "", flags=re.I):
+            if not clause.strip():
+                continue
+            match = RESTRICTION_RE.match(clause)
+            if not match:
+                raise InvalidRequest(f"{name}: unsupported restriction {clause!r}")
+            restrictions.append(match.groups())
+
+        def select(values):
+            table = self._table(name)
+            bound = iter(values)
+            restricted = {
+                column: next(bound) if token in MARKERS else parse_literal(token)
+                for column, token in restrictions
+            }
+
+            if any(column not in restricted for column in table.partition_key):
+                raise InvalidRequest(
+                    f"{name}: every partition key column "
+                    f"({', '.join(table.partition_key)}) must be restricted"
+                )
+            prefix = []
+            for column in table.clustering:
+                if column not in restricted:
+                    break
+                prefix.append(restricted[column])
+            key_columns = len(table.partition_key) + len(prefix)
+            if len(restricted) > key_columns:
+                raise InvalidRequest(
+                    f"{name}: only the partition key and a prefix of the "
+                    "clustering columns can be restricted"
+                )
+
+            columns = table.columns if selected == ["*"] else selected
+            unknown = set(columns) - set(table.columns)
+            if unknown:
+                raise InvalidRequest(f"{name}: unknown columns {sorted(unknown)}")
+            row_type = namedtuple("Row", columns)
+
+            key = tuple(restricted[column] for column in table.partition_key)
+            partition = table.partitions.get(key, {})
+            return FakeResultSet(
+                row_type(*(row.get(column) for column in columns))
+                for clustering, row in sorted(partition.items())
+                if list(clustering[: len(prefix)]) == prefix
+            )
+
+        return select
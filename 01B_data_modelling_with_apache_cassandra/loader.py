@@ -0,0 +1,539 @@
+import optparse
+import time
+from collections import deque
+from decimal import Decimal
+from typing import Callable, NamedTuple
+
+from cassandra.cluster import Cluster
+from cassandra.concurrent import execute_concurrent
+from cassandra.query import BatchStatement, BatchType
+
+from batching import DEFAULT_BATCH_SIZE, DEFAULT_BATCH_WINDOW, PartitionBatcher
+from cql_queries import (keyspace_create, session_items_create,
+                         session_items_insert, songs_by_user_session_create,
+                         songs_by_user_session_insert, users_by_song_create,
+                         users_by_song_insert)
+from events import (DEFAULT_EVENT_DIR, get_event_files, read_event_lines,
+                    stream_event_rows, write_merged)
+from fake_cassandra import FakeSession
+from log import config_log
+from metrics import WriteMetrics
+
+logging = config_log()
+
+DEFAULT_CONCURRENCY = 100
+
+WRITE_MODES = ["sync", "concurrent", "batched"]
+
+
+class Event(NamedTuple):
+    """An event of the data file, with its fields converted to their column
+    types."""
+
+    artist: str
+    first_name: str
+    gender: str
+    item_in_session: int
+    last_name: str
+    length: Decimal
+    level: str
+    location: str
+    session_id: int
+    song: str
+    user_id: int
+
+
+def parse_event(line):
+    """Converts a row of the event data file to an `Event`.
+
+    :param line: dict - a row of the event data file
+    """
+    return Event(
+        artist=line["artist"],
+        first_name=line["firstName"],
+        gender=line["gender"],
+        item_in_session=int(line["itemInSession"]),
+        last_name=line["lastName"],
+        length=Decimal(line["length"]),
+        level=line["level"],
+        location=line["location"],
+        session_id=int(line["sessionId"]),
+        song=line["song"],
+        user_id=int(line["userId"]),
+    )
+
+
+class QueryTable(NamedTuple):
+    """A denormalized table written from every event."""
+
+    name: str
+    create: str
+    insert: str
+    # function(Event) -> values to bind to `insert`
+    values: Callable
+    # function(Event) -> the row's partition key, for batching
+    partition_key: Callable
+
+
+# name -> QueryTable, in load order. Every registered table is written from the
+# same pass over the events.
+QUERY_TABLES = {}
+
+
+def register_query_table(name, create, insert, values, partition_key):
+    """Adds a table to the ones the loader writes events to.
+
+    :param name: str
+    :param create: str - CREATE TABLE IF NOT EXISTS query
+    :param insert: str - INSERT query with ? markers
+    :param values: function(Event) - returns the values to bind to `insert`
+    :param partition_key: function(Event) - returns the partition key of the
+        table's row for an event
+    """
+    QUERY_TABLES[name] = QueryTable(name, create, insert, values, partition_key)
+
+
+register_query_table(
+    "session_items",
+    session_items_create,
+    session_items_insert,
+    lambda e: (e.session_id, e.item_in_session, e.artist, e.song, e.length),
+    lambda e: e.session_id,
+)
+register_query_table(
+    "songs_by_user_session",
+    songs_by_user_session_create,
+    songs_by_user_session_insert,
+    lambda e: (
+        e.user_id,
+        e.session_id,
+        e.item_in_session,
+        e.first_name,
+        e.last_name,
+        e.artist,
+        e.song,
+    ),
+    lambda e: (e.user_id, e.session_id),
+)
+register_query_table(
+    "users_by_song",
+    users_by_song_create,
+    users_by_song_insert,
+    lambda e: (e.song, e.user_id, e.first_name, e.last_name),
+    lambda e: e.song,
+)
+
+
+def connect(hosts, port):
+    """Returns a (cluster, session) connected to Cassandra.
+
+    :param hosts: list[str] - contact points
+    :param port: int
+    """
+    cluster = Cluster(hosts, port=port)
+    return cluster, cluster.connect()
+
+
+def create_keyspace(session, keyspace):
+    """Creates the keyspace if needed and makes it the session's default.
+
+    :param session: cassandra.cluster.Session, or another session backend
+    :param keyspace: str
+    """
+    session.execute(keyspace_create.format(keyspace=keyspace))
+    session.set_keyspace(keyspace)
+
+
+def create_tables(session, tables):
+    """Creates the query tables that don't exist yet.
+
+    :param session: cassandra.cluster.Session, or another session backend
+    :param tables: list[str]
+    """
+    for table in tables:
+        session.execute(QUERY_TABLES[table].create)
+
+
+def new_batch(session):
+    """Returns an empty UNLOGGED batch for a session. Session backends that
+    aren't driver sessions, like `fake_cassandra.FakeSession`, make their own.
+
+    :param session: cassandra.cluster.Session, or another session backend
+    """
+    if hasattr(session, "new_batch"):
+        return session.new_batch()
+    return BatchStatement(batch_type=BatchType.UNLOGGED)
+
+
+def prepare_inserts(session, tables):
+    """Prepares the INSERT of each table once, so Cassandra doesn't parse the
+    statement again for every row.
+
+    Returns a dict of table -> PreparedStatement.
+
+    :param session: cassandra.cluster.Session, or another session backend
+    :param tables: list[str]
+    """
+    return {table: session.prepare(QUERY_TABLES[table].insert) for table in tables}
+
+
+def read_events(lines, tables, metrics):
+    """Yields every line converted to an `Event`. Lines that can't be converted
+    are counted as an error of each of `tables`, since none of them gets the
+    row, and skipped.
+
+    :param lines: Iterable[dict]
+    :param tables: list[str]
+    :param metrics: WriteMetrics
+    """
+    for line in lines:
+        try:
+            yield parse_event(line)
+        # decimal.InvalidOperation is an ArithmeticError
+        except (KeyError, ValueError, ArithmeticError) as e:
+            for table in tables:
+                metrics.record_error(table, e)
+
+
+def fan_out(events, statements, pending):
+    """Yields a (statement, values) write for every table, for every event.
+
+    The (table, rows) of each write is appended to `pending` as it's yielded,
+    so the results, which come back in the same order, can be matched to their
+    table.
+
+    :param events: Iterable[Event]
+    :param statements: dict - table -> PreparedStatement of its INSERT
+    :param pending: collections.deque
+    """
+    writers = [
+        (table, statement, QUERY_TABLES[table].values)
+        for table, statement in statements.items()
+    ]
+    for event in events:
+        for table, statement, values in writers:
+            pending.append((table, 1))
+            yield statement, values(event)
+
+
+def fan_out_batches(session, events, statements, pending, batch_size, batch_window):
+    """Batched version of `fan_out`: yields (UNLOGGED batch, None) writes of up
+    to `batch_size` rows of the same table and partition.
+
+    :param session: cassandra.cluster.Session, or another session backend
+    :param events: Iterable[Event]
+    :param statements: dict - table -> PreparedStatement of its INSERT
+    :param pending: collections.deque
+    :param batch_size: int - max rows per batch
+    :param batch_window: int - rows of a table held while grouping them by
+        partition
+    """
+    writers = [
+        (
+            PartitionBatcher(table, statement, batch_size, batch_window),
+            QUERY_TABLES[table].values,
+            QUERY_TABLES[table].partition_key,
+        )
+        for table, statement in statements.items()
+    ]
+
+    def batch_writes(batches):
+        for batch in batches:
+            pending.append((batch.table, len(batch)))
+            yield batch.to_statement(new_batch(session)), None
+
+    for event in events:
+        for batcher, values, partition_key in writers:
+            yield from batch_writes(batcher.add(partition_key(event), values(event)))
+
+    for batcher, _, _ in writers:
+        yield from batch_writes(batcher.flush())
+
+
+def write_sync(session, writes, pending, metrics):
+    """Runs writes one at a time, each waiting for its own round trip, like the
+    notebook does. Only there as a baseline for the benchmark.
+
+    :param session: cassandra.cluster.Session, or another session backend
+    :param writes: Iterable[tuple] - (statement, values)
+    :param pending: collections.deque - filled in by `writes`
+    :param metrics: WriteMetrics
+    """
+    for statement, values in writes:
+        table, rows = pending.popleft()
+        try:
+            session.execute(statement, values)
+        except Exception as e:
+            metrics.record_error(table, e, rows)
+        else:
+            metrics.record_write(table, rows)
+
+
+def write_concurrently(session, writes, pending, concurrency, metrics):
+    """Runs writes with up to `concurrency` of them in flight at once.
+
+    :param session: cassandra.cluster.Session, or another session backend
+    :param writes: Iterable[tuple] - (statement, values)
+    :param pending: collections.deque - filled in by `writes`
+    :param concurrency: int
+    :param metrics: WriteMetrics
+    """
+    results = execute_concurrent(
+        session,
+        writes,
+        concurrency=concurrency,
+        raise_on_first_error=False,
+        results_generator=True,
+    )
+    for success, result_or_error in results:
+        table, rows = pending.popleft()
+        metrics.record_result(table, success, result_or_error, rows)
+
+
+def load_events(
+    session,
+    statements,
+    events,
+    concurrency,
+    metrics,
+    write_mode="concurrent",
+    batch_size=DEFAULT_BATCH_SIZE,
+    batch_window=DEFAULT_BATCH_WINDOW,
+):
+    """Writes every event into every table of `statements` in a single pass,
+    keeping up to `concurrency` writes in flight instead of waiting for each
+    one's round trip.
+
+    With the "batched" write mode, each write is a single partition UNLOGGED
+    batch of rows instead of a single row. The "sync" write mode waits for every
+    write before sending the next one.
+
+    Failed writes are counted in `metrics`, they don't stop the load. A failed
+    batch counts an error for each of its rows.
+
+    :param session: cassandra.cluster.Session, or another session backend
+    :param statements: dict - table -> PreparedStatement of its INSERT
+    :param events: Iterable[Event]
+    :param concurrency: int - max writes in flight
+    :param metrics: WriteMetrics
+    :param write_mode: str - sync | concurrent | batched
+    :param batch_size: int - max rows per batch
+    :param batch_window: int - rows of a table held while grouping them by
+        partition
+    """
+    pending = deque()
+    if write_mode == "batched":
+        writes = fan_out_batches(
+            session, events, statements, pending, batch_size, batch_window
+        )
+    else:
+        writes = fan_out(events, statements, pending)
+
+    with metrics.time_tables(statements):
+        if write_mode == "sync":
+            write_sync(session, writes, pending, metrics)
+        else:
+            write_concurrently(session, writes, pending, concurrency, metrics)
+
+
+def prepare_session(session, keyspace, tables):
+    """Creates the keyspace and the query tables if needed, and prepares their
+    INSERTs.
+
+    Returns a dict of table -> PreparedStatement.
+
+    :param session: cassandra.cluster.Session, or another session backend
+    :param keyspace: str
+    :param tables: list[str]
+    """
+    create_keyspace(session, keyspace)
+    create_tables(session, tables)
+    return prepare_inserts(session, tables)
+
+
+def main(
+    hosts="127.0.0.1",
+    port=9042,
+    keyspace="sparkify",
+    event_dir=DEFAULT_EVENT_DIR,
+    event_file=None,
+    write_merged_file=None,
+    tables=None,
+    concurrency=DEFAULT_CONCURRENCY,
+    write_mode="concurrent",
+    batch_size=DEFAULT_BATCH_SIZE,
+    batch_window=DEFAULT_BATCH_WINDOW,
+    backend="cassandra",
+    fake_latency_ms=0.0,
+):
+    """Creates the keyspace and query tables and loads the events into them.
+
+    Events are streamed straight from the source CSVs in `event_dir`, unless
+    `event_file` points at an already merged file.
+
+    :param hosts: str - comma separated contact points
+    :param port: int
+    :param keyspace: str
+    :param event_dir: str - directory of the source event CSVs
+    :param event_file: str - optional, a merged event data CSV to load instead
+    :param write_merged_file: str - optional, also write the streamed events to
+        this merged event data CSV
+    :param tables: str - optional, comma separated tables to load, defaults to
+        every query table
+    :param concurrency: int - max writes in flight
+    :param write_mode: str - sync | concurrent | batched
+    :param batch_size: int - max rows per batch, batched write mode only
+    :param batch_window: int - rows of a table held while grouping them by
+        partition, batched write mode only
+    :param backend: str - cassandra | fake (in memory, see `fake_cassandra`)
+    :param fake_latency_ms: float - per request latency of the fake backend
+    """
+    tables = tables.split(",") if tables else list(QUERY_TABLES)
+    unknown = set(tables) - set(QUERY_TABLES)
+    if unknown:
+        raise ValueError(f"Unknown tables: {', '.join(sorted(unknown))}")
+
+    if backend == "fake":
+        session = FakeSession(latency=fake_latency_ms / 1000)
+        shutdown = session.shutdown
+    else:
+        cluster, session = connect(hosts.split(","), port)
+        shutdown = cluster.shutdown
+    metrics = WriteMetrics()
+    start = time.perf_counter()
+
+    try:
+        statements = prepare_session(session, keyspace, tables)
+
+        if event_file:
+            source = event_file
+            lines = read_event_lines(event_file)
+            if write_merged_file:
+                logging.warning("--write-merged is ignored with --event-file")
+        else:
+            source = event_dir
+            lines = stream_event_rows(get_event_files(event_dir))
+            if write_merged_file:
+                lines = write_merged(lines, write_merged_file)
+
+        logging.info(f"Loading {', '.join(tables)} from {source}")
+        events = read_events(lines, tables, metrics)
+        load_events(
+            session,
+            statements,
+            events,
+            concurrency,
+            metrics,
+            write_mode,
+            batch_size,
+            batch_window,
+        )
+    finally:
+        shutdown()
+
+    logging.info(f"Load finished in {time.perf_counter() - start:.2f}s")
+    metrics.log_summary()
+
+
+def get_opt_parser():
+    """
+    Returns an option parser instance for the loader's command line options.
+    """
+    optparser = optparse.OptionParser()
+    optparser.add_option(
+        "--hosts",
+        dest="hosts",
+        default="127.0.0.1",
+        help="Comma separated Cassandra contact points (default: 127.0.0.1)",
+    )
+    optparser.add_option(
+        "--port",
+        dest="port",
+        type="int",
+        default=9042,
+        help="Cassandra native protocol port (default: 9042)",
+    )
+    optparser.add_option(
+        "--keyspace",
+        dest="keyspace",
+        default="sparkify",
+        help="Keyspace to create and load (default: sparkify)",
+    )
+    optparser.add_option(
+        "--event-dir",
+        dest="event_dir",
+        default=DEFAULT_EVENT_DIR,
+        help=f"Directory of the source event CSVs (default: {DEFAULT_EVENT_DIR})",
+    )
+    optparser.add_option(
+        "--event-file",
+        dest="event_file",
+        help="Load an already merged event data CSV (e.g. the notebook's "
+        "event_datafile_new.csv) instead of the source CSVs",
+    )
+    optparser.add_option(
+        "--write-merged",
+        dest="write_merged_file",
+        help="Also write the streamed events to this merged event data CSV",
+    )
+    optparser.add_option(
+        "--tables",
+        dest="tables",
+        help="Comma separated query tables to load. Defaults to all of: "
+        + " | ".join(QUERY_TABLES),
+    )
+    optparser.add_option(
+        "--concurrency",
+        dest="concurrency",
+        type="int",
+        default=DEFAULT_CONCURRENCY,
+        help=f"Max writes in flight at once (default: {DEFAULT_CONCURRENCY})",
+    )
+    optparser.add_option(
+        "--write-mode",
+        dest="write_mode",
+        type="choice",
+        choices=WRITE_MODES,
+        default="concurrent",
+        help="How rows are written. One of: sync (one request at a time) | "
+        "concurrent (a request per row) | batched (single partition UNLOGGED "
+        "batches)",
+    )
+    optparser.add_option(
+        "--batch-size",
+        dest="batch_size",
+        type="int",
+        default=DEFAULT_BATCH_SIZE,
+        help="Max rows per batch with --write-mode batched "
+        f"(default: {DEFAULT_BATCH_SIZE})",
+    )
+    optparser.add_option(
+        "--batch-window",
+        dest="batch_window",
+        type="int",
+        default=DEFAULT_BATCH_WINDOW,
+        help="Rows of each table held while grouping them by partition, with "
+        f"--write-mode batched (default: {DEFAULT_BATCH_WINDOW})",
+    )
+    optparser.add_option(
+        "--backend",
+        dest="backend",
+        type="choice",
+        choices=["cassandra", "fake"],
+        default="cassandra",
+        help="Where rows are written. One of: cassandra | fake (in memory, no "
+        "server needed)",
+    )
+    optparser.add_option(
+        "--fake-latency-ms",
+        dest="fake_latency_ms",
+        type="float",
+        default=0.0,
+        help="Latency of every request to the fake backend, in ms (default: 0)",
+    )
+    return optparser
+
+
+if __name__ == "__main__":
+    options, args = get_opt_parser().parse_args()
+    main(**vars(options))
@@ -0,0 +1,105 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from log import config_log
+
+logging = config_log()
+
+
+class WriteMetrics:
+    """Collects write and error counts and write timings per table, for a single
+    load."""
+
+    def __init__(self):
+        self.writes = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.seconds = defaultdict(float)
+        self.first_errors = {}
+
+    def record_write(self, table, rows=1):
+        """Counts rows successfully written to `table`.
+
+        :param table: str
+        :param rows: int
+
+        """
+        self.writes[table] += rows
+
+    def record_error(self, table, error, rows=1):
+        """Counts rows that failed to be written to `table`. The first error of
+        each table is kept for the summary.
+
+        :param table: str
+        :param error: Exception
+        :param rows: int
+
+        """
+        self.errors[table] += rows
+        self.first_errors.setdefault(table, f"{type(error).__name__}: {error}")
+
+    def record_result(self, table, success, result_or_error, rows=1):
+        """Counts the outcome of one write request, as returned by the driver's
+        concurrent execution.
+
+        :param table: str
+        :param success: bool
+        :param result_or_error: the result, or the Exception if it failed
+        :param rows: int - rows written by the request, more than 1 for batches
+
+        """
+        if success:
+            self.record_write(table, rows)
+        else:
+            self.record_error(table, result_or_error, rows)
+
+    @contextmanager
+    def time_tables(self, tables):
+        """Context manager that adds the time the wrapped block took to every one
+        of `tables`.
+
+        :param tables: Iterable[str]
+
+        """
+        start = time.perf_counter()
+        yield
+        elapsed = time.perf_counter() - start
+        for table in tables:
+            self.seconds[table] += elapsed
+
+    def tables(self):
+        """Returns every table something was recorded for, in order."""
+        return sorted(set(self.writes) | set(self.errors) | set(self.seconds))
+
+    def writes_per_second(self, table):
+        """Returns the write throughput for a table, 0 if nothing was timed.
+
+        :param table: str
+
+        """
+        seconds = self.seconds.get(table, 0.0)
+        return self.writes.get(table, 0) / seconds if seconds else 0.0
+
+    def to_dict(self):
+        """Returns the metrics as plain data, e.g. for JSON output."""
+        return {
+            table: {
+                "writes": self.writes.get(table, 0),
+                "errors": self.errors.get(table, 0),
+                "seconds": self.seconds.get(table, 0.0),
+                "writes_per_second": self.writes_per_second(table),
+            }
+            for table in self.tables()
+        }
+
+    def log_summary(self):
+        """Logs writes/sec and errors for every table."""
+        for table in self.tables():
+            logging.info(
+                f"{table}: {self.writes.get(table, 0)} writes in "
+                f"{self.seconds.get(table, 0.0):.2f}s "
+                f"({self.writes_per_second(table):.0f} writes/s), "
+                f"{self.errors.get(table, 0)} errors"
+            )
+            if table in self.first_errors:
+                logging.warning(f"{table}: first error: {self.first_errors[table]}")
@@ -0,0 +1,82 @@
+import pytest
+
+from batching import CrossPartitionBatchError, PartitionBatch, PartitionBatcher
+
+
+class RecordingBatch:
+    def __init__(self):
+        self.added = []
+
+    def add(self, statement, values):
+        self.added.append((statement, values))
+
+
+def test_partition_batch_rejects_rows_of_another_partition():
+    batch = PartitionBatch("session_items", "INSERT", key=338)
+    batch.add(338, (338, 0))
+
+    with pytest.raises(CrossPartitionBatchError, match="session_items"):
+        batch.add(339, (339, 0))
+    assert batch.rows == [(338, 0)]
+
+
+def test_partition_batch_to_statement_binds_every_row():
+    batch = PartitionBatch("session_items", "INSERT", key=338)
+    batch.add(338, (338, 0))
+    batch.add(338, (338, 1))
+
+    statement = batch.to_statement(RecordingBatch())
+
+    assert statement.added == [("INSERT", (338, 0)), ("INSERT", (338, 1))]
+
+
+def test_full_batches_go_out_as_soon_as_they_are_full():
+    batcher = PartitionBatcher("session_items", "INSERT", max_size=2, window=100)
+
+    assert batcher.add(1, ("a",)) == []
+    assert batcher.add(2, ("b",)) == []
+    (full,) = batcher.add(1, ("c",))
+
+    assert (full.key, full.rows) == (1, [("a",), ("c",)])
+    assert batcher.held == 1
+    assert list(batcher.batches) == [2]
+
+
+def test_every_batch_goes_out_when_the_window_is_over():
+    batcher = PartitionBatcher("session_items", "INSERT", max_size=10, window=3)
+
+    batcher.add(1, ("a",))
+    batcher.add(2, ("b",))
+    batches = batcher.add(1, ("c",))
+
+    assert [(batch.key, len(batch)) for batch in batches] == [(1, 2), (2, 1)]
+    assert batcher.held == 0
+    assert batcher.batches == {}
+
+
+def test_flush_returns_what_is_held_and_empties_the_batcher():
+    batcher = PartitionBatcher("users_by_song", "INSERT", max_size=10, window=100)
+    batcher.add("Silhouette", ("Silhouette", 10))
+    batcher.add(("tuple", "key"), ("other", 11))
+
+    batches = batcher.flush()
+
+    assert [batch.key for batch in batches] == ["Silhouette", ("tuple", "key")]
+    assert batcher.flush() == []
+    assert batcher.held == 0
+
+
+def test_batches_never_mix_partitions():
+    batcher = PartitionBatcher("session_items", "INSERT", max_size=3, window=7)
+    keys = [1, 2, 1, 3, 1, 2, 2, 2, 3, 1, 1]
+    batches = []
+    for i, key in enumerate(keys):
+        batches += batcher.add(key, (key, i))
+    batches += batcher.flush()
+
+    for batch in batches:
+        assert 0 < len(batch) <= 3
+        assert all(values[0] == batch.key for values in batch.rows)
+    # every row goes out exactly once
+    written = sorted(values for batch in batches for values in batch.rows)
+    assert written == sorted((key, i) for i, key in enumerate(keys))
@@ -0,0 +1,117 @@
+import csv
+
+from events import EVENT_COLUMNS, read_event_lines, stream_event_rows, write_merged
+
+SOURCE_HEADER = [
+    "artist",
+    "auth",
+    "firstName",
+    "gender",
+    "itemInSession",
+    "lastName",
+    "length",
+    "level",
+    "location",
+    "method",
+    "page",
+    "registration",
+    "sessionId",
+    "song",
+    "status",
+    "ts",
+    "userId",
+]
+
+
+def source_row(artist, song, session_id, item_in_session, user_id="10"):
+    values = {
+        "artist": artist,
+        "auth": "Logged In",
+        "firstName": "Sylvie",
+        "gender": "F",
+        "itemInSession": item_in_session,
+        "lastName": "Cruz",
+        "length": "333.7659" if artist else "",
+        "level": "free",
+        "location": "Washington-Arlington-Alexandria, DC-VA-MD-WV",
+        "method": "PUT" if artist else "GET",
+        "page": "NextSong" if artist else "Home",
+        "registration": "1.54027E+12",
+        "sessionId": session_id,
+        "song": song,
+        "status": "200",
+        "ts": "1.54129E+12",
+        "userId": user_id,
+    }
+    return [values[column] for column in SOURCE_HEADER]
+
+
+def write_source(path, rows, header=SOURCE_HEADER):
+    with open(path, "w", encoding="utf8", newline="") as f:
+        writer = csv.writer(f)
+        if header:
+            writer.writerow(header)
+        writer.writerows(rows)
+    return str(path)
+
+
+def test_rows_are_projected_to_the_event_columns(tmp_path):
+    path = write_source(
+        tmp_path / "01.csv", [source_row("Faithless", "Music Matters", "338", "4")]
+    )
+
+    (row,) = stream_event_rows([path])
+
+    assert list(row) == EVENT_COLUMNS
+    assert row["artist"] == "Faithless"
+    assert row["song"] == "Music Matters"
+    assert (row["sessionId"], row["itemInSession"]) == ("338", "4")
+    assert row["length"] == "333.7659"
+    assert "page" not in row and "ts" not in row
+
+
+def test_events_without_an_artist_are_dropped(tmp_path):
+    path = write_source(
+        tmp_path / "01.csv",
+        [
+            source_row("", "", "154", "0"),
+            source_row("Faithless", "Music Matters", "338", "4"),
+            [],
+        ],
+    )
+
+    assert [row["artist"] for row in stream_event_rows([path])] == ["Faithless"]
+
+
+def test_files_are_read_in_order_and_found_by_header(tmp_path):
+    # columns in another order than the other file, and an empty file
+    reordered = list(reversed(SOURCE_HEADER))
+    first = write_source(tmp_path / "01.csv", [source_row("A", "One", "1", "0")])
+    empty = write_source(tmp_path / "02.csv", [], header=None)
+    second = write_source(
+        tmp_path / "03.csv",
+        [list(reversed(source_row("B", "Two", "2", "1")))],
+        header=reordered,
+    )
+
+    rows = list(stream_event_rows([first, empty, second]))
+
+    assert [(row["artist"], row["song"], row["sessionId"]) for row in rows] == [
+        ("A", "One", "1"),
+        ("B", "Two", "2"),
+    ]
+
+
+def test_written_merged_file_reads_back_the_same_rows(tmp_path):
+    path = write_source(
+        tmp_path / "01.csv",
+        [
+            source_row("Faithless", "Music Matters", "338", "4"),
+            source_row("Kenny G", "Silhouette", "338", "5"),
+        ],
+    )
+    merged = str(tmp_path / "event_datafile_new.csv")
+
+    passed_through = list(write_merged(stream_event_rows([path]), merged))
+
+    assert [dict(row) for row in read_event_lines(merged)] == passed_through
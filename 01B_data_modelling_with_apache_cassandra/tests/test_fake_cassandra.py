@@ -0,0 +1,105 @@
+from decimal import Decimal
+
+import pytest
+
+import loader
+from cql_queries import (
+    session_item_select,
+    song_users_select,
+    user_session_songs_select,
+)
+from fake_cassandra import FakeSession, InvalidRequest
+from metrics import WriteMetrics
+
+
+def event(user_id, first_name, session_id, item_in_session, artist, song, length):
+    return loader.Event(
+        artist=artist,
+        first_name=first_name,
+        gender="F",
+        item_in_session=item_in_session,
+        last_name="Lynch",
+        length=Decimal(length),
+        level="paid",
+        location="Atlanta-Sandy Springs-Roswell, GA",
+        session_id=session_id,
+        song=song,
+        user_id=user_id,
+    )
+
+
+EVENTS = [
+    event(10, "Sylvie", 182, 1, "Three Drives", "Greece 2000", "411.6371"),
+    event(10, "Sylvie", 182, 0, "Down To The Bone", "Keep On Keepin' On", "333.7659"),
+    event(10, "Sylvie", 183, 0, "Faithless", "Music Matters", "495.3073"),
+    # played again: a new session item, but the same users_by_song row
+    event(10, "Sylvie", 183, 1, "Three Drives", "Greece 2000", "411.6371"),
+    event(29, "Jacqueline", 338, 4, "Faithless", "Music Matters", "495.3073"),
+    event(29, "Jacqueline", 338, 5, "Kenny G", "Silhouette", "311.6583"),
+    event(80, "Tegan", 611, 2, "The Black Keys", "All Hands Against His Own", "185.5"),
+    event(29, "Jacqueline", 339, 0, "The Black Keys", "All Hands Against His Own", "1"),
+]
+
+
+@pytest.fixture(params=loader.WRITE_MODES)
+def session(request):
+    """A fake session with `EVENTS` loaded by one of the write modes."""
+    session = FakeSession()
+    tables = list(loader.QUERY_TABLES)
+    metrics = WriteMetrics()
+    statements = loader.prepare_session(session, "sparkify", tables)
+    loader.load_events(
+        session, statements, iter(EVENTS), 4, metrics, request.param, 2, 5
+    )
+    assert not metrics.errors
+    yield session
+    session.shutdown()
+
+
+def test_song_by_session_and_item(session):
+    rows = session.execute(session_item_select, (338, 4))
+
+    assert [tuple(row) for row in rows] == [
+        ("Faithless", "Music Matters", Decimal("495.3073"))
+    ]
+    assert rows[0].song_title == "Music Matters"
+    assert session.execute(session_item_select, (338, 6)).one() is None
+
+
+def test_songs_of_a_user_session_in_item_order(session):
+    rows = session.execute(user_session_songs_select, (10, 182))
+
+    assert [(row.item_in_session, row.artist, row.song_title) for row in rows] == [
+        (0, "Down To The Bone", "Keep On Keepin' On"),
+        (1, "Three Drives", "Greece 2000"),
+    ]
+    assert {row.user_first_name for row in rows} == {"Sylvie"}
+
+
+def test_users_who_listened_to_a_song(session):
+    rows = session.execute(song_users_select, ("All Hands Against His Own",))
+
+    # one row per user, however often they played it, in user_id order
+    assert [(row.user_id, row.user_first_name) for row in rows] == [
+        (29, "Jacqueline"),
+        (80, "Tegan"),
+    ]
+
+
+def test_rows_are_upserted_by_primary_key(session):
+    assert session.row_count("session_items") == len(EVENTS)
+    assert session.row_count("users_by_song") == len(EVENTS) - 1
+
+
+def test_selects_must_restrict_the_partition_key():
+    session = FakeSession()
+    try:
+        session.execute(loader.QUERY_TABLES["session_items"].create)
+        with pytest.raises(InvalidRequest, match="partition key"):
+            session.execute("SELECT * FROM session_items WHERE item_in_session = 4")
+        with pytest.raises(InvalidRequest, match="prefix"):
+            session.execute(
+                "SELECT * FROM session_items WHERE session_id = 1 AND artist = 'x'"
+            )
+    finally:
+        session.shutdown()
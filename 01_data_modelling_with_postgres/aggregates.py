@@ -0,0 +1,133 @@
+import optparse
+import time
+
+import db
+from log import config_log
+from metrics import run_metrics
+from sql_queries import (aggregate_refresh_queries, aggregate_watermark_select,
+                         aggregate_watermark_update, songplay_max_id_select,
+                         top_artists_select, top_songs_select)
+
+logging = config_log()
+
+
+def refresh_aggregates(cur):
+    """Folds the songplays inserted since the last refresh into the aggregate
+    tables, and moves the watermark past them. Doesn't commit.
+
+    Only run this once loading has committed: `songplay_id`s are handed out
+    when rows are inserted, so while several loaders are still writing a lower
+    id can show up after a higher one has been refreshed.
+
+    Returns the (low, high) songplay_id window that was folded in, low
+    exclusive. Nothing was new if they're equal.
+
+    :param cur: psycopg2 cursor
+    """
+    cur.execute(aggregate_watermark_select)
+    (low,) = cur.fetchone()
+    cur.execute(songplay_max_id_select)
+    (high,) = cur.fetchone()
+
+    if high <= low:
+        return low, low
+
+    window = {"low": low, "high": high}
+    with run_metrics.time_stage("refresh_aggregates"):
+        for table, query in aggregate_refresh_queries:
+            start = time.perf_counter()
+            cur.execute(query, window)
+            run_metrics.record_load(table, cur.rowcount, time.perf_counter() - start)
+        cur.execute(aggregate_watermark_update, {"high": high})
+
+    return low, high
+
+
+def rebuild_aggregates(cur):
+    """Empties the aggregate tables and refreshes them from every songplay.
+    Doesn't commit.
+
+    Returns the (low, high) songplay_id window that was folded in.
+
+    :param cur: psycopg2 cursor
+    """
+    cur.execute(aggregate_watermark_select)
+    cur.execute(
+        f"TRUNCATE {', '.join(table for table, _ in aggregate_refresh_queries)}"
+    )
+    cur.execute(aggregate_watermark_update, {"high": 0})
+    return refresh_aggregates(cur)
+
+
+def log_refresh(low, high):
+    """Logs the songplay_id window a refresh folded in.
+
+    :param low: int - exclusive
+    :param high: int - inclusive
+    """
+    if high > low:
+        logging.info(f"Aggregates refreshed with songplay ids {low + 1}-{high}")
+    else:
+        logging.info("Aggregates are up to date")
+
+
+def log_top_plays(cur, limit):
+    """Logs the most played songs and artists.
+
+    :param cur: psycopg2 cursor
+    :param limit: int
+    """
+    cur.execute(top_songs_select, [limit])
+    for rank, (title, artist, plays) in enumerate(cur.fetchall(), 1):
+        logging.info(f"Top song {rank}: {title} by {artist}, {plays} plays")
+
+    cur.execute(top_artists_select, [limit])
+    for rank, (artist, plays) in enumerate(cur.fetchall(), 1):
+        logging.info(f"Top artist {rank}: {artist}, {plays} plays")
+
+
+def main(rebuild=False, top=0):
+    """Refreshes (or rebuilds) the aggregate tables and commits.
+
+    :param rebuild: bool - recompute from every songplay instead of only the new
+        ones
+    :param top: int - log this many top songs and artists afterwards
+    """
+    with db.connection() as conn:
+        cur = conn.cursor()
+        low, high = rebuild_aggregates(cur) if rebuild else refresh_aggregates(cur)
+        conn.commit()
+        log_refresh(low, high)
+
+        if top:
+            log_top_plays(cur, top)
+
+    db.close_pool()
+
+
+def get_opt_parser():
+    """
+    Returns an option parser instance for the aggregate refresh's command line
+    options.
+    """
+    optparser = optparse.OptionParser()
+    optparser.add_option(
+        "--rebuild",
+        dest="rebuild",
+        action="store_true",
+        default=False,
+        help="Recompute the aggregates from every songplay",
+    )
+    optparser.add_option(
+        "--top",
+        dest="top",
+        type="int",
+        default=0,
+        help="Log this many of the most played songs and artists",
+    )
+    return optparser
+
+
+if __name__ == "__main__":
+    options, args = get_opt_parser().parse_args()
+    main(**vars(options))
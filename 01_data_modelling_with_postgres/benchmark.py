@@ -0,0 +1,244 @@
+import json
+import optparse
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import time
+
+import db
+import generate_data
+from log import config_log
+from sql_queries import loaded_tables, table_rows_select
+
+logging = config_log()
+
+# Allowed drop in rows/sec against a baseline before it counts as a regression
+DEFAULT_TOLERANCE = 0.1
+
+
+def run_script(*args):
+    """Runs one of this project's scripts with the current interpreter.
+
+    :param args: str - script name and its arguments
+    """
+    subprocess.run([sys.executable, *args], check=True)
+
+
+def count_loaded_rows(cur):
+    """Returns the number of rows in each table the ETL loads.
+
+    The run metrics can't be compared across load modes for this: row and
+    copy modes count the rows they send, sql mode the rows Postgres inserted.
+
+    :param cur: psycopg2 cursor
+    """
+    counts = {}
+    for table in loaded_tables:
+        cur.execute(table_rows_select.format(table=table))
+        (counts[table],) = cur.fetchone()
+    return counts
+
+
+def run_scale_point(scale, work_path, match_rate, seed, etl_args):
+    """Generates data at a scale, resets the DB and times a full `etl.py` run
+    against it.
+
+    `etl.py` runs in its own process so its peak memory is its own.
+
+    Returns a dict of results for the scale point.
+
+    :param scale: float
+    :param work_path: str - directory for generated data and metrics files
+    :param match_rate: float - share of "NextSong" events that match a song
+    :param seed: int
+    :param etl_args: list[str] - extra `etl.py` arguments, e.g. a load mode
+    """
+    data_path = os.path.join(work_path, f"scale_{scale:g}")
+    metrics_path = os.path.join(work_path, f"scale_{scale:g}_metrics.json")
+    shutil.rmtree(data_path, ignore_errors=True)
+    sizes = generate_data.generate(data_path, scale, match_rate, seed)
+
+    run_script("create_tables.py")
+
+    start = time.perf_counter()
+    run_script(
+        "etl.py",
+        "--data-path",
+        data_path,
+        "--metrics-json",
+        metrics_path,
+        *etl_args,
+    )
+    wall_seconds = time.perf_counter() - start
+
+    with open(metrics_path, encoding="utf8") as f:
+        metrics = json.load(f)
+    with db.connection() as conn:
+        stored_rows = count_loaded_rows(conn.cursor())
+    # `create_tables.py` drops the database for the next point
+    db.close_pool()
+    rows = sum(stored_rows.values())
+
+    return {
+        "scale": scale,
+        "etl_args": shlex.join(etl_args),
+        **sizes,
+        "wall_seconds": wall_seconds,
+        "rows": rows,
+        "stored_rows": stored_rows,
+        "rows_per_second": rows / wall_seconds,
+        "peak_memory_mb": metrics["peak_memory_mb"],
+        "tables": {
+            name: table["rows_per_second"] for name, table in metrics["tables"].items()
+        },
+    }
+
+
+def find_regressions(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Compares overall rows/sec per scale point against a baseline run.
+
+    Points are matched on scale and `etl.py` arguments. Returns a list of
+    (scale, etl args, baseline rows/sec, rows/sec) for every scale point that got
+    slower by more than `tolerance`.
+
+    :param results: list[dict] - from `run_scale_point`
+    :param baseline: list[dict] - results of an earlier benchmark
+    :param tolerance: float - allowed relative drop, e.g. 0.1 for 10%
+    """
+    baseline_by_point = {
+        (point["scale"], point.get("etl_args", "")): point for point in baseline
+    }
+    regressions = []
+    for point in results:
+        before = baseline_by_point.get((point["scale"], point["etl_args"]))
+        if before and point["rows_per_second"] < before["rows_per_second"] * (
+            1 - tolerance
+        ):
+            regressions.append(
+                (
+                    point["scale"],
+                    point["etl_args"],
+                    before["rows_per_second"],
+                    point["rows_per_second"],
+                )
+            )
+    return regressions
+
+
+def log_results(results):
+    """Logs one line per scale point.
+
+    :param results: list[dict] - from `run_scale_point`
+    """
+    for point in results:
+        logging.info(
+            f"scale {point['scale']:g} [{point['etl_args'] or 'defaults'}]: "
+            f"{point['songs']} songs, "
+            f"{point['events']} events, {point['wall_seconds']:.2f}s, "
+            f"{point['rows_per_second']:.0f} rows/sec, "
+            f"peak {point['peak_memory_mb']:.1f} MB"
+        )
+
+
+def main(scales, work_path, match_rate, seed, etl_args, output, baseline, tolerance):
+    """Runs the benchmark for every scale point, once per set of `etl.py`
+    arguments, and writes the results.
+
+    Exits with status 1 if a baseline was given and throughput regressed.
+    """
+    results = [
+        run_scale_point(scale, work_path, match_rate, seed, args)
+        for scale in scales
+        for args in etl_args
+    ]
+    log_results(results)
+
+    with open(output, "w", encoding="utf8") as f:
+        json.dump(results, f, indent=2)
+    logging.info(f"Results written to {output}")
+
+    if baseline:
+        with open(baseline, encoding="utf8") as f:
+            regressions = find_regressions(results, json.load(f), tolerance)
+        for scale, args, before, after in regressions:
+            logging.error(
+                f"scale {scale:g} [{args or 'defaults'}] regressed: "
+                f"{before:.0f} -> {after:.0f} rows/sec"
+            )
+        if regressions:
+            sys.exit(1)
+
+
+def get_opt_parser():
+    """
+    Returns an option parser instance for the benchmark's command line options.
+    """
+    optparser = optparse.OptionParser()
+    optparser.add_option(
+        "--scales",
+        dest="scales",
+        default="1,10,100",
+        help="Comma separated scale points, 1 is the sample data size "
+        "(default: 1,10,100)",
+    )
+    optparser.add_option(
+        "--work-path",
+        dest="work_path",
+        default="benchmark_data",
+        help="Where generated data and metrics go (default: benchmark_data)",
+    )
+    optparser.add_option(
+        "--match-rate",
+        dest="match_rate",
+        type="float",
+        default=0.5,
+        help="Share of NextSong events that match a generated song (default: 0.5)",
+    )
+    optparser.add_option(
+        "--seed", dest="seed", type="int", default=0, help="Random seed (default: 0)"
+    )
+    optparser.add_option(
+        "--etl-args",
+        dest="etl_args",
+        action="append",
+        default=None,
+        help='Extra etl.py arguments, e.g. "--load-mode copy --workers 4". Repeat '
+        "to benchmark several configurations against each other",
+    )
+    optparser.add_option(
+        "--output",
+        "-o",
+        dest="output",
+        default="benchmark_results.json",
+        help="Results file (default: benchmark_results.json)",
+    )
+    optparser.add_option(
+        "--baseline",
+        dest="baseline",
+        default=None,
+        help="Results file of an earlier run to check for regressions against",
+    )
+    optparser.add_option(
+        "--tolerance",
+        dest="tolerance",
+        type="float",
+        default=DEFAULT_TOLERANCE,
+        help="Allowed rows/sec drop against the baseline (default: 0.1)",
+    )
+    return optparser
+
+
+if __name__ == "__main__":
+    options, args = get_opt_parser().parse_args()
+    main(
+        [float(scale) for scale in options.scales.split(",")],
+        options.work_path,
+        options.match_rate,
+        options.seed,
+        [shlex.split(args) for args in options.etl_args or [""]],
+        options.output,
+        options.baseline,
+        options.tolerance,
+    )
@@ -0,0 +1,183 @@
+import io
+
+from psycopg2.extras import execute_values
+
+from metrics import run_metrics
+from sql_queries import (artist_staging_upsert, create_staging_table_queries,
+                         song_staging_upsert, songplay_staging_upsert,
+                         time_staging_upsert, user_staging_upsert)
+
+# Marker used for NULL in the CSV stream so empty strings stay empty strings.
+COPY_NULL = "\\N"
+
+
+def create_staging_tables(cursor):
+    """Creates the session-scoped temp tables used by the COPY load mode.
+
+    :param cursor: psycopg2 cursor
+
+    """
+    for query in create_staging_table_queries:
+        cursor.execute(query)
+
+
+def copy_dataframe(df, cursor, table, columns):
+    """Streams a dataframe into a table with `COPY FROM STDIN`.
+
+    The dataframe columns are matched to `columns` by position, so they must be
+    in the same order.
+
+    :param df: pd.DataFrame
+    :param cursor: psycopg2 cursor
+    :param table: str - table to copy into
+    :param columns: list[str] - target column names
+
+    """
+    buffer = io.StringIO()
+    df.to_csv(buffer, header=False, index=False, na_rep=COPY_NULL)
+    buffer.seek(0)
+
+    cursor.copy_expert(
+        f"COPY {table} ({', '.join(columns)}) "
+        f"FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')",
+        buffer,
+    )
+
+
+def dataframe_rows(df):
+    """Returns the rows of a dataframe as tuples, with NaN and similar as None.
+
+    :param df: pd.DataFrame
+
+    """
+    cleaned = df.astype(object).where(df.notnull(), None)
+    return list(cleaned.itertuples(index=False, name=None))
+
+
+def insert_dataframe(df, cursor, table, insert_query):
+    """Writes a whole dataframe with one multi-row INSERT.
+
+    Records the row count and time taken against `table` in the run metrics.
+
+    :param df: pd.DataFrame
+    :param cursor: psycopg2 cursor
+    :param table: str - table name, used for the metrics
+    :param insert_query: str - INSERT with a single `VALUES %s` placeholder
+
+    """
+    if df.empty:
+        return
+
+    rows = dataframe_rows(df)
+    with run_metrics.time_load(table, len(rows)):
+        execute_values(cursor, insert_query, rows, page_size=len(rows))
+
+
+def upsert_dataframe(df, cursor, table, columns, upsert_query):
+    """Copies a dataframe into `<table>_staging` and folds it into `table`.
+
+    The staging table is emptied afterwards, so it can be used several times in
+    one transaction (e.g. once per chunk of a file). Records the row count and
+    time taken against `table` in the run metrics.
+
+    :param df: pd.DataFrame
+    :param cursor: psycopg2 cursor
+    :param table: str - final table name
+    :param columns: list[str] - staging column names, in dataframe order
+    :param upsert_query: str - INSERT ... SELECT from the staging table
+
+    """
+    if df.empty:
+        return
+
+    staging_table = f"{table}_staging"
+    with run_metrics.time_load(table, len(df)):
+        copy_dataframe(df, cursor, staging_table, columns)
+        cursor.execute(upsert_query)
+        cursor.execute(f"TRUNCATE {staging_table}")
+
+
+def load_times(start_times, cursor):
+    """Bulk loads times from a single `startTime` column dataframe.
+
+    :param start_times: pd.DataFrame
+    :param cursor: psycopg2 cursor
+
+    """
+    upsert_dataframe(start_times, cursor, "times", ["start_time"], time_staging_upsert)
+
+
+def load_users(user_data, cursor):
+    """Bulk loads users. The latest event per user sets the `level`.
+
+    :param user_data: pd.DataFrame - userId, firstName, lastName, gender, level,
+        startTime
+    :param cursor: psycopg2 cursor
+
+    """
+    upsert_dataframe(
+        user_data,
+        cursor,
+        "users",
+        ["user_id", "first_name", "last_name", "gender", "level", "start_time"],
+        user_staging_upsert,
+    )
+
+
+def load_artists(artist_data, cursor):
+    """Bulk loads artists from songfile artist data.
+
+    :param artist_data: pd.DataFrame
+    :param cursor: psycopg2 cursor
+
+    """
+    upsert_dataframe(
+        artist_data,
+        cursor,
+        "artists",
+        ["artist_id", "name", "location", "latitude", "longitude"],
+        artist_staging_upsert,
+    )
+
+
+def load_songs(song_data, cursor):
+    """Bulk loads songs from songfile song data.
+
+    :param song_data: pd.DataFrame
+    :param cursor: psycopg2 cursor
+
+    """
+    upsert_dataframe(
+        song_data,
+        cursor,
+        "songs",
+        ["song_id", "title", "artist_id", "year", "duration"],
+        song_staging_upsert,
+    )
+
+
+def load_songplays(songplay_data, cursor):
+    """Bulk loads songplays, resolving song and artist ids inside Postgres.
+
+    :param songplay_data: pd.DataFrame - startTime, userId, level, song, artist,
+        length, sessionId, location, userAgent
+    :param cursor: psycopg2 cursor
+
+    """
+    upsert_dataframe(
+        songplay_data,
+        cursor,
+        "songplays",
+        [
+            "start_time",
+            "user_id",
+            "level",
+            "song",
+            "artist",
+            "length",
+            "session_id",
+            "location",
+            "user_agent",
+        ],
+        songplay_staging_upsert,
+    )
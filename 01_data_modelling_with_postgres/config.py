@@ -0,0 +1,148 @@
+import optparse
+
+
+def get_opt_parser():
+    """
+    Returns an option parser instance for command line options. Centralized here
+    for re-use.
+    """
+    optparser = optparse.OptionParser()
+    optparser.add_option(
+        "--load-mode",
+        "-m",
+        dest="load_mode",
+        type="choice",
+        choices=["row", "copy", "sql"],
+        default="row",
+        help="How rows are written to the DB. One of: row | copy | sql "
+        "(default: row)",
+    )
+    optparser.add_option(
+        "--song-batch-size",
+        "-b",
+        dest="song_batch_size",
+        type="int",
+        default=1,
+        help="Number of song files read, written and committed together (default: 1)",
+    )
+    optparser.add_option(
+        "--workers",
+        "-w",
+        dest="workers",
+        type="int",
+        default=1,
+        help="Number of worker processes to parse and load files with (default: 1)",
+    )
+    optparser.add_option(
+        "--full-refresh",
+        dest="full_refresh",
+        action="store_true",
+        default=False,
+        help="Reload every file, including ones already in the loaded_files manifest",
+    )
+    optparser.add_option(
+        "--log-chunk-size",
+        "-c",
+        dest="log_chunk_size",
+        type="int",
+        default=None,
+        help="Stream log files this many lines at a time to cap memory use",
+    )
+    optparser.add_option(
+        "--metrics-json",
+        dest="metrics_json",
+        default=None,
+        help="Write per-stage timings and per-table throughput to this JSON file",
+    )
+    optparser.add_option(
+        "--metrics-prometheus",
+        dest="metrics_prometheus",
+        default=None,
+        help="Write the same metrics to this Prometheus textfile (*.prom)",
+    )
+    optparser.add_option(
+        "--data-path",
+        "-d",
+        dest="data_path",
+        default="data",
+        help="Directory holding the song_data and log_data trees (default: data)",
+    )
+    optparser.add_option(
+        "--commit-every-files",
+        dest="commit_every_files",
+        type="int",
+        default=None,
+        help="Commit every N files instead of after every file (or song batch)",
+    )
+    optparser.add_option(
+        "--commit-every-rows",
+        dest="commit_every_rows",
+        type="int",
+        default=None,
+        help="Also commit once N rows have been written since the last commit",
+    )
+    optparser.add_option(
+        "--reject-file",
+        dest="reject_file",
+        default=None,
+        help="Write files that failed to load to this file, one per line",
+    )
+    optparser.add_option(
+        "--since",
+        dest="since",
+        default=None,
+        help="Only load log data from this day on, YYYY-MM-DD",
+    )
+    optparser.add_option(
+        "--until",
+        dest="until",
+        default=None,
+        help="Only load log data up to and including this day, YYYY-MM-DD",
+    )
+    optparser.add_option(
+        "--pipeline-depth",
+        dest="pipeline_depth",
+        type="int",
+        default=None,
+        help="Parse files while earlier ones are written, with up to N parsed "
+        "files queued for the writer",
+    )
+    optparser.add_option(
+        "--parse-workers",
+        dest="parse_workers",
+        type="int",
+        default=1,
+        help="Number of parser processes for --pipeline-depth (default: 1)",
+    )
+    optparser.add_option(
+        "--json-parser",
+        dest="json_parser",
+        type="choice",
+        choices=["pandas", "orjson", "pyarrow"],
+        default="pandas",
+        help="How JSON files are parsed. One of: pandas | orjson | pyarrow "
+        "(default: pandas)",
+    )
+    optparser.add_option(
+        "--parse-cache",
+        dest="parse_cache",
+        default=None,
+        help="Cache parsed JSON files as Feather files in this directory, keyed "
+        "by path, size and mtime",
+    )
+    optparser.add_option(
+        "--parse-cache-size",
+        dest="parse_cache_size",
+        type="int",
+        default=1024,
+        help="Parse cache size limit in MB, least recently used entries are "
+        "evicted first (default: 1024)",
+    )
+    optparser.add_option(
+        "--refresh-aggregates",
+        dest="refresh",
+        action="store_true",
+        default=False,
+        help="Fold the songplays loaded by this run into the aggregate tables",
+    )
+    return optparser
@@ -1,15 +1,25 @@
+import optparse
+import shlex
+import time
+
 import db
+import etl
+from config import get_opt_parser as get_etl_opt_parser
 from log import config_log
-from sql_queries import create_table_queries
+from sql_queries import (create_index_queries, create_table_queries,
+                         foreign_key_add, foreign_key_orphans_select,
+                         foreign_keys, songplay_duplicate_ids_select,
+                         songplay_primary_key_add)
 
 logging = config_log()
 
 
 def create_database():
     """
-    - Creates and connects to the sparkifydb
-    - Returns the connection and cursor to sparkifydb
+    - Drops (if exists) and creates the sparkifydb
     """
+    # pooled connections to sparkifydb would block the DROP
+    db.close_pool()
 
     # connect to default database
     conn = db.create_connection()
@@ -23,41 +33,158 @@ def create_database():
     # close connection to default database
     conn.close()
 
-    # connect to sparkify database
-    conn = db.create_db_connection()
-    cur = conn.cursor()
-
-    return cur, conn
-
 
 def create_tables(cur, conn):
     """
     Creates each table using the queries in `create_table_queries` list.
+    Primary keys the loaders upsert on are part of the tables, the rest of the
+    constraints and the lookup indexes are added by `add_constraints`.
     """
     for query in create_table_queries:
         cur.execute(query)
         conn.commit()
 
 
-def main():
+def find_constraint_violations(cur):
+    """
+    Returns a list of messages describing rows that would stop the deferred
+    constraints from being added. Empty if there are none.
+
+    :param cur: psycopg2 cursor
+    """
+    violations = []
+
+    cur.execute(songplay_duplicate_ids_select)
+    (duplicates,) = cur.fetchone()
+    if duplicates:
+        violations.append(f"{duplicates} duplicate songplays.songplay_id values")
+
+    for table, column, ref_table, ref_column in foreign_keys:
+        cur.execute(
+            foreign_key_orphans_select.format(
+                table=table, column=column, ref_table=ref_table, ref_column=ref_column
+            )
+        )
+        (orphans,) = cur.fetchone()
+        if orphans:
+            violations.append(
+                f"{orphans} {table}.{column} values missing from "
+                f"{ref_table}.{ref_column}"
+            )
+
+    return violations
+
+
+def add_constraints(cur, conn):
+    """
+    Validates the loaded data, then adds the songplays primary key, the foreign
+    keys and the lookup indexes in a single transaction. Nothing is added if
+    any rows would violate a constraint, every violation is reported in the
+    raised error.
+
+    :param cur: psycopg2 cursor
+    :param conn: psycopg2 connection
+    """
+    violations = find_constraint_violations(cur)
+    if violations:
+        conn.rollback()
+        raise ValueError("Can't add constraints: " + "; ".join(violations))
+
+    cur.execute(songplay_primary_key_add)
+    for table, column, ref_table, ref_column in foreign_keys:
+        cur.execute(
+            foreign_key_add.format(
+                table=table, column=column, ref_table=ref_table, ref_column=ref_column
+            )
+        )
+    for query in create_index_queries:
+        cur.execute(query)
+
+    # fresh statistics, so the planner knows about the new indexes and the data
+    cur.execute("ANALYZE")
+    conn.commit()
+
+
+def bulk_load(etl_args):
+    """
+    Loads into tables created without the deferred constraints and indexes,
+    then adds them all in one pass. Logs how long each phase took.
+
+    :param etl_args: list[str] - etl.py command line arguments for the load
+    """
+    etl_options, _ = get_etl_opt_parser().parse_args(etl_args)
+
+    started = time.perf_counter()
+    etl.main(**vars(etl_options))
+    load_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    with db.connection() as conn:
+        add_constraints(conn.cursor(), conn)
+    constraint_seconds = time.perf_counter() - started
+    db.close_pool()
+
+    logging.info(
+        f"Bulk load: load phase {load_seconds:.2f}s, "
+        f"constraint and index phase {constraint_seconds:.2f}s"
+    )
+
+
+def main(bulk=False, etl_args=""):
     """
     - Drops (if exists) and Creates the sparkify database.
 
-    - Establishes connection with the sparkify database and gets
+    - Checks out a pooled connection to the sparkify database and gets
     cursor to it.
 
-    - Creates all tables needed.
+    - Creates all tables needed. Unless bulk loading, adds the constraints and
+    indexes straight away.
+
+    - Returns the connection to the pool and closes it.
 
-    - Finally, closes the connection.
+    - When bulk loading, runs the ETL and then adds the constraints and indexes.
+
+    :param bulk: bool - defer constraints and indexes until after an ETL run
+    :param etl_args: str - etl.py arguments for the bulk load
     """
-    cur, conn = create_database()
+    create_database()
     logging.info("Database has been reset")
 
-    create_tables(cur, conn)
-    logging.info("Tables created")
+    with db.connection() as conn:
+        cur = conn.cursor()
+        create_tables(cur, conn)
+        if not bulk:
+            add_constraints(cur, conn)
+        logging.info("Tables created")
 
-    conn.close()
+    db.close_pool()
+
+    if bulk:
+        bulk_load(shlex.split(etl_args))
+
+
+def get_opt_parser():
+    """
+    Returns an option parser instance for create_tables.py's command line options.
+    """
+    optparser = optparse.OptionParser()
+    optparser.add_option(
+        "--bulk-load",
+        dest="bulk",
+        action="store_true",
+        default=False,
+        help="Create the tables without foreign keys, the songplays primary key "
+        "and lookup indexes, run the ETL, then add them all at the end",
+    )
+    optparser.add_option(
+        "--etl-args",
+        dest="etl_args",
+        default="",
+        help='etl.py arguments for --bulk-load, e.g. "--load-mode copy --workers 4"',
+    )
+    return optparser
 
 
 if __name__ == "__main__":
-    main()
+    options, args = get_opt_parser().parse_args()
+    main(**vars(options))
@@ -1,24 +1,201 @@
 import os
+import time
+from contextlib import contextmanager
 
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
 
-DB_HOST = "localhost"
+from log import config_log
+
+logging = config_log()
+
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_PORT = int(os.getenv("DB_PORT", "5432"))
 DB_USER = os.getenv("DB_USER", "postgres")
 DB_PASSWORD = os.getenv("DB_PASSWORD", "postgres")
 DB_NAME = os.getenv("DB_NAME", "sparkifydb")
 
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+DB_CONNECT_ATTEMPTS = int(os.getenv("DB_CONNECT_ATTEMPTS", "5"))
+DB_CONNECT_BACKOFF = float(os.getenv("DB_CONNECT_BACKOFF", "0.5"))
+
+# TCP keepalives so idle pooled connections aren't silently dropped
+KEEPALIVE_OPTIONS = {
+    "keepalives": 1,
+    "keepalives_idle": 30,
+    "keepalives_interval": 10,
+    "keepalives_count": 5,
+}
+
+# Session settings for bulk loads. With synchronous_commit off a crash can lose
+# the last few commits, but never leaves the DB inconsistent, and the
+# `loaded_files` manifest is lost along with the data it describes.
+BULK_LOAD_SETTINGS = {"synchronous_commit": "off"}
+
+_pool = None
+
+
+def load_session_settings(load_mode):
+    """
+    Returns the session settings to load with for an `etl.py --load-mode`.
+
+    :param load_mode: str
+    """
+    return BULK_LOAD_SETTINGS if load_mode in ("copy", "sql") else None
+
+
+def connection_kwargs(dbname=None):
+    """
+    Returns the psycopg2.connect keyword arguments for the configured server.
+
+    :param dbname: str - optional, database to select
+    """
+    kwargs = {
+        "host": DB_HOST,
+        "port": DB_PORT,
+        "user": DB_USER,
+        "password": DB_PASSWORD,
+        **KEEPALIVE_OPTIONS,
+    }
+    if dbname:
+        kwargs["dbname"] = dbname
+    return kwargs
+
+
+def with_retry(func, attempts=DB_CONNECT_ATTEMPTS, backoff=DB_CONNECT_BACKOFF):
+    """
+    Calls `func`, retrying with exponential backoff on transient connection
+    errors (psycopg2.OperationalError). The last error is re-raised.
+
+    :param func: function() - usually something that opens a connection
+    :param attempts: int - total number of tries, at least 1
+    :param backoff: float - seconds to wait after the first failure, doubled
+        after every failure after that
+    """
+    if attempts < 1:
+        raise ValueError(f"attempts must be at least 1, got {attempts}")
+
+    for attempt in range(1, attempts):
+        try:
+            return func()
+        except psycopg2.OperationalError as e:
+            delay = backoff * 2 ** (attempt - 1)
+            logging.warning(
+                f"DB connection failed ({e}), retry {attempt}/{attempts - 1} in "
+                f"{delay:.1f}s"
+            )
+            time.sleep(delay)
+
+    # the last try, its error goes to the caller
+    return func()
+
 
 def create_connection():
     """
     Creates a connection to the postgres server without selecting a database.
     """
-    return psycopg2.connect(f"host={DB_HOST} user={DB_USER} password={DB_PASSWORD}")
+    return with_retry(lambda: psycopg2.connect(**connection_kwargs()))
 
 
 def create_db_connection():
     """
     Creates a connection to the postgres server selecting the application database.
     """
-    return psycopg2.connect(
-        f"host={DB_HOST} dbname={DB_NAME} user={DB_USER} password={DB_PASSWORD}"
-    )
+    return with_retry(lambda: psycopg2.connect(**connection_kwargs(DB_NAME)))
+
+
+def get_pool():
+    """
+    Returns the process-wide connection pool for the application database,
+    creating it on first use.
+    """
+    global _pool
+    if _pool is None:
+        kwargs = connection_kwargs(DB_NAME)
+        _pool = with_retry(lambda: ThreadedConnectionPool(1, DB_POOL_SIZE, **kwargs))
+    return _pool
+
+
+def close_pool():
+    """
+    Closes every connection in the pool. The next `get_pool` call starts a new
+    one. Call this before forking worker processes, so they don't inherit open
+    connections.
+    """
+    global _pool
+    if _pool is not None:
+        _pool.closeall()
+        _pool = None
+
+
+def apply_session_settings(conn, settings):
+    """
+    Applies `SET` session settings (e.g. `BULK_LOAD_SETTINGS`) to a connection.
+
+    :param conn: psycopg2 connection
+    :param settings: dict - setting name -> value
+    """
+    with conn.cursor() as cur:
+        for name, value in settings.items():
+            cur.execute(f"SET {name} = %s", [value])
+    conn.commit()
+
+
+def checkout(settings=None):
+    """
+    Takes a connection from the pool, replacing it if the server closed it.
+    Give it back with `release`, or use the `connection` context manager.
+
+    :param settings: dict - optional session settings for this checkout
+    """
+    pool = get_pool()
+    conn = with_retry(pool.getconn)
+    if conn.closed:
+        pool.putconn(conn, close=True)
+        conn = with_retry(pool.getconn)
+
+    if settings:
+        apply_session_settings(conn, settings)
+    return conn
+
+
+def release(conn, settings=None):
+    """
+    Returns a connection to the pool. Any open transaction is rolled back and
+    session settings from `checkout` are reset, so the next user gets a clean
+    connection.
+
+    :param conn: psycopg2 connection
+    :param settings: dict - the settings passed to `checkout`
+    """
+    pool = get_pool()
+    if conn.closed:
+        pool.putconn(conn, close=True)
+        return
+
+    conn.rollback()
+    if settings:
+        with conn.cursor() as cur:
+            for name in settings:
+                cur.execute(f"RESET {name}")
+        conn.commit()
+    pool.putconn(conn)
+
+
+@contextmanager
+def connection(settings=None):
+    """
+    Context managed pool checkout:
+
+        with db.connection(db.BULK_LOAD_SETTINGS) as conn:
+            ...
+
+    Uncommitted work is rolled back when the block exits.
+
+    :param settings: dict - optional session settings for this checkout
+    """
+    conn = checkout(settings)
+    try:
+        yield conn
+    finally:
+        release(conn, settings)
@@ -0,0 +1,68 @@
+from metrics import run_metrics
+
+
+class RunDeduplicator:
+    """Remembers which times and users have already been written during this
+    run, so each distinct key is only sent to the DB when it's new (or, for
+    users, when their level changed).
+
+    Keys seen while loading a file are pending until the file's savepoint is
+    released (`confirm`). If the file is rolled back, `discard` forgets them so
+    they get written again by a later file.
+    """
+
+    def __init__(self):
+        self.written_times = set()
+        self.pending_times = set()
+        self.user_levels = {}
+        self.pending_user_levels = {}
+
+    def new_start_times(self, next_song_data):
+        """Returns one row per `ts` that hasn't been written yet this run.
+
+        :param next_song_data: pd.DataFrame - with `ts` and `startTime`
+
+        """
+        unique = next_song_data.drop_duplicates(subset=["ts"])
+        seen = unique["ts"].isin(self.written_times) | unique["ts"].isin(
+            self.pending_times
+        )
+        new = unique.loc[~seen]
+
+        self.pending_times.update(new["ts"].tolist())
+        run_metrics.record_deduplicated("times", len(next_song_data) - len(new))
+        return new
+
+    def changed_users(self, next_song_data):
+        """Returns the latest row per user, for users that are new this run or
+        whose level differs from what was last written. That's all the
+        `ON CONFLICT (user_id) DO UPDATE SET level` upsert would change.
+
+        :param next_song_data: pd.DataFrame - with `userId` and `level`
+
+        """
+        latest = next_song_data.drop_duplicates(subset=["userId"], keep="last")
+        known_levels = {**self.user_levels, **self.pending_user_levels}
+        mask = [
+            known_levels.get(user_id) != level
+            for user_id, level in zip(latest["userId"], latest["level"])
+        ]
+        changed = latest.loc[mask]
+
+        self.pending_user_levels.update(zip(changed["userId"], changed["level"]))
+        run_metrics.record_deduplicated("users", len(next_song_data) - len(changed))
+        return changed
+
+    def confirm(self):
+        """Marks everything pending as written, once its file is in."""
+        self.written_times |= self.pending_times
+        self.user_levels.update(self.pending_user_levels)
+        self.discard()
+
+    def discard(self):
+        """Forgets everything pending, after its file was rolled back."""
+        self.pending_times = set()
+        self.pending_user_levels = {}
+
+
+run_deduplicator = RunDeduplicator()
@@ -1,14 +1,35 @@
+import os
+from datetime import date
+from functools import partial
+
 import pandas as pd
-from pydash import py_
 
+import bulk_load
 import db
+import json_parsers
+import manifest
+import staged_load
+from aggregates import log_refresh, refresh_aggregates
+from config import get_opt_parser
+from dedup import run_deduplicator
+from json_parsers import (LOG_SCHEMA, SONG_SCHEMA, read_json_lines,
+                          read_json_lines_chunks, read_json_lines_many)
 from log import config_log
-from sql_queries import (artist_table_insert, song_select, song_table_insert,
-                         songplay_table_insert, time_table_insert,
-                         user_table_insert)
-from utils import get_all_json_files_in_path
+from metrics import run_metrics
+from parallel import process_data_parallel
+from parse_cache import DEFAULT_MAX_MB, ParseCache
+from partitions import create_partitions, ensure_partitions_for, log_file_months
+from pipeline import process_data_pipelined
+from song_index import song_lookup_index
+from sql_queries import (artist_table_insert, artist_table_insert_values,
+                         song_table_insert, song_table_insert_values,
+                         songplay_table_insert_values,
+                         time_table_insert_values, user_table_insert_values)
+from transactions import CommitPolicy, run_in_savepoint
+from utils import chunked
 
 logging = config_log()
+optparser = get_opt_parser()
 
 
 def clean_not_nulls(df):
@@ -61,13 +82,118 @@ def process_song_file(cur, filepath):
     :param filepath: str
 
     """
-    df = pd.read_json(filepath, lines=True)
+    with run_metrics.time_stage("read_json"):
+        df = read_json_lines(filepath, SONG_SCHEMA)
 
     artist_data = artist_data_from_songfile(df)
-    cur.execute(artist_table_insert, artist_data.values[0])
+    with run_metrics.time_load("artists", 1):
+        cur.execute(artist_table_insert, artist_data.values[0])
 
     song_data = song_data_from_songfile(df)
-    cur.execute(song_table_insert, song_data.values[0])
+    with run_metrics.time_load("songs", 1):
+        cur.execute(song_table_insert, song_data.values[0])
+
+
+def process_song_file_copy(cur, filepath):
+    """
+    Same as `process_song_file`, but writes through the COPY bulk loader.
+
+    :param cur: psycopg2 cursor
+    :param filepath: str
+
+    """
+    with run_metrics.time_stage("read_json"):
+        df = read_json_lines(filepath, SONG_SCHEMA)
+
+    bulk_load.load_artists(artist_data_from_songfile(df), cur)
+    bulk_load.load_songs(song_data_from_songfile(df), cur)
+
+
+def song_data_from_songfiles(filepaths):
+    """Reads many song files into a single dataframe.
+
+    :param filepaths: list[str]
+
+    """
+    with run_metrics.time_stage("read_json"):
+        return read_json_lines_many(filepaths, SONG_SCHEMA)
+
+
+def unique_artist_and_song_data(df):
+    """Extracts artist and song data from a multi-file songfile dataframe,
+    deduplicated by id. The first row wins, like ON CONFLICT DO NOTHING. Rows
+    are sorted by id so concurrent loaders lock them in the same order.
+
+    :param df: pd.DataFrame
+
+    """
+    artist_data = (
+        artist_data_from_songfile(df)
+        .drop_duplicates(subset=["artist_id"])
+        .sort_values("artist_id")
+    )
+    song_data = (
+        song_data_from_songfile(df)
+        .drop_duplicates(subset=["song_id"])
+        .sort_values("song_id")
+    )
+    return artist_data, song_data
+
+
+def load_song_data(df, cursor):
+    """Writes artists and songs from a multi-file songfile dataframe, each table
+    with a single INSERT.
+
+    :param df: pd.DataFrame
+    :param cursor: psycopg2 cursor
+
+    """
+    if df.empty:
+        return
+
+    artist_data, song_data = unique_artist_and_song_data(df)
+    bulk_load.insert_dataframe(
+        artist_data, cursor, "artists", artist_table_insert_values
+    )
+    bulk_load.insert_dataframe(song_data, cursor, "songs", song_table_insert_values)
+
+
+def load_song_data_copy(df, cursor):
+    """Same as `load_song_data`, but writes through the COPY bulk loader.
+
+    :param df: pd.DataFrame
+    :param cursor: psycopg2 cursor
+
+    """
+    if df.empty:
+        return
+
+    artist_data, song_data = unique_artist_and_song_data(df)
+    bulk_load.load_artists(artist_data, cursor)
+    bulk_load.load_songs(song_data, cursor)
+
+
+def process_song_files(cur, filepaths):
+    """
+    Batched version of `process_song_file`. Reads all the files at once and
+    writes each table with a single INSERT.
+
+    :param cur: psycopg2 cursor
+    :param filepaths: list[str]
+
+    """
+    load_song_data(song_data_from_songfiles(filepaths), cur)
+
+
+def process_song_files_copy(cur, filepaths):
+    """
+    Batched version of `process_song_file_copy`.
+
+    :param cur: psycopg2 cursor
+    :param filepaths: list[str]
+
+    """
+    load_song_data_copy(song_data_from_songfiles(filepaths), cur)
 
 
 def only_next_song_data(df):
@@ -83,11 +209,15 @@ def only_next_song_data(df):
 def datetime_from_mills_column(df: pd.DataFrame, timestamp_column: str):
     """Creates a DateTime column from a timestamp column in a dataframe.
 
+    The datetimes are naive, in UTC. `start_time` columns are `timestamp without
+    time zone`: a tz-aware value would be stored in the session's time zone by
+    psycopg2 but in UTC by `COPY`, so the load modes wouldn't agree.
+
     :param df: pd.DataFrame
     :param timestamp_column: str
 
     """
-    return pd.to_datetime(df[timestamp_column], unit="ms", utc=True)
+    return pd.to_datetime(df[timestamp_column], unit="ms", utc=True).dt.tz_convert(None)
 
 
 def user_data_from_songplays(df):
@@ -99,136 +229,631 @@ def user_data_from_songplays(df):
     return df.filter(items=["userId", "firstName", "lastName", "gender", "level"])
 
 
-def song_query_variables_not_null(row):
-    """Checks to see if the properties song, artist, and length are on a dict.
+def song_query_variables_not_null(df):
+    """Returns a boolean mask of the rows where song, artist and length are all
+    set. Rows outside the mask can't be matched to a song.
 
-    :param row: dict
+    :param df: pd.DataFrame
 
     """
-    return (
-        not py_([row.song, row.artist, row.length])
-        .every(lambda v: v is not None)
-        .value()
-    )
+    return df[["song", "artist", "length"]].notnull().all(axis=1)
+
+
+def songplays_with_song_data(next_song_data):
+    """Drops songplays that are missing song, artist or length.
+
+    The dropped rows are counted in the run metrics rather than logged one by
+    one.
+
+    :param next_song_data: pd.DataFrame with only "NextSong" data
+
+    """
+    mask = song_query_variables_not_null(next_song_data)
+    run_metrics.record_skipped("songplays", int((~mask).sum()))
+    return next_song_data.loc[mask]
 
 
 def load_start_times(next_song_data, cursor):
     """Loads start_times data into the DB from songplay data.
 
+    Times already written earlier in the run are not sent again.
+
     :param next_song_data: pd.DataFrame
     :param cursor: psycopg2 cursor
 
     """
-    start_times = list(next_song_data["startTime"])
-
-    for t in start_times:
-        cursor.execute(time_table_insert, [t])
+    with run_metrics.time_stage("load_start_times"):
+        start_times = run_deduplicator.new_start_times(next_song_data)
+        bulk_load.insert_dataframe(
+            start_times.filter(items=["startTime"]).sort_values("startTime"),
+            cursor,
+            "times",
+            time_table_insert_values,
+        )
 
 
 def load_users(next_song_data, cursor):
     """Loads users data into the DB from songplay data.
 
+    Only the last event per user is sent, since a single upsert statement can't
+    update the same user twice. It's the one that would have won anyway. Users
+    already written earlier in the run are skipped unless their level changed.
+    Rows are sent in user_id order so concurrent loaders lock them in the same
+    order.
+
     :param next_song_data: pd.DataFrame
     :param cursor: psycopg2 cursor
 
     """
-    user_data = user_data_from_songplays(next_song_data)
-
-    for _, row in user_data.iterrows():
-        cursor.execute(user_table_insert, row)
+    with run_metrics.time_stage("load_users"):
+        user_data = user_data_from_songplays(
+            run_deduplicator.changed_users(next_song_data)
+        ).sort_values("userId")
+        bulk_load.insert_dataframe(user_data, cursor, "users", user_table_insert_values)
 
 
 def load_songplays(next_song_data, cursor):
     """Loads songplays data into the DB from a dataframe.
 
+    Songs and artists are resolved against the in-memory `song_lookup_index`
+    with one merge, and all rows are written in a single batched insert.
+
     :param next_song_data: pd.DataFrame with only "NextSong" data
     :param cursor: psycopg2 cursor
 
     """
-    for _, row in next_song_data.iterrows():
+    song_lookup_index.ensure_loaded(cursor)
+
+    with run_metrics.time_stage("song_lookup"):
+        songplay_data = song_lookup_index.resolve(
+            songplays_with_song_data(next_song_data)
+        )
+
+    with run_metrics.time_stage("songplay_insert"):
+        ensure_partitions_for(cursor, songplay_data["startTime"])
+        bulk_load.insert_dataframe(
+            songplay_data.filter(
+                items=[
+                    "startTime",
+                    "userId",
+                    "level",
+                    "songId",
+                    "artistId",
+                    "sessionId",
+                    "location",
+                    "userAgent",
+                ]
+            ),
+            cursor,
+            "songplays",
+            songplay_table_insert_values,
+        )
+
+
+def next_song_data_with_start_times(songplay_dataframe):
+    """Keeps the "NextSong" rows of a log dataframe and adds a `startTime`.
+
+    :param songplay_dataframe: pd.DataFrame
 
-        if song_query_variables_not_null(row):
-            logging.info(f"Empty values for song, artist, or length in log {row}")
-            logging.info([row.song, row.artist, row.length])
-            continue
+    """
+    with run_metrics.time_stage("next_song_filter"):
+        next_song_data = only_next_song_data(songplay_dataframe)
 
-        cursor.execute(song_select, (row.song, row.artist, row.length))
-        results = cursor.fetchone()
+    with run_metrics.time_stage("timestamp_conversion"):
+        next_song_data["startTime"] = datetime_from_mills_column(next_song_data, "ts")
 
-        if results:
-            song_id, artist_id = results
-        else:
-            song_id, artist_id = None, None
-
-        # insert songplay record
-        songplay_data = [
-            row.startTime,
-            row.userId,
-            row.level,
-            song_id,
-            artist_id,
-            row.sessionId,
-            row.location,
-            row.userAgent,
-        ]
-        cursor.execute(songplay_table_insert, songplay_data)
+    return next_song_data
 
 
-def process_log_file(cursor, filepath):
-    """Process a log file from a filepath.
+def next_song_data_from_logfile(filepath):
+    """Reads a log file and returns its "NextSong" rows with a `startTime`.
 
-    :param cursor: psycopg2 cursor
     :param filepath: str - path to a log file
 
     """
-    songplay_dataframe = pd.read_json(filepath, lines=True)
+    with run_metrics.time_stage("read_json"):
+        songplay_dataframe = read_json_lines(filepath, LOG_SCHEMA)
 
-    next_song_data = only_next_song_data(songplay_dataframe)
+    return next_song_data_with_start_times(songplay_dataframe)
 
-    next_song_data["startTime"] = datetime_from_mills_column(next_song_data, "ts")
 
+def next_song_data_chunks_from_logfile(filepath, chunksize):
+    """Streams a log file `chunksize` lines at a time, yielding the "NextSong"
+    rows of each chunk with a `startTime`. Memory is bounded by the chunk size
+    rather than the file size.
+
+    :param filepath: str - path to a log file
+    :param chunksize: int - lines per chunk
+
+    """
+    chunks = read_json_lines_chunks(filepath, LOG_SCHEMA, chunksize)
+    while True:
+        with run_metrics.time_stage("read_json"):
+            songplay_dataframe = next(chunks, None)
+        if songplay_dataframe is None:
+            return
+
+        next_song_data = next_song_data_with_start_times(songplay_dataframe)
+        if not next_song_data.empty:
+            yield next_song_data
+
+
+def load_next_song_data(next_song_data, cursor):
+    """Loads times, users and songplays from "NextSong" log data.
+
+    :param next_song_data: pd.DataFrame with only "NextSong" data
+    :param cursor: psycopg2 cursor
+
+    """
     load_start_times(next_song_data, cursor)
     load_users(next_song_data, cursor)
     load_songplays(next_song_data, cursor)
 
 
-def process_data(cur, conn, filepath, func):
+def load_next_song_data_copy(next_song_data, cursor):
+    """Same as `load_next_song_data`, but writes through the COPY bulk loader.
+
+    Rows missing song, artist or length are dropped before loading, the same as
+    `load_songplays`.
+
+    :param next_song_data: pd.DataFrame with only "NextSong" data
+    :param cursor: psycopg2 cursor
+
+    """
+    with run_metrics.time_stage("load_start_times"):
+        start_times = run_deduplicator.new_start_times(next_song_data)
+        bulk_load.load_times(start_times.filter(items=["startTime"]), cursor)
+
+    with run_metrics.time_stage("load_users"):
+        changed_users = run_deduplicator.changed_users(next_song_data)
+        bulk_load.load_users(
+            user_data_from_songplays(changed_users).assign(
+                startTime=changed_users["startTime"]
+            ),
+            cursor,
+        )
+
+    # song lookup happens inside the songplays upsert in this mode
+    with run_metrics.time_stage("songplay_insert"):
+        songplay_data = songplays_with_song_data(next_song_data)
+        ensure_partitions_for(cursor, songplay_data["startTime"])
+        bulk_load.load_songplays(
+            songplay_data.filter(
+                items=[
+                    "startTime",
+                    "userId",
+                    "level",
+                    "song",
+                    "artist",
+                    "length",
+                    "sessionId",
+                    "location",
+                    "userAgent",
+                ]
+            ),
+            cursor,
+        )
+
+
+def process_log_file(cursor, filepath):
+    """Process a log file from a filepath.
+
+    :param cursor: psycopg2 cursor
+    :param filepath: str - path to a log file
+
+    """
+    load_next_song_data(next_song_data_from_logfile(filepath), cursor)
+
+
+def process_log_file_copy(cursor, filepath):
+    """Same as `process_log_file`, but writes through the COPY bulk loader.
+
+    :param cursor: psycopg2 cursor
+    :param filepath: str - path to a log file
+
+    """
+    load_next_song_data_copy(next_song_data_from_logfile(filepath), cursor)
+
+
+def process_log_file_in_chunks(cursor, filepath, load_func, chunksize):
+    """Streaming version of `process_log_file`. Each chunk of the file goes
+    through filtering, timestamp conversion and loading before the next one is
+    read.
+
+    Meant to be bound with `functools.partial` so it has the usual
+    (cursor, filepath) file processing signature.
+
+    :param cursor: psycopg2 cursor
+    :param filepath: str - path to a log file
+    :param load_func: function(next_song_data, cursor) - one of `LOG_LOADERS`
+    :param chunksize: int - lines per chunk
+
+    """
+    for next_song_data in next_song_data_chunks_from_logfile(filepath, chunksize):
+        load_func(next_song_data, cursor)
+
+
+# file processing functions (song, log) for each --load-mode
+LOAD_MODES = {
+    "row": (process_song_file, process_log_file),
+    "copy": (process_song_file_copy, process_log_file_copy),
+    "sql": (staged_load.process_song_file, staged_load.process_log_file),
+}
+
+# "NextSong" data loading functions for each --load-mode that reads files with
+# pandas
+LOG_LOADERS = {
+    "row": load_next_song_data,
+    "copy": load_next_song_data_copy,
+}
+
+# batched song file processing functions for each --load-mode
+SONG_BATCH_LOADERS = {
+    "row": process_song_files,
+    "copy": process_song_files_copy,
+    "sql": staged_load.process_song_files,
+}
+
+# (song data, "NextSong" data) writing functions for --pipeline-depth, for each
+# --load-mode that reads files with pandas. Song files are parsed with
+# `song_data_from_songfiles` and log files with `next_song_data_from_logfile`.
+PIPELINE_WRITERS = {
+    "row": (load_song_data, load_next_song_data),
+    "copy": (load_song_data_copy, load_next_song_data_copy),
+}
+
+
+def load_file_with_manifest(cur, func, work):
+    """Runs a file processing function and records the file(s) in the manifest.
+
+    :param cur: psycopg2 cursor
+    :param func: function(cur, work) - file processing function
+    :param work: str | list[str] - a filepath, or a batch of them
+
+    """
+    func(cur, work)
+    manifest.record_loaded_files(cur, work if isinstance(work, list) else [work])
+
+
+def load_work_items(cur, conn, work_items, func, commit_policy):
+    """Processes files (or batches of files), each inside its own savepoint,
+    committing as often as `commit_policy` says.
+
+    A file that fails is rolled back to its savepoint and added to the rejects,
+    and everything else in the transaction still gets committed.
+
+    Returns a list of (work, error message) for the rejected files.
+
+    :param cur: psycopg2 cursor
+    :param conn: psycopg2 connection
+    :param work_items: Iterable[str] | Iterable[list[str]] - filepaths or
+        batches, consumed lazily
+    :param func: function(cur, work) - file processing function
+    :param commit_policy: CommitPolicy
+
+    """
+    rejects = []
+    processed = 0
+
+    for work in work_items:
+        error = run_in_savepoint(cur, load_file_with_manifest, func, work)
+        if error:
+            run_deduplicator.discard()
+            rejects.append((work, error))
+            logging.error(f"Rejected {work}: {error}")
+        else:
+            run_deduplicator.confirm()
+
+        files = len(work) if isinstance(work, list) else 1
+        commit_policy.add_files(files)
+        commit_policy.maybe_commit(conn)
+
+        processed += files
+        logging.info(f"{processed} files processed.")
+
+    commit_policy.commit(conn)
+    return rejects
+
+
+def process_data(
+    cur,
+    conn,
+    filepath,
+    func,
+    full_refresh=False,
+    commit_policy=None,
+    since=None,
+    until=None,
+):
     """Main data processing function.
 
     This function takes in a root filepath where all data is to be processed and
     a file processing function. It iterates through all found files and calls
     the file processing function with the filepath.
 
+    Files are discovered lazily, so processing starts before the whole tree
+    has been walked. Files already recorded in the `loaded_files` manifest and
+    unchanged since are skipped, unless `full_refresh` is set. Each file runs in
+    a savepoint, so a bad file is rejected without losing the rest of the
+    transaction.
+
+    Returns a list of (filepath, error message) for the rejected files.
+
     :param cur:
     :param conn:
     :param filepath:
     :param func:
+    :param full_refresh: bool - process every file, loaded or not
+    :param commit_policy: CommitPolicy - defaults to a commit per file
+    :param since: datetime.date - optional, skip log data before this day
+    :param until: datetime.date - optional, skip log data after this day
 
     """
-    all_files = get_all_json_files_in_path(filepath)
-    number_of_files = len(all_files)
-    logging.info(f"{number_of_files} files found in {filepath}")
+    logging.info(f"Processing files in {filepath}")
+    all_files = manifest.files_to_process(cur, filepath, full_refresh, since, until)
 
-    for i, datafile in enumerate(all_files, 1):
-        func(cur, datafile)
-        conn.commit()
-        logging.info(f"{i}/{number_of_files} files processed.")
+    return load_work_items(cur, conn, all_files, func, commit_policy or CommitPolicy())
 
 
-def main():
-    """Main entrypoint function.
+def process_data_in_batches(
+    cur, conn, filepath, func, batch_size, full_refresh=False, commit_policy=None
+):
+    """Batched version of `process_data`.
+
+    The file processing function is called with lists of up to `batch_size`
+    filepaths, each batch in its own savepoint. By default there is one commit
+    per batch.
+
+    :param cur: psycopg2 cursor
+    :param conn: psycopg2 connection
+    :param filepath: str - root path to look for files in
+    :param func: function(cur, filepaths)
+    :param batch_size: int
+    :param full_refresh: bool - process every file, loaded or not
+    :param commit_policy: CommitPolicy - defaults to a commit per batch
 
-    Creates a db connection, processes song data, then log data.
     """
+    logging.info(f"Processing files in {filepath}")
+    all_files = manifest.files_to_process(cur, filepath, full_refresh)
+
+    return load_work_items(
+        cur,
+        conn,
+        chunked(all_files, batch_size),
+        func,
+        commit_policy or CommitPolicy(every_files=batch_size),
+    )
+
 
-    conn = db.create_db_connection()
-    cur = conn.cursor()
+def write_rejects(path, rejects):
+    """Writes rejected files to a tab separated file of path and error, one line
+    per file. Line breaks and tabs in errors (e.g. a Postgres DETAIL) become
+    single spaces.
 
-    process_data(cur, conn, "data/song_data", process_song_file)
-    process_data(cur, conn, "data/log_data", process_log_file)
+    :param path: str
+    :param rejects: list[tuple] - (filepath or list of filepaths, error message)
+
+    """
+    with open(path, "w", encoding="utf8") as f:
+        for work, error in rejects:
+            error = " ".join(error.split())
+            for filepath in work if isinstance(work, list) else [work]:
+                f.write(f"{filepath}\t{error}\n")
+
+
+def main(
+    load_mode="row",
+    song_batch_size=1,
+    workers=1,
+    full_refresh=False,
+    log_chunk_size=None,
+    metrics_json=None,
+    metrics_prometheus=None,
+    data_path="data",
+    commit_every_files=None,
+    commit_every_rows=None,
+    reject_file=None,
+    since=None,
+    until=None,
+    pipeline_depth=None,
+    parse_workers=1,
+    json_parser="pandas",
+    parse_cache=None,
+    parse_cache_size=DEFAULT_MAX_MB,
+    refresh=False,
+):
+    """Main entrypoint function.
+
+    Checks out a pooled db connection, processes song data, then log data. With
+    more than one worker, song data is fully processed and committed by the pool
+    before any log data is, so songplay lookups resolve. With a pipeline depth,
+    files are parsed in separate processes while earlier ones are written.
+
+    :param load_mode: str - one of the `LOAD_MODES` keys
+    :param song_batch_size: int - song files per batch, 1 processes them one at
+        a time
+    :param workers: int - number of worker processes, 1 runs in this process
+    :param full_refresh: bool - reload every file, even ones in the manifest
+    :param log_chunk_size: int - optional, stream log files this many lines at a
+        time instead of reading them whole
+    :param metrics_json: str - optional, path to write the run metrics to as JSON
+    :param metrics_prometheus: str - optional, path to write the run metrics to
+        as a Prometheus textfile
+    :param data_path: str - directory holding the `song_data` and `log_data`
+        trees
+    :param commit_every_files: int - optional, commit every this many files
+        instead of after every file (or song batch)
+    :param commit_every_rows: int - optional, also commit once this many rows
+        have been written since the last commit
+    :param reject_file: str - optional, path to write rejected files to
+    :param since: str - optional, YYYY-MM-DD, only load log data from this day
+    :param until: str - optional, YYYY-MM-DD, only load log data up to this day
+    :param pipeline_depth: int - optional, overlap parsing and writing with up
+        to this many parsed files queued for the writer
+    :param parse_workers: int - number of parser processes for the pipeline
+    :param json_parser: str - one of the `json_parsers.PARSERS` keys
+    :param parse_cache: str - optional, directory to cache parsed files in
+    :param parse_cache_size: int - parse cache size limit in MB
+    :param refresh: bool - fold the new songplays into the aggregate tables once
+        everything is loaded
+    """
+    json_parsers.configure(
+        json_parser,
+        ParseCache(parse_cache, parse_cache_size << 20) if parse_cache else None,
+    )
 
-    conn.close()
+    since = date.fromisoformat(since) if since else None
+    until = date.fromisoformat(until) if until else None
+
+    song_data_path = os.path.join(data_path, "song_data")
+    log_data_path = os.path.join(data_path, "log_data")
+
+    process_song_file_func, process_log_file_func = LOAD_MODES[load_mode]
+    if song_batch_size > 1:
+        process_song_file_func = SONG_BATCH_LOADERS[load_mode]
+    else:
+        song_batch_size = None
+
+    if log_chunk_size and load_mode not in LOG_LOADERS:
+        logging.warning(f"--log-chunk-size has no effect with --load-mode {load_mode}")
+    elif log_chunk_size:
+        process_log_file_func = partial(
+            process_log_file_in_chunks,
+            load_func=LOG_LOADERS[load_mode],
+            chunksize=log_chunk_size,
+        )
+
+    def commit_policy():
+        if commit_every_files or commit_every_rows:
+            # no --commit-every-files: only --commit-every-rows decides
+            return CommitPolicy(commit_every_files or 0, commit_every_rows)
+        return None
+
+    if pipeline_depth and load_mode not in PIPELINE_WRITERS:
+        logging.warning(f"--pipeline-depth has no effect with --load-mode {load_mode}")
+        pipeline_depth = None
+    elif pipeline_depth and log_chunk_size and load_mode in LOG_LOADERS:
+        # the pipeline parses each log file whole before handing it on
+        logging.warning("--log-chunk-size has no effect with --pipeline-depth")
+
+    # up front and committed: creating them while loaders have transactions
+    # open deadlocks against those loaders
+    create_partitions(log_file_months(log_data_path, since, until))
+
+    if workers > 1:
+        if commit_every_files or commit_every_rows:
+            # every worker commits each file (or song batch) as soon as it's done
+            logging.warning("--commit-every-* options have no effect with --workers")
+        rejects = process_data_parallel(
+            song_data_path,
+            process_song_file_func,
+            workers,
+            load_mode,
+            song_batch_size,
+            full_refresh,
+        )
+        rejects += process_data_parallel(
+            log_data_path,
+            process_log_file_func,
+            workers,
+            load_mode,
+            full_refresh=full_refresh,
+            since=since,
+            until=until,
+        )
+    elif pipeline_depth:
+        write_song_data, write_next_song_data = PIPELINE_WRITERS[load_mode]
+        with db.connection(db.load_session_settings(load_mode)) as conn:
+            cur = conn.cursor()
+
+            if load_mode == "copy":
+                bulk_load.create_staging_tables(cur)
+
+            rejects = process_data_pipelined(
+                cur,
+                conn,
+                song_data_path,
+                song_data_from_songfiles,
+                write_song_data,
+                pipeline_depth,
+                parse_workers,
+                song_batch_size or 1,
+                full_refresh,
+                commit_policy(),
+            )
+            rejects += process_data_pipelined(
+                cur,
+                conn,
+                log_data_path,
+                next_song_data_from_logfile,
+                write_next_song_data,
+                pipeline_depth,
+                parse_workers,
+                full_refresh=full_refresh,
+                commit_policy=commit_policy(),
+                since=since,
+                until=until,
+            )
+
+        db.close_pool()
+    else:
+        with db.connection(db.load_session_settings(load_mode)) as conn:
+            cur = conn.cursor()
+
+            if load_mode == "copy":
+                bulk_load.create_staging_tables(cur)
+
+            if song_batch_size:
+                rejects = process_data_in_batches(
+                    cur,
+                    conn,
+                    song_data_path,
+                    process_song_file_func,
+                    song_batch_size,
+                    full_refresh,
+                    commit_policy(),
+                )
+            else:
+                rejects = process_data(
+                    cur,
+                    conn,
+                    song_data_path,
+                    process_song_file_func,
+                    full_refresh,
+                    commit_policy(),
+                )
+            rejects += process_data(
+                cur,
+                conn,
+                log_data_path,
+                process_log_file_func,
+                full_refresh,
+                commit_policy(),
+                since,
+                until,
+            )
+
+        db.close_pool()
+
+    if refresh:
+        with db.connection() as conn:
+            low, high = refresh_aggregates(conn.cursor())
+            conn.commit()
+        db.close_pool()
+        log_refresh(low, high)
+
+    if rejects:
+        logging.error(f"{len(rejects)} files/batches were rejected")
+        if reject_file:
+            write_rejects(reject_file, rejects)
+
+    run_metrics.log_summary()
+    if metrics_json:
+        run_metrics.write_json(metrics_json)
+    if metrics_prometheus:
+        run_metrics.write_prometheus(metrics_prometheus)
 
 
 if __name__ == "__main__":
-    main()
+    options, args = optparser.parse_args()
+    main(**vars(options))
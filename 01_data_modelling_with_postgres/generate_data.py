@@ -0,0 +1,277 @@
+import json
+import optparse
+import os
+import random
+import string
+from datetime import datetime, timedelta, timezone
+
+from log import config_log
+
+logging = config_log()
+
+# Sizes of the sample data in `data/`, which is what scale 1 generates
+SONGS_PER_SCALE = 71
+EVENTS_PER_DAY_PER_SCALE = 268
+USERS_PER_SCALE = 96
+DAYS = 30
+START_DATE = datetime(2018, 11, 1, tzinfo=timezone.utc)
+
+# Share of events that are "NextSong" in the sample logs, the rest are spread
+# over the other pages
+NEXT_SONG_RATE = 0.85
+OTHER_PAGES = ["Home", "Login", "Logout", "Downgrade", "Settings", "Help", "About"]
+
+FIRST_NAMES = ["Walter", "Kaylee", "Celeste", "Sylvie", "Jacob", "Lily", "Aleena"]
+LAST_NAMES = ["Frye", "Summers", "Williams", "Cruz", "Klein", "Koch", "Kirby"]
+LOCATIONS = [
+    "San Francisco-Oakland-Hayward, CA",
+    "Phoenix-Mesa-Scottsdale, AZ",
+    "Klamath Falls, OR",
+    "Washington-Arlington-Alexandria, DC-VA-MD-WV",
+    "Tampa-St. Petersburg-Clearwater, FL",
+]
+USER_AGENTS = [
+    '"Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_4) AppleWebKit/537.36 '
+    '(KHTML, like Gecko) Chrome/36.0.1985.143 Safari/537.36"',
+    '"Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 '
+    '(KHTML, like Gecko) Chrome/37.0.2062.103 Safari/537.36"',
+    "Mozilla/5.0 (Windows NT 6.1; WOW64; rv:31.0) Gecko/20100101 Firefox/31.0",
+]
+WORDS = ["Broken", "Night", "Fire", "Blue", "Ashes", "Place", "Streets", "Girls"]
+
+
+def random_id(rng, prefix, length=16):
+    """Returns an id like the ones in the sample data, e.g. "SOGVQGJ12AB017F169".
+
+    :param rng: random.Random
+    :param prefix: str - e.g. "SO", "AR" or "TR"
+    :param length: int - number of characters after the prefix
+    """
+    alphabet = string.ascii_uppercase + string.digits
+    return prefix + "".join(rng.choices(alphabet, k=length))
+
+
+def random_title(rng):
+    """Returns a made up song title or artist name.
+
+    :param rng: random.Random
+    """
+    return " ".join(rng.choices(WORDS, k=rng.randint(1, 4)))
+
+
+def generate_songs(rng, number_of_songs):
+    """Returns song file records, with an artist for every ~2 songs.
+
+    :param rng: random.Random
+    :param number_of_songs: int
+    """
+    artists = [
+        {
+            "artist_id": random_id(rng, "AR"),
+            "artist_latitude": rng.choice([None, round(rng.uniform(-90, 90), 5)]),
+            "artist_longitude": rng.choice([None, round(rng.uniform(-180, 180), 5)]),
+            "artist_location": rng.choice(["", *LOCATIONS]),
+            "artist_name": f"{random_title(rng)} {i}",
+        }
+        for i in range(max(number_of_songs // 2, 1))
+    ]
+
+    return [
+        {
+            "num_songs": 1,
+            **rng.choice(artists),
+            "song_id": random_id(rng, "SO"),
+            "title": f"{random_title(rng)} {i}",
+            "duration": round(rng.uniform(60, 600), 5),
+            "year": rng.choice([0, rng.randint(1960, 2018)]),
+        }
+        for i in range(number_of_songs)
+    ]
+
+
+def generate_users(rng, number_of_users):
+    """Returns user fields, as they appear on log events.
+
+    :param rng: random.Random
+    :param number_of_users: int
+    """
+    return [
+        {
+            "firstName": rng.choice(FIRST_NAMES),
+            "gender": rng.choice(["M", "F"]),
+            "lastName": rng.choice(LAST_NAMES),
+            "level": rng.choice(["free", "paid"]),
+            "location": rng.choice(LOCATIONS),
+            "registration": float(rng.randint(1538000000, 1541000000) * 1000 + 796),
+            "userAgent": rng.choice(USER_AGENTS),
+            "userId": str(user_id),
+        }
+        for user_id in range(1, number_of_users + 1)
+    ]
+
+
+def generate_day_events(rng, day, number_of_events, songs, users, match_rate):
+    """Returns a day of log events, as sessions of consecutive events, in
+    timestamp order.
+
+    :param rng: random.Random
+    :param day: datetime - midnight UTC of the day
+    :param number_of_events: int
+    :param songs: list[dict] - song file records
+    :param users: list[dict] - from `generate_users`
+    :param match_rate: float - share of "NextSong" events that are for a song
+        in `songs`, the rest won't match anything
+    """
+    day_start_ms = int(day.timestamp() * 1000)
+    events = []
+
+    while len(events) < number_of_events:
+        user = rng.choice(users)
+        session_id = rng.randint(1, 1_000_000)
+        ts = day_start_ms + rng.randint(0, 20 * 60 * 60 * 1000)
+        if rng.random() < 0.05:
+            user["level"] = "paid" if user["level"] == "free" else "free"
+
+        for item_in_session in range(rng.randint(1, 30)):
+            if rng.random() < NEXT_SONG_RATE:
+                page = "NextSong"
+                if rng.random() < match_rate:
+                    song = rng.choice(songs)
+                    artist, title, length = (
+                        song["artist_name"],
+                        song["title"],
+                        song["duration"],
+                    )
+                else:
+                    artist, title = random_title(rng), f"{random_title(rng)} unmatched"
+                    length = round(rng.uniform(60, 600), 5)
+            else:
+                page, artist, title, length = rng.choice(OTHER_PAGES), None, None, None
+
+            events.append(
+                {
+                    "artist": artist,
+                    "auth": "Logged In",
+                    "firstName": user["firstName"],
+                    "gender": user["gender"],
+                    "itemInSession": item_in_session,
+                    "lastName": user["lastName"],
+                    "length": length,
+                    "level": user["level"],
+                    "location": user["location"],
+                    "method": "PUT" if page == "NextSong" else "GET",
+                    "page": page,
+                    "registration": user["registration"],
+                    "sessionId": session_id,
+                    "song": title,
+                    "status": 200,
+                    "ts": ts,
+                    "userAgent": user["userAgent"],
+                    "userId": user["userId"],
+                }
+            )
+            ts += int(length * 1000) if length else rng.randint(1000, 60000)
+
+    events = events[:number_of_events]
+    events.sort(key=lambda e: e["ts"])
+    return events
+
+
+def write_json_lines(filepath, records):
+    """Writes records as line-delimited JSON, creating directories as needed.
+
+    :param filepath: str
+    :param records: list[dict]
+    """
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    with open(filepath, "w", encoding="utf8") as f:
+        for record in records:
+            f.write(json.dumps(record))
+            f.write("\n")
+
+
+def generate(output_path, scale=1, match_rate=0.5, seed=0):
+    """Writes `song_data` and `log_data` trees in the same layout and schema as
+    the sample data in `data/`, `scale` times as large.
+
+    Returns a dict with the number of songs and events written.
+
+    :param output_path: str - directory to write the trees into
+    :param scale: float - 1 is about the size of the sample data
+    :param match_rate: float - share of "NextSong" events that match a song
+    :param seed: int - random seed, the same seed gives the same data
+    """
+    rng = random.Random(seed)
+    number_of_songs = max(int(SONGS_PER_SCALE * scale), 1)
+    events_per_day = max(int(EVENTS_PER_DAY_PER_SCALE * scale), 1)
+
+    songs = generate_songs(rng, number_of_songs)
+    for song in songs:
+        track_id = random_id(rng, "TR")
+        write_json_lines(
+            os.path.join(
+                output_path,
+                "song_data",
+                *track_id[2:5],
+                f"{track_id}.json",
+            ),
+            [song],
+        )
+
+    users = generate_users(rng, max(int(USERS_PER_SCALE * scale), 1))
+    for day_number in range(DAYS):
+        day = START_DATE + timedelta(days=day_number)
+        write_json_lines(
+            os.path.join(
+                output_path,
+                "log_data",
+                f"{day:%Y}",
+                f"{day:%m}",
+                f"{day:%Y-%m-%d}-events.json",
+            ),
+            generate_day_events(rng, day, events_per_day, songs, users, match_rate),
+        )
+
+    logging.info(
+        f"Generated {number_of_songs} songs and {events_per_day * DAYS} events "
+        f"in {output_path}"
+    )
+    return {"songs": number_of_songs, "events": events_per_day * DAYS}
+
+
+def get_opt_parser():
+    """
+    Returns an option parser instance for the generator's command line options.
+    """
+    optparser = optparse.OptionParser(usage="%prog [options] OUTPUT_PATH")
+    optparser.add_option(
+        "--scale",
+        "-s",
+        dest="scale",
+        type="float",
+        default=1.0,
+        help="Size relative to the sample data in data/ (default: 1)",
+    )
+    optparser.add_option(
+        "--match-rate",
+        dest="match_rate",
+        type="float",
+        default=0.5,
+        help="Share of NextSong events that match a generated song (default: 0.5)",
+    )
+    optparser.add_option(
+        "--seed",
+        dest="seed",
+        type="int",
+        default=0,
+        help="Random seed (default: 0)",
+    )
+    return optparser
+
+
+if __name__ == "__main__":
+    optparser = get_opt_parser()
+    options, args = optparser.parse_args()
+    if len(args) != 1:
+        optparser.error("OUTPUT_PATH is required")
+    generate(args[0], options.scale, options.match_rate, options.seed)
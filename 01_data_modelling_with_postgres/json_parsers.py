@@ -0,0 +1,334 @@
+import io
+import optparse
+import os
+import time
+
+import pandas as pd
+
+from log import config_log
+from utils import get_all_json_files_in_path, read_json_lines_files
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import pyarrow as pa
+    from pyarrow import json as pa_json
+except ImportError:
+    pa = pa_json = None
+
+logging = config_log()
+
+# Columns and dtypes of the song and log files, in file order. Every parser
+# returns exactly these, so the rest of the ETL can't tell them apart. `userId`
+# stays a string: logged out events have an empty one.
+SONG_SCHEMA = {
+    "num_songs": "int64",
+    "artist_id": "object",
+    "artist_latitude": "float64",
+    "artist_longitude": "float64",
+    "artist_location": "object",
+    "artist_name": "object",
+    "song_id": "object",
+    "title": "object",
+    "duration": "float64",
+    "year": "int64",
+}
+
+LOG_SCHEMA = {
+    "artist": "object",
+    "auth": "object",
+    "firstName": "object",
+    "gender": "object",
+    "itemInSession": "int64",
+    "lastName": "object",
+    "length": "float64",
+    "level": "object",
+    "location": "object",
+    "method": "object",
+    "page": "object",
+    "registration": "float64",
+    "sessionId": "int64",
+    "song": "object",
+    "status": "int64",
+    "ts": "int64",
+    "userAgent": "object",
+    "userId": "object",
+}
+
+_parser = "pandas"
+_cache = None
+
+
+def missing_parser(name):
+    """Returns the error for a JSON parser whose module isn't installed.
+
+    :param name: str - one of the `PARSERS` keys
+
+    """
+    return ImportError(f"The {name} JSON parser needs `pip install {name}`")
+
+
+def conform(df, schema):
+    """Returns a dataframe with exactly the schema's columns, in order and with
+    its dtypes. Missing values in string columns are None.
+
+    :param df: pd.DataFrame
+    :param schema: dict - column name -> dtype
+
+    """
+    df = df.reindex(columns=list(schema))
+    for column, dtype in schema.items():
+        if dtype == "object":
+            values = df[column].astype(object)
+            df[column] = values.where(values.notnull(), None)
+        else:
+            df[column] = df[column].astype(dtype)
+    return df
+
+
+def parse_pandas(data, schema):
+    """Parses line-delimited JSON with `pd.read_json`.
+
+    :param data: bytes
+    :param schema: dict - column name -> dtype
+
+    """
+    return pd.read_json(io.BytesIO(data), lines=True, dtype=schema, convert_dates=False)
+
+
+def parse_orjson(data, schema):
+    """Parses line-delimited JSON one line at a time with orjson.
+
+    :param data: bytes
+    :param schema: dict - column name -> dtype
+
+    """
+    if orjson is None:
+        raise missing_parser("orjson")
+    records = [orjson.loads(line) for line in data.splitlines() if line.strip()]
+    return pd.DataFrame.from_records(records, columns=list(schema))
+
+
+def parse_pyarrow(data, schema):
+    """Parses line-delimited JSON with pyarrow's multithreaded JSON reader,
+    straight into typed columns.
+
+    :param data: bytes
+    :param schema: dict - column name -> dtype
+
+    """
+    if pa is None or pa_json is None:
+        raise missing_parser("pyarrow")
+    arrow_types = {"object": pa.string(), "int64": pa.int64(), "float64": pa.float64()}
+    parse_options = pa_json.ParseOptions(
+        explicit_schema=pa.schema(
+            [(column, arrow_types[dtype]) for column, dtype in schema.items()]
+        ),
+        unexpected_field_behavior="ignore",
+    )
+    return pa_json.read_json(io.BytesIO(data), parse_options=parse_options).to_pandas()
+
+
+# JSON parsers for --json-parser, and the module each one needs
+PARSERS = {
+    "pandas": (parse_pandas, pd),
+    "orjson": (parse_orjson, orjson),
+    "pyarrow": (parse_pyarrow, pa_json),
+}
+
+
+def use_parser(name):
+    """Sets the JSON parser used by this process.
+
+    :param name: str - one of the `PARSERS` keys
+
+    """
+    global _parser
+    if PARSERS[name][1] is None:
+        raise missing_parser(name)
+    _parser = name
+
+
+def configure(parser="pandas", cache=None):
+    """Sets the JSON parser and parse cache used by this process.
+
+    :param parser: str - one of the `PARSERS` keys
+    :param cache: parse_cache.ParseCache - optional, cache parsed files
+
+    """
+    global _cache
+    use_parser(parser)
+    if cache is not None and pa is None:
+        raise ImportError("The parse cache needs `pip install pyarrow`")
+    _cache = cache
+
+
+def current_configuration():
+    """Returns the (parser, cache) this process uses, for `configure` in
+    another process."""
+    return _parser, _cache
+
+
+def parse(data, schema, parser=None):
+    """Parses line-delimited JSON into a dataframe matching `schema`.
+
+    :param data: bytes
+    :param schema: dict - column name -> dtype
+    :param parser: str - optional, one of the `PARSERS` keys, defaults to the
+        one set with `use_parser`
+
+    """
+    if not data.strip():
+        return conform(pd.DataFrame(), schema)
+
+    parse_func, _ = PARSERS[parser or _parser]
+    return conform(parse_func(data, schema), schema)
+
+
+def read_json_lines(filepath, schema):
+    """Reads a line-delimited JSON file into a dataframe matching `schema`,
+    through the parse cache if there is one.
+
+    :param filepath: str
+    :param schema: dict - column name -> dtype
+
+    """
+    if _cache is not None:
+        df = _cache.get(filepath, schema)
+        if df is not None:
+            # Arrow may hand strings back with another dtype than `parse` does
+            return conform(df, schema)
+
+    with open(filepath, "rb") as f:
+        df = parse(f.read(), schema)
+
+    if _cache is not None:
+        _cache.put(filepath, schema, df)
+    return df
+
+
+def read_json_lines_many(filepaths, schema):
+    """Reads many line-delimited JSON files into a single dataframe. With a
+    parse cache, files are cached one by one.
+
+    :param filepaths: list[str]
+    :param schema: dict - column name -> dtype
+
+    """
+    if _cache is not None:
+        return conform(
+            pd.concat(
+                [read_json_lines(filepath, schema) for filepath in filepaths],
+                ignore_index=True,
+            ),
+            schema,
+        )
+
+    return parse(read_json_lines_files(filepaths), schema)
+
+
+def read_json_lines_chunks(filepath, schema, chunksize):
+    """Reads a line-delimited JSON file `chunksize` lines at a time, yielding a
+    dataframe per chunk.
+
+    :param filepath: str
+    :param schema: dict - column name -> dtype
+    :param chunksize: int - lines per chunk
+
+    """
+    with open(filepath, "rb") as f:
+        lines = []
+        for line in f:
+            lines.append(line)
+            if len(lines) == chunksize:
+                yield parse(b"".join(lines), schema)
+                lines = []
+        if lines:
+            yield parse(b"".join(lines), schema)
+
+
+def benchmark_parsers(filepaths, schema, parsers, repeat=3):
+    """Times each parser on the same files, already read into memory, and checks
+    that each one returns exactly what the pandas parser does.
+
+    Returns a dict of parser name -> {"seconds", "mb_per_second",
+    "rows_per_second"}, using the fastest of `repeat` runs.
+
+    :param filepaths: list[str]
+    :param schema: dict - column name -> dtype
+    :param parsers: list[str] - `PARSERS` keys
+    :param repeat: int - at least 1
+
+    """
+    if repeat < 1:
+        raise ValueError(f"repeat must be at least 1, got {repeat}")
+
+    data = read_json_lines_files(filepaths)
+    expected = parse(data, schema, "pandas")
+    results = {}
+
+    for name in parsers:
+        seconds = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            df = parse(data, schema, name)
+            seconds.append(time.perf_counter() - start)
+            pd.testing.assert_frame_equal(df, expected)
+
+        best = min(seconds)
+        results[name] = {
+            "seconds": best,
+            "mb_per_second": len(data) / (1024 * 1024) / best if best else 0.0,
+            "rows_per_second": len(expected) / best if best else 0.0,
+        }
+    return results
+
+
+def get_opt_parser():
+    """
+    Returns an option parser instance for the parser benchmark's command line
+    options.
+    """
+    optparser = optparse.OptionParser()
+    optparser.add_option(
+        "--data-path",
+        "-d",
+        dest="data_path",
+        default="data",
+        help="Directory holding the song_data and log_data trees (default: data)",
+    )
+    optparser.add_option(
+        "--parsers",
+        dest="parsers",
+        default=",".join(PARSERS),
+        help="Comma separated parsers to compare (default: all installed)",
+    )
+    optparser.add_option(
+        "--repeat",
+        dest="repeat",
+        type="int",
+        default=3,
+        help="Runs per parser, the fastest one counts (default: 3)",
+    )
+    return optparser
+
+
+if __name__ == "__main__":
+    optparser = get_opt_parser()
+    options, args = optparser.parse_args()
+    if options.repeat < 1:
+        optparser.error("--repeat must be at least 1")
+    parsers = [
+        name for name in options.parsers.split(",") if PARSERS[name][1] is not None
+    ]
+    for tree, schema in (("song_data", SONG_SCHEMA), ("log_data", LOG_SCHEMA)):
+        filepaths = get_all_json_files_in_path(os.path.join(options.data_path, tree))
+        results = benchmark_parsers(filepaths, schema, parsers, options.repeat)
+        for name, result in results.items():
+            logging.info(
+                f"{tree} {name}: {result['mb_per_second']:.1f} MB/s, "
+                f"{result['rows_per_second']:.0f} rows/sec"
+            )
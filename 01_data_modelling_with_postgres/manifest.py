@@ -0,0 +1,93 @@
+import hashlib
+import os
+
+from psycopg2.extras import execute_values
+
+from log import config_log
+from sql_queries import loaded_file_select, loaded_file_upsert
+from utils import iter_json_files_in_path
+
+logging = config_log()
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_hash(filepath):
+    """Returns the sha256 hex digest of a file's contents.
+
+    :param filepath: str
+    """
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_fingerprint(filepath):
+    """Returns (path, size, mtime, content hash) for a file.
+
+    :param filepath: str
+    """
+    stat = os.stat(filepath)
+    return filepath, stat.st_size, stat.st_mtime, file_hash(filepath)
+
+
+def load_manifest(cursor):
+    """Returns the manifest as a dict of path -> (size, mtime, content hash).
+
+    :param cursor: psycopg2 cursor
+    """
+    cursor.execute(loaded_file_select)
+    return {path: tuple(fingerprint) for path, *fingerprint in cursor}
+
+
+def is_loaded(filepath, manifest):
+    """Checks if a file is in the manifest and unchanged since it was loaded.
+
+    Size and mtime are checked first so unchanged files are never read. A file
+    that was only touched (new mtime, same content) still counts as loaded.
+
+    :param filepath: str
+    :param manifest: dict - from `load_manifest`
+    """
+    if filepath not in manifest:
+        return False
+
+    size, mtime, content_hash = manifest[filepath]
+    stat = os.stat(filepath)
+    if stat.st_size != size:
+        return False
+    if stat.st_mtime == mtime:
+        return True
+    return file_hash(filepath) == content_hash
+
+
+def files_to_process(cursor, filepath, full_refresh=False, since=None, until=None):
+    """Lazily yields the JSON files under a path that still need to be loaded.
+
+    The manifest is read up front, so the cursor is free again once this
+    returns, but the directory walk only happens as files are consumed.
+
+    :param cursor: psycopg2 cursor
+    :param filepath: str - root path to look for files in
+    :param full_refresh: bool - ignore the manifest and return every file
+    :param since: datetime.date - optional, skip log data before this day
+    :param until: datetime.date - optional, skip log data after this day
+    """
+    all_files = iter_json_files_in_path(filepath, since, until)
+    if full_refresh:
+        return all_files
+
+    manifest = load_manifest(cursor)
+    return (f for f in all_files if not is_loaded(f, manifest))
+
+
+def record_loaded_files(cursor, filepaths):
+    """Adds or updates manifest entries for files. Call this before committing
+    the files' data so both land in the same transaction.
+
+    :param cursor: psycopg2 cursor
+    :param filepaths: list[str]
+    """
+    execute_values(cursor, loaded_file_upsert, [file_fingerprint(f) for f in filepaths])
@@ -0,0 +1,330 @@
+import json
+import math
+import os
+import resource
+import sys
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from log import config_log
+
+logging = config_log()
+
+
+def peak_memory_mb():
+    """Returns the peak resident set size of this process and any finished child
+    processes (e.g. pool workers), in MB.
+    """
+    # ru_maxrss is in bytes on macOS and KB everywhere else
+    unit = 1 if sys.platform == "darwin" else 1024
+    peaks = [
+        resource.getrusage(who).ru_maxrss
+        for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)
+    ]
+    return max(peaks) * unit / (1024 * 1024)
+
+
+PERCENTILES = (0.5, 0.95)
+
+PROMETHEUS_PREFIX = "sparkify_etl"
+
+
+def percentile(samples, q):
+    """Nearest-rank percentile of a list of samples, 0 if there are none.
+
+    :param samples: list[float]
+    :param q: float - between 0 and 1
+
+    """
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[max(math.ceil(q * len(ordered)) - 1, 0)]
+
+
+def write_atomically(path, text):
+    """Writes a file via a temp file + rename, so readers (e.g. the Prometheus
+    node exporter textfile collector) never see a half written file.
+
+    :param path: str
+    :param text: str
+
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+class RunMetrics:
+    """Collects row counts and load timings per table, per call timings of each
+    ETL stage, and samples of gauges (e.g. queue depths), for a single ETL
+    run."""
+
+    def __init__(self):
+        self.rows = defaultdict(int)
+        self.seconds = defaultdict(float)
+        self.skipped = defaultdict(int)
+        self.deduplicated = defaultdict(int)
+        self.stage_seconds = defaultdict(list)
+        self.gauge_samples = defaultdict(list)
+
+    def record_load(self, table, rows, seconds):
+        """Adds a load of `rows` rows into `table` that took `seconds`.
+
+        :param table: str
+        :param rows: int
+        :param seconds: float
+
+        """
+        self.rows[table] += rows
+        self.seconds[table] += seconds
+
+    def record_skipped(self, table, rows):
+        """Counts rows that were left out of a load into `table`.
+
+        :param table: str
+        :param rows: int
+
+        """
+        self.skipped[table] += rows
+
+    def record_deduplicated(self, table, rows):
+        """Counts duplicate writes to `table` that were avoided.
+
+        :param table: str
+        :param rows: int
+
+        """
+        self.deduplicated[table] += rows
+
+    def record_gauge(self, gauge, value):
+        """Adds a sample of a gauge, e.g. how many items are queued right now.
+
+        :param gauge: str
+        :param value: float
+
+        """
+        self.gauge_samples[gauge].append(value)
+
+    @contextmanager
+    def time_load(self, table, rows):
+        """Context manager that records the wrapped block as a load into `table`.
+
+        :param table: str
+        :param rows: int - number of rows written by the block
+
+        """
+        start = time.perf_counter()
+        yield
+        self.record_load(table, rows, time.perf_counter() - start)
+
+    @contextmanager
+    def time_stage(self, stage):
+        """Context manager that records how long the wrapped block took as one
+        sample for `stage` (e.g. "read_json" for one file).
+
+        :param stage: str
+
+        """
+        start = time.perf_counter()
+        yield
+        self.stage_seconds[stage].append(time.perf_counter() - start)
+
+    def merge(self, other):
+        """Adds the counts and timings from another `RunMetrics` into this one.
+
+        :param other: RunMetrics
+
+        """
+        for table, rows in other.rows.items():
+            self.rows[table] += rows
+        for table, seconds in other.seconds.items():
+            self.seconds[table] += seconds
+        for table, rows in other.skipped.items():
+            self.skipped[table] += rows
+        for table, rows in other.deduplicated.items():
+            self.deduplicated[table] += rows
+        for stage, samples in other.stage_seconds.items():
+            self.stage_seconds[stage].extend(samples)
+        for gauge, samples in other.gauge_samples.items():
+            self.gauge_samples[gauge].extend(samples)
+
+    def drain(self):
+        """Returns a copy of the metrics collected so far and resets them.
+
+        Used by worker processes to hand their metrics back to the parent.
+        """
+        drained = RunMetrics()
+        drained.merge(self)
+        self.__init__()
+        return drained
+
+    def total_rows(self):
+        """Returns the number of rows loaded so far, across all tables."""
+        return sum(self.rows.values())
+
+    def rows_per_second(self, table):
+        """Returns the load throughput for a table, 0 if nothing was timed.
+
+        :param table: str
+
+        """
+        seconds = self.seconds.get(table, 0.0)
+        return self.rows.get(table, 0) / seconds if seconds else 0.0
+
+    def stage_summary(self, stage):
+        """Returns count, total and percentile timings for a stage.
+
+        :param stage: str
+
+        """
+        samples = self.stage_seconds[stage]
+        summary = {"count": len(samples), "seconds": sum(samples, 0.0)}
+        for q in PERCENTILES:
+            summary[f"p{int(q * 100)}"] = percentile(samples, q)
+        return summary
+
+    def gauge_summary(self, gauge):
+        """Returns count, max and percentiles of the samples of a gauge.
+
+        :param gauge: str
+
+        """
+        samples = self.gauge_samples[gauge]
+        summary = {"count": len(samples), "max": max(samples, default=0)}
+        for q in PERCENTILES:
+            summary[f"p{int(q * 100)}"] = percentile(samples, q)
+        return summary
+
+    def to_dict(self):
+        """Returns the whole run summary as a JSON-serializable dict."""
+        return {
+            "tables": {
+                table: {
+                    "rows": self.rows.get(table, 0),
+                    "seconds": self.seconds.get(table, 0.0),
+                    "rows_per_second": self.rows_per_second(table),
+                    "skipped": self.skipped.get(table, 0),
+                    "deduplicated": self.deduplicated.get(table, 0),
+                }
+                for table in sorted(
+                    set(self.rows) | set(self.skipped) | set(self.deduplicated)
+                )
+            },
+            "stages": {
+                stage: self.stage_summary(stage) for stage in sorted(self.stage_seconds)
+            },
+            "gauges": {
+                gauge: self.gauge_summary(gauge) for gauge in sorted(self.gauge_samples)
+            },
+            "peak_memory_mb": peak_memory_mb(),
+        }
+
+    def write_json(self, path):
+        """Writes the run summary to a JSON file.
+
+        :param path: str
+
+        """
+        write_atomically(path, json.dumps(self.to_dict(), indent=2))
+
+    def to_prometheus(self):
+        """Returns the run summary in the Prometheus text exposition format."""
+        summary = self.to_dict()
+        p = PROMETHEUS_PREFIX
+        lines = [
+            f"# HELP {p}_stage_seconds Time spent per call of each ETL stage.",
+            f"# TYPE {p}_stage_seconds summary",
+        ]
+        for stage, timings in summary["stages"].items():
+            for q in PERCENTILES:
+                lines.append(
+                    f'{p}_stage_seconds{{stage="{stage}",quantile="{q}"}} '
+                    f'{timings[f"p{int(q * 100)}"]}'
+                )
+            labels = f'{{stage="{stage}"}}'
+            lines.append(f"{p}_stage_seconds_sum{labels} {timings['seconds']}")
+            lines.append(f"{p}_stage_seconds_count{labels} {timings['count']}")
+
+        table_metrics = [
+            ("rows_total", "counter", "rows", "Rows loaded per table."),
+            ("rows_skipped_total", "counter", "skipped", "Rows skipped per table."),
+            (
+                "rows_deduplicated_total",
+                "counter",
+                "deduplicated",
+                "Duplicate writes avoided per table.",
+            ),
+            ("load_seconds_total", "counter", "seconds", "Time spent loading."),
+            ("rows_per_second", "gauge", "rows_per_second", "Load throughput."),
+        ]
+        for name, metric_type, key, help_text in table_metrics:
+            lines.append(f"# HELP {p}_{name} {help_text}")
+            lines.append(f"# TYPE {p}_{name} {metric_type}")
+            for table, values in summary["tables"].items():
+                lines.append(f'{p}_{name}{{table="{table}"}} {values[key]}')
+
+        if summary["gauges"]:
+            lines.append(f"# HELP {p}_gauge Sampled gauges, e.g. queue depths.")
+            lines.append(f"# TYPE {p}_gauge summary")
+        for gauge, values in summary["gauges"].items():
+            for q in PERCENTILES:
+                lines.append(
+                    f'{p}_gauge{{gauge="{gauge}",quantile="{q}"}} '
+                    f'{values[f"p{int(q * 100)}"]}'
+                )
+            lines.append(f'{p}_gauge_count{{gauge="{gauge}"}} {values["count"]}')
+        if summary["gauges"]:
+            lines.append(f"# HELP {p}_gauge_max Highest sample of each gauge.")
+            lines.append(f"# TYPE {p}_gauge_max gauge")
+        for gauge, values in summary["gauges"].items():
+            lines.append(f'{p}_gauge_max{{gauge="{gauge}"}} {values["max"]}')
+
+        lines += [
+            f"# HELP {p}_peak_memory_bytes Peak resident set size of the run.",
+            f"# TYPE {p}_peak_memory_bytes gauge",
+            f"{p}_peak_memory_bytes {int(summary['peak_memory_mb'] * 1024 * 1024)}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """Writes the run summary as a Prometheus textfile.
+
+        :param path: str - usually a `*.prom` file in the node exporter's
+            textfile collector directory
+
+        """
+        write_atomically(path, self.to_prometheus())
+
+    def log_summary(self):
+        """Logs one throughput line per table that was loaded, any skips, stage
+        timings, gauges and the peak memory use of the run."""
+        for table in sorted(self.rows):
+            logging.info(
+                f"{table}: {self.rows[table]} rows in {self.seconds[table]:.2f}s "
+                f"({self.rows_per_second(table):.0f} rows/sec)"
+            )
+        for table in sorted(self.skipped):
+            logging.info(f"{table}: {self.skipped[table]} rows skipped")
+        for table in sorted(self.deduplicated):
+            logging.info(
+                f"{table}: {self.deduplicated[table]} duplicate writes avoided"
+            )
+        for stage in sorted(self.stage_seconds):
+            summary = self.stage_summary(stage)
+            logging.info(
+                f"{stage}: {summary['count']} calls, {summary['seconds']:.2f}s total, "
+                f"p50 {summary['p50'] * 1000:.1f}ms, p95 {summary['p95'] * 1000:.1f}ms"
+            )
+        for gauge in sorted(self.gauge_samples):
+            summary = self.gauge_summary(gauge)
+            logging.info(
+                f"{gauge}: {summary['count']} samples, p50 {summary['p50']:g}, "
+                f"p95 {summary['p95']:g}, max {summary['max']:g}"
+            )
+        logging.info(f"Peak memory: {peak_memory_mb():.1f} MB")
+
+
+run_metrics = RunMetrics()
@@ -0,0 +1,132 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import bulk_load
+import db
+import manifest
+import partitions
+from dedup import run_deduplicator
+from log import config_log
+from metrics import run_metrics
+from utils import chunked
+
+logging = config_log()
+
+# Each worker process keeps its own connection and cursor for its lifetime.
+_worker = {}
+
+
+def init_worker(load_mode):
+    """Process pool initializer. Checks out the worker's DB connection from its
+    own pool, with the session settings for the load mode.
+
+    :param load_mode: str - `etl.LOAD_MODES` key, "copy" needs staging tables
+
+    """
+    # forked workers start with a copy of the parent's metrics, which the parent
+    # already has, drop them so they aren't sent back and merged twice
+    run_metrics.drain()
+
+    conn = db.checkout(db.load_session_settings(load_mode))
+    cur = conn.cursor()
+
+    # creating partitions here would deadlock against the other workers, they're
+    # created before the pool starts
+    partitions.set_create_in_load(False)
+
+    if load_mode == "copy":
+        bulk_load.create_staging_tables(cur)
+        conn.commit()
+
+    _worker["conn"] = conn
+    _worker["cur"] = cur
+
+
+def process_in_worker(func, work):
+    """Runs a file processing function inside a worker and commits.
+
+    Exceptions are caught and rolled back, so one bad file doesn't take the
+    worker or the run down with it.
+
+    :param func: function(cur, work) - file processing function
+    :param work: str | list[str] - a filepath, or a batch of them
+
+    Returns a tuple of (work, error message or None, metrics for this work).
+    """
+    conn, cur = _worker["conn"], _worker["cur"]
+    try:
+        func(cur, work)
+        manifest.record_loaded_files(cur, work if isinstance(work, list) else [work])
+        conn.commit()
+        run_deduplicator.confirm()
+        error = None
+    except Exception as e:
+        conn.rollback()
+        run_deduplicator.discard()
+        error = f"{type(e).__name__}: {e}"
+
+    return work, error, run_metrics.drain()
+
+
+def process_data_parallel(
+    filepath,
+    func,
+    workers,
+    load_mode,
+    batch_size=None,
+    full_refresh=False,
+    since=None,
+    until=None,
+):
+    """Parallel version of `etl.process_data`.
+
+    Files are handed out to a pool of worker processes, each with its own DB
+    connection, and committed by the worker that processed them. Everything
+    is committed by the time this returns, so callers can rely on ordering
+    between calls (e.g. song data before log data).
+
+    :param filepath: str - root path to look for files in
+    :param func: function(cur, filepath) or function(cur, filepaths) if
+        `batch_size` is set
+    :param workers: int - number of worker processes
+    :param load_mode: str - `etl.LOAD_MODES` key, "copy" needs staging tables
+    :param batch_size: int - optional, hand out files in batches of this size
+    :param full_refresh: bool - process every file, even ones in the manifest
+    :param since: datetime.date - optional, skip log data before this day
+    :param until: datetime.date - optional, skip log data after this day
+
+    Returns a list of (work, error message) for everything that failed.
+    """
+    with db.connection() as conn:
+        all_files = list(
+            manifest.files_to_process(
+                conn.cursor(), filepath, full_refresh, since, until
+            )
+        )
+    # forked workers must not inherit this process' pooled connections
+    db.close_pool()
+    number_of_files = len(all_files)
+    logging.info(f"{number_of_files} files found in {filepath}, {workers} workers")
+
+    work_items = list(chunked(all_files, batch_size)) if batch_size else all_files
+    failures = []
+    processed = 0
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=init_worker,
+        initargs=(load_mode,),
+    ) as executor:
+        futures = [executor.submit(process_in_worker, func, w) for w in work_items]
+
+        for future in as_completed(futures):
+            work, error, work_metrics = future.result()
+            run_metrics.merge(work_metrics)
+
+            if error:
+                failures.append((work, error))
+                logging.error(f"Failed to process {work}: {error}")
+
+            processed += len(work) if batch_size else 1
+            logging.info(f"{processed}/{number_of_files} files processed.")
+
+    return failures
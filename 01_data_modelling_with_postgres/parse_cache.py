@@ -0,0 +1,267 @@
+import hashlib
+import optparse
+import os
+
+from log import config_log
+from metrics import run_metrics
+from utils import absolute_path, get_all_json_files_in_path
+
+try:
+    from pyarrow import feather
+except ImportError:
+    feather = None
+
+logging = config_log()
+
+DEFAULT_CACHE_DIR = ".parse_cache"
+DEFAULT_MAX_MB = 1024
+ENTRY_SUFFIX = ".feather"
+
+# Eviction frees the cache down to this share of its limit, so the next puts
+# don't each have to evict again
+LOW_WATER_MARK = 0.9
+
+
+def path_key(filepath):
+    """Returns the part of a cache entry name that identifies the source file.
+
+    :param filepath: str
+
+    """
+    return hashlib.sha1(absolute_path(filepath).encode("utf8")).hexdigest()
+
+
+def version_key(filepath, schema):
+    """Returns the part of a cache entry name that identifies the version of the
+    source file (size and mtime) and the schema it was parsed with.
+
+    :param filepath: str
+    :param schema: dict - column name -> dtype
+
+    """
+    stat = os.stat(filepath)
+    version = f"{stat.st_size}:{stat.st_mtime_ns}:{sorted(schema.items())}"
+    return hashlib.sha1(version.encode("utf8")).hexdigest()[:16]
+
+
+def require_feather():
+    """Returns `pyarrow.feather`, which entries are read and written with."""
+    if feather is None:
+        raise ImportError("The parse cache needs `pip install pyarrow`")
+    return feather
+
+
+class ParseCache:
+    """Feather files of already parsed JSON files, keyed by path, size, mtime and
+    schema, so unchanged files skip JSON parsing on later runs (e.g. with
+    `--full-refresh`, or when a run is retried). Entries are written
+    uncompressed and memory mapped when read. Needs pyarrow.
+
+    The cache is bounded to `max_bytes`; once it goes over, the least recently
+    used entries are evicted until it's down to `LOW_WATER_MARK` of that. An
+    entry is only ever served for the exact file version it was made from,
+    entries for older versions are never read again and age out.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_MB << 20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._size = None
+
+    def entries(self):
+        """Returns a list of (path, size, mtime) of every cache entry."""
+        if not os.path.isdir(self.directory):
+            return []
+
+        entries = []
+        with os.scandir(self.directory) as scanned:
+            for entry in scanned:
+                if not entry.name.endswith(ENTRY_SUFFIX):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((entry.path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def entry_path(self, filepath, schema):
+        """Returns where the cache entry for a file's current version goes.
+
+        :param filepath: str
+        :param schema: dict - column name -> dtype
+
+        """
+        name = f"{path_key(filepath)}-{version_key(filepath, schema)}{ENTRY_SUFFIX}"
+        return os.path.join(self.directory, name)
+
+    def get(self, filepath, schema):
+        """Returns the cached dataframe for a file, or None if there's no entry
+        for its current version.
+
+        :param filepath: str
+        :param schema: dict - column name -> dtype
+
+        """
+        entry = self.entry_path(filepath, schema)
+        try:
+            with run_metrics.time_stage("parse_cache_read"):
+                # memory mapped, not read through a file handle: entries are
+                # uncompressed, so Arrow can use the mapped pages as they are
+                table = require_feather().read_table(entry, memory_map=True)
+                df = table.to_pandas()
+        except FileNotFoundError:
+            return None
+
+        # mtime is the last use, for eviction
+        os.utime(entry)
+        return df
+
+    def put(self, filepath, schema, df):
+        """Caches the parsed dataframe of a file, and evicts entries if the cache
+        grew too big.
+
+        :param filepath: str
+        :param schema: dict - column name -> dtype
+        :param df: pd.DataFrame - as returned by `json_parsers.parse`
+
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        entry = self.entry_path(filepath, schema)
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self.entries())
+        # a replaced entry (e.g. written by another worker too) counts once
+        self._size -= entry_size(entry)
+
+        with run_metrics.time_stage("parse_cache_write"):
+            # written aside and renamed, so concurrent workers never read a
+            # half written entry
+            tmp_entry = f"{entry}.{os.getpid()}.tmp"
+            require_feather().write_feather(df, tmp_entry, compression="uncompressed")
+            os.replace(tmp_entry, entry)
+
+        self._size += entry_size(entry)
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Removes the least recently used entries until the cache is down to
+        `LOW_WATER_MARK` of `max_bytes`.
+        """
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        size = sum(size for _, size, _ in entries)
+        target = self.max_bytes * LOW_WATER_MARK
+        evicted = 0
+
+        for path, size_of_entry, _ in entries:
+            if size <= target:
+                break
+            remove_entry(path)
+            size -= size_of_entry
+            evicted += 1
+
+        self._size = size
+        if evicted:
+            logging.debug(f"Evicted {evicted} parse cache entries")
+
+    def invalidate_paths(self, filepaths):
+        """Removes every cached version of some files.
+
+        Returns the number of entries removed.
+
+        :param filepaths: list[str]
+
+        """
+        prefixes = {path_key(filepath) for filepath in filepaths}
+        removed = 0
+        for path, _, _ in self.entries():
+            if os.path.basename(path).split("-", 1)[0] in prefixes:
+                remove_entry(path)
+                removed += 1
+        return removed
+
+    def clear(self):
+        """Removes every entry. Returns the number of entries removed."""
+        entries = self.entries()
+        for path, _, _ in entries:
+            remove_entry(path)
+        self._size = 0
+        return len(entries)
+
+
+def entry_size(path):
+    """Returns the size of a cache entry, 0 if there is none.
+
+    :param path: str
+
+    """
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+def remove_entry(path):
+    """Removes a cache entry, if another process hasn't already.
+
+    :param path: str
+
+    """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def invalidate(cache, paths):
+    """Drops cache entries for files, or for every JSON file under directories.
+    With no paths, the whole cache is cleared.
+
+    Returns the number of entries removed.
+
+    :param cache: ParseCache
+    :param paths: list[str] - files and/or directories
+
+    """
+    if not paths:
+        return cache.clear()
+
+    filepaths = []
+    for path in paths:
+        if os.path.isdir(path):
+            filepaths += get_all_json_files_in_path(path)
+        else:
+            filepaths.append(path)
+    return cache.invalidate_paths(filepaths)
+
+
+def get_opt_parser():
+    """
+    Returns an option parser instance for the parse cache's command line options.
+    """
+    optparser = optparse.OptionParser(
+        usage="%prog [options] invalidate [PATH ...] | stats"
+    )
+    optparser.add_option(
+        "--cache-dir",
+        dest="cache_dir",
+        default=DEFAULT_CACHE_DIR,
+        help=f"Parse cache directory (default: {DEFAULT_CACHE_DIR})",
+    )
+    return optparser
+
+
+if __name__ == "__main__":
+    optparser = get_opt_parser()
+    options, args = optparser.parse_args()
+    cache = ParseCache(options.cache_dir)
+
+    if args[:1] == ["invalidate"]:
+        removed = invalidate(cache, args[1:])
+        logging.info(f"Removed {removed} parse cache entries")
+    elif args == ["stats"]:
+        entries = cache.entries()
+        size_mb = sum(size for _, size, _ in entries) / (1024 * 1024)
+        logging.info(f"{len(entries)} parse cache entries, {size_mb:.1f} MB")
+    else:
+        optparser.error("expected a command: invalidate or stats")
@@ -0,0 +1,273 @@
+import optparse
+import os
+from datetime import date, datetime
+
+import db
+from log import config_log
+from sql_queries import (songplay_partition_attach, songplay_partition_create,
+                         songplay_partition_detach, songplay_partition_names_select,
+                         songplay_partition_truncate, songplay_partitions_select)
+from utils import DATE_PREFIX, iter_json_files_in_path
+
+logging = config_log()
+
+# Whether loads may create missing partitions in their own transaction, see
+# `ensure_load_partitions`
+_settings = {"create_in_load": True}
+
+
+def partition_name(month):
+    """Returns the name of the `songplays` partition for a month.
+
+    :param month: datetime.date - any day of the month
+    """
+    return f"songplays_{month:%Y_%m}"
+
+
+def month_bounds(month):
+    """Returns the (inclusive start, exclusive end) dates of a month.
+
+    :param month: datetime.date - any day of the month
+    """
+    start = date(month.year, month.month, 1)
+    if month.month == 12:
+        return start, date(month.year + 1, 1, 1)
+    return start, date(month.year, month.month + 1, 1)
+
+
+def months_of(start_times):
+    """Returns the distinct months in a series of timestamps, as the first day of
+    each month.
+
+    :param start_times: pd.Series - datetimes
+    """
+    year_months = (start_times.dt.year * 100 + start_times.dt.month).dropna().unique()
+    return {date(int(ym) // 100, int(ym) % 100, 1) for ym in year_months}
+
+
+def missing_months(cursor, months):
+    """Returns the months that have no `songplays` partition yet, sorted.
+
+    :param cursor: psycopg2 cursor
+    :param months: Iterable[datetime.date]
+    """
+    months = set(months)
+    if not months:
+        return []
+
+    cursor.execute(songplay_partition_names_select)
+    existing = {name for (name,) in cursor.fetchall()}
+    return sorted(month for month in months if partition_name(month) not in existing)
+
+
+def ensure_partitions(cursor, months):
+    """Creates the `songplays` partitions that are missing for some months, in
+    the caller's transaction.
+
+    `CREATE TABLE ... PARTITION OF songplays` takes a SHARE ROW EXCLUSIVE lock
+    on `songplays`, and, once the foreign keys are in place, on `users` and
+    `times` too. Run it in a transaction that hasn't written to those tables
+    while other loaders have transactions open on them, or it deadlocks against
+    them; `create_partitions` does that.
+
+    :param cursor: psycopg2 cursor
+    :param months: Iterable[datetime.date]
+    """
+    for month in missing_months(cursor, months):
+        name = partition_name(month)
+        start, end = month_bounds(month)
+        cursor.execute(
+            songplay_partition_create.format(name=name), {"start": start, "end": end}
+        )
+        logging.info(f"Created partition {name}")
+
+
+def create_partitions(months):
+    """Creates the `songplays` partitions that are missing for some months in a
+    short transaction of its own, and commits. Call it before loaders start.
+
+    :param months: Iterable[datetime.date]
+    """
+    with db.connection() as conn:
+        ensure_partitions(conn.cursor(), months)
+        conn.commit()
+
+
+def log_file_months(filepath, since=None, until=None):
+    """Returns the months of the log files under a path, going by their
+    `YYYY-MM-DD-events.json` names. Files named otherwise are skipped.
+
+    :param filepath: str - root of the log data
+    :param since: datetime.date - optional, see `utils.in_date_range`
+    :param until: datetime.date - optional, see `utils.in_date_range`
+    """
+    months = set()
+    for path in iter_json_files_in_path(filepath, since, until):
+        match = DATE_PREFIX.match(os.path.basename(path))
+        if match:
+            year, month, _ = map(int, match.groups())
+            months.add(date(year, month, 1))
+    return months
+
+
+def set_create_in_load(create):
+    """Sets whether loads may create missing partitions in their own
+    transaction. Turned off in parallel workers, where it would deadlock.
+
+    :param create: bool
+    """
+    _settings["create_in_load"] = create
+
+
+def ensure_load_partitions(cursor, months):
+    """Makes sure the `songplays` partitions for some months exist before a
+    load inserts rows into them.
+
+    Only a single writer (no `--workers`) creates missing ones, in its own
+    transaction, since nothing else can be holding locks it would wait on.
+    Parallel workers rely on `create_partitions` having run before them, and
+    raise instead, which rejects the file.
+
+    :param cursor: psycopg2 cursor
+    :param months: Iterable[datetime.date]
+    """
+    if _settings["create_in_load"]:
+        ensure_partitions(cursor, months)
+        return
+
+    missing = missing_months(cursor, months)
+    if missing:
+        raise ValueError(
+            "No songplays partition for "
+            + ", ".join(f"{month:%Y-%m}" for month in missing)
+            + ", create them with `python partitions.py create` first"
+        )
+
+
+def ensure_partitions_for(cursor, start_times):
+    """Makes sure the `songplays` partitions needed to insert rows with these
+    start times exist, see `ensure_load_partitions`.
+
+    :param cursor: psycopg2 cursor
+    :param start_times: pd.Series - datetimes
+    """
+    ensure_load_partitions(cursor, months_of(start_times))
+
+
+def attach_partition(cursor, month):
+    """Attaches a standalone `songplays_YYYY_MM` table (e.g. one that was
+    detached earlier) as the partition for its month. Postgres checks every
+    row falls in the month.
+
+    :param cursor: psycopg2 cursor
+    :param month: datetime.date
+    """
+    start, end = month_bounds(month)
+    cursor.execute(
+        songplay_partition_attach.format(name=partition_name(month)),
+        {"start": start, "end": end},
+    )
+
+
+def detach_partition(cursor, month):
+    """Detaches a month's partition from `songplays`. The table and its rows are
+    kept, e.g. for archiving, and can be attached again.
+
+    :param cursor: psycopg2 cursor
+    :param month: datetime.date
+    """
+    cursor.execute(songplay_partition_detach.format(name=partition_name(month)))
+
+
+def truncate_partition(cursor, month):
+    """Deletes every songplay of a month, without touching the other months.
+
+    :param cursor: psycopg2 cursor
+    :param month: datetime.date
+    """
+    cursor.execute(songplay_partition_truncate.format(name=partition_name(month)))
+
+
+def parse_month(text):
+    """Parses a YYYY-MM month.
+
+    :param text: str
+    """
+    return datetime.strptime(text, "%Y-%m").date()
+
+
+def months_between(first, last):
+    """Returns every month from `first` to `last`, both included.
+
+    :param first: datetime.date
+    :param last: datetime.date
+    """
+    months = []
+    month = date(first.year, first.month, 1)
+    while month <= last:
+        months.append(month)
+        month = month_bounds(month)[1]
+    return months
+
+
+# partitions.py commands that change a single month, see `main`
+MONTH_COMMANDS = {
+    "attach": attach_partition,
+    "detach": detach_partition,
+    "truncate": truncate_partition,
+}
+
+
+def main(command, months):
+    """Runs a partition management command and commits.
+
+    :param command: str - list | create | attach | detach | truncate
+    :param months: list[datetime.date] - one month, or a first and last month
+        for create
+    """
+    with db.connection() as conn:
+        cur = conn.cursor()
+
+        if command == "list":
+            cur.execute(songplay_partitions_select)
+            for name, bounds, rows in cur.fetchall():
+                logging.info(f"{name}: {bounds}, ~{max(rows, 0)} rows")
+        elif command == "create":
+            ensure_partitions(cur, months_between(months[0], months[-1]))
+        else:
+            MONTH_COMMANDS[command](cur, months[0])
+            logging.info(f"{command} {partition_name(months[0])} done")
+            if command == "truncate":
+                logging.warning(
+                    "Aggregates still count the truncated songplays, run "
+                    "`python aggregates.py --rebuild`"
+                )
+
+        conn.commit()
+
+    db.close_pool()
+
+
+def get_opt_parser():
+    """
+    Returns an option parser instance for the partition commands.
+    """
+    return optparse.OptionParser(
+        usage="%prog list | create FIRST_MONTH [LAST_MONTH] | "
+        "attach MONTH | detach MONTH | truncate MONTH\n\n"
+        "Months are YYYY-MM."
+    )
+
+
+if __name__ == "__main__":
+    optparser = get_opt_parser()
+    options, args = optparser.parse_args()
+
+    if args[:1] == ["list"] and len(args) == 1:
+        main("list", [])
+    elif args[:1] == ["create"] and len(args) in (2, 3):
+        main("create", [parse_month(month) for month in args[1:]])
+    elif args[:1] and args[0] in MONTH_COMMANDS and len(args) == 2:
+        main(args[0], [parse_month(args[1])])
+    else:
+        optparser.error("expected list, create, attach, detach or truncate")
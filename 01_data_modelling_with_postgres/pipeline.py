@@ -0,0 +1,225 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import json_parsers
+import manifest
+from dedup import run_deduplicator
+from log import config_log
+from metrics import run_metrics
+from transactions import CommitPolicy, run_in_savepoint
+from utils import chunked
+
+logging = config_log()
+
+# Put on the queue after the last work item
+DONE = None
+
+
+def parse_in_worker(parse, work):
+    """Runs a parse function in a parser process.
+
+    Returns a tuple of (parsed data, metrics recorded while parsing).
+
+    :param parse: function(work) - e.g. `etl.next_song_data_from_logfile`
+    :param work: str | list[str] - a filepath, or a batch of them
+    """
+    return parse(work), run_metrics.drain()
+
+
+def write_parsed(cur, write, data, work):
+    """Writes parsed data and records its file(s) in the manifest.
+
+    :param cur: psycopg2 cursor
+    :param write: function(data, cursor) - e.g. `etl.load_next_song_data`
+    :param data: whatever `parse` returned for `work`
+    :param work: str | list[str] - a filepath, or a batch of them
+    """
+    write(data, cur)
+    manifest.record_loaded_files(cur, work if isinstance(work, list) else [work])
+
+
+def write_work_item(cur, conn, write, work, data, commit_policy):
+    """Writes one parsed work item in its own savepoint and commits if the
+    commit policy says so. Runs on the writer thread.
+
+    Returns None on success, or the error message.
+
+    :param cur: psycopg2 cursor
+    :param conn: psycopg2 connection
+    :param write: function(data, cursor)
+    :param work: str | list[str] - a filepath, or a batch of them
+    :param data: whatever `parse` returned for `work`
+    :param commit_policy: CommitPolicy
+    """
+    error = run_in_savepoint(cur, write_parsed, write, data, work)
+    if error:
+        run_deduplicator.discard()
+    else:
+        run_deduplicator.confirm()
+
+    commit_policy.add_files(len(work) if isinstance(work, list) else 1)
+    commit_policy.maybe_commit(conn)
+    return error
+
+
+async def produce(work_items, parse, parser_pool, queue):
+    """Starts parsing each work item in the parser pool and queues
+    (work, future) pairs in order.
+
+    The queue is bounded, so once it's full this waits for the writer, and
+    parsing never gets more than `queue.maxsize` items ahead. The time spent
+    waiting is recorded as the "pipeline_producer_stall" stage.
+
+    :param work_items: Iterable[str] | Iterable[list[str]]
+    :param parse: function(work)
+    :param parser_pool: concurrent.futures.Executor
+    :param queue: asyncio.Queue
+    """
+    loop = asyncio.get_running_loop()
+    for work in work_items:
+        future = loop.run_in_executor(parser_pool, parse_in_worker, parse, work)
+        with run_metrics.time_stage("pipeline_producer_stall"):
+            await queue.put((work, future))
+    await queue.put(DONE)
+
+
+async def consume(cur, conn, write, queue, commit_policy):
+    """Writes queued work items in order on a single writer thread, so the
+    event loop stays free to keep the parsers busy.
+
+    Time spent waiting for the next parsed item is recorded as the
+    "pipeline_consumer_stall" stage, and the queue depth is sampled before
+    every item as the "pipeline_queue_depth" gauge.
+
+    Returns a list of (work, error message) for the rejected files.
+
+    :param cur: psycopg2 cursor
+    :param conn: psycopg2 connection
+    :param write: function(data, cursor)
+    :param queue: asyncio.Queue
+    :param commit_policy: CommitPolicy
+    """
+    loop = asyncio.get_running_loop()
+    rejects = []
+    processed = 0
+
+    with ThreadPoolExecutor(max_workers=1) as writer:
+        while True:
+            run_metrics.record_gauge("pipeline_queue_depth", queue.qsize())
+            with run_metrics.time_stage("pipeline_consumer_stall"):
+                item = await queue.get()
+                if item is DONE:
+                    break
+
+                work, future = item
+                try:
+                    data, parse_metrics = await future
+                    run_metrics.merge(parse_metrics)
+                    error = None
+                except Exception as e:
+                    data = None
+                    error = f"{type(e).__name__}: {e}"
+
+            if not error:
+                error = await loop.run_in_executor(
+                    writer,
+                    write_work_item,
+                    cur,
+                    conn,
+                    write,
+                    work,
+                    data,
+                    commit_policy,
+                )
+            if error:
+                rejects.append((work, error))
+                logging.error(f"Rejected {work}: {error}")
+
+            processed += len(work) if isinstance(work, list) else 1
+            logging.info(f"{processed} files processed.")
+
+        await loop.run_in_executor(writer, commit_policy.commit, conn)
+
+    return rejects
+
+
+async def run_pipeline(cur, conn, work_items, parse, write, depth, parsers, policy):
+    """Runs the producer and the consumer side by side until every work item is
+    written.
+
+    :param cur: psycopg2 cursor
+    :param conn: psycopg2 connection
+    :param work_items: Iterable[str] | Iterable[list[str]]
+    :param parse: function(work)
+    :param write: function(data, cursor)
+    :param depth: int - queue size
+    :param parsers: int - number of parser processes
+    :param policy: CommitPolicy
+    """
+    queue = asyncio.Queue(maxsize=depth)
+
+    # spawned, not forked: this process holds an open DB connection
+    with ProcessPoolExecutor(
+        max_workers=parsers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=json_parsers.configure,
+        initargs=json_parsers.current_configuration(),
+    ) as parser_pool:
+        _, rejects = await asyncio.gather(
+            produce(work_items, parse, parser_pool, queue),
+            consume(cur, conn, write, queue, policy),
+        )
+    return rejects
+
+
+def process_data_pipelined(
+    cur,
+    conn,
+    filepath,
+    parse,
+    write,
+    depth,
+    parsers=1,
+    batch_size=None,
+    full_refresh=False,
+    commit_policy=None,
+    since=None,
+    until=None,
+):
+    """Pipelined version of `etl.process_data`.
+
+    Files are parsed in a pool of `parsers` processes while earlier files are
+    being written, so a run takes about as long as the slower of the two
+    instead of their sum. Up to `depth` parsed files wait in a bounded queue
+    between them. Writes happen in file order, each file in its own savepoint.
+
+    Returns a list of (work, error message) for the rejected files.
+
+    :param cur: psycopg2 cursor
+    :param conn: psycopg2 connection
+    :param filepath: str - root path to look for files in
+    :param parse: function(work) - reads and transforms a file, or a batch of
+        files if `batch_size` is set
+    :param write: function(data, cursor) - writes what `parse` returned
+    :param depth: int - how many parsed files can be queued for the writer
+    :param parsers: int - number of parser processes
+    :param batch_size: int - optional, parse and write files in batches of
+        this size
+    :param full_refresh: bool - process every file, loaded or not
+    :param commit_policy: CommitPolicy - defaults to a commit per file (or
+        batch)
+    :param since: datetime.date - optional, skip log data before this day
+    :param until: datetime.date - optional, skip log data after this day
+    """
+    logging.info(f"Processing files in {filepath}, pipeline depth {depth}")
+    # `files_to_process` reads the manifest with `cur` right here, before the
+    # pipeline starts and the writer thread takes the cursor over
+    work_items = manifest.files_to_process(cur, filepath, full_refresh, since, until)
+    if batch_size:
+        work_items = chunked(work_items, batch_size)
+
+    policy = commit_policy or CommitPolicy(every_files=batch_size or 1)
+    return asyncio.run(
+        run_pipeline(cur, conn, work_items, parse, write, depth, parsers, policy)
+    )
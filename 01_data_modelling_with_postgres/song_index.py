@@ -0,0 +1,121 @@
+import pandas as pd
+
+from log import config_log
+from sql_queries import song_lookup_select
+
+logging = config_log()
+
+# `songs.duration` is decimal(9, 5), so round lengths to the same precision to
+# make floats from the logs and Decimals from the DB hash to the same key.
+DURATION_PRECISION = 5
+
+
+def duration_key(duration):
+    """Normalizes a song duration/length for use in a lookup key.
+
+    :param duration: float | Decimal
+
+    """
+    return round(float(duration), DURATION_PRECISION)
+
+
+class SongLookupIndex:
+    """In-memory (title, artist name, duration) -> (song_id, artist_id) index.
+
+    Replaces a `song_select` round trip per log event with a dict probe, or a
+    single dataframe merge for a whole file.
+    """
+
+    def __init__(self):
+        self._index = {}
+        self._frame = None
+        self.loaded = False
+
+    def __len__(self):
+        return len(self._index)
+
+    def add(self, title, artist_name, duration, song_id, artist_id):
+        """Adds a song to the index. The first song seen for a key wins, the same
+        as `fetchone()` on `song_select`.
+
+        :param title: str
+        :param artist_name: str
+        :param duration: float | Decimal
+        :param song_id: str
+        :param artist_id: str
+
+        """
+        key = (title, artist_name, duration_key(duration))
+        if key not in self._index:
+            self._index[key] = (song_id, artist_id)
+            self._frame = None
+
+    def load(self, cursor):
+        """(Re)builds the index from the `songs` and `artists` tables.
+
+        :param cursor: psycopg2 cursor
+
+        """
+        self._index = {}
+        self._frame = None
+        cursor.execute(song_lookup_select)
+        for row in cursor.fetchall():
+            self.add(*row)
+        self.loaded = True
+        logging.info(f"{len(self)} songs loaded into the song lookup index")
+
+    def ensure_loaded(self, cursor):
+        """Builds the index from the DB unless it has been built already.
+
+        :param cursor: psycopg2 cursor
+
+        """
+        if not self.loaded:
+            self.load(cursor)
+
+    def lookup(self, title, artist_name, length):
+        """Returns (song_id, artist_id) for a log event, (None, None) if unknown.
+
+        :param title: str
+        :param artist_name: str
+        :param length: float
+
+        """
+        return self._index.get((title, artist_name, duration_key(length)), (None, None))
+
+    def to_dataframe(self):
+        """Returns the index as a dataframe keyed by song, artist and length.
+
+        The dataframe is cached until the index changes.
+        """
+        if self._frame is None:
+            self._frame = pd.DataFrame(
+                [key + ids for key, ids in self._index.items()],
+                columns=["song", "artist", "lengthKey", "songId", "artistId"],
+            )
+        return self._frame
+
+    def resolve(self, df):
+        """Adds `songId` and `artistId` columns to a dataframe of log events with
+        a single merge. Unmatched events get None for both.
+
+        :param df: pd.DataFrame - with song, artist and length columns
+
+        """
+        length_keys = df["length"].astype(float).round(DURATION_PRECISION)
+        resolved = df.assign(lengthKey=length_keys).merge(
+            self.to_dataframe(),
+            how="left",
+            on=["song", "artist", "lengthKey"],
+            validate="many_to_one",
+        )
+        resolved.index = df.index
+
+        ids = ["songId", "artistId"]
+        resolved[ids] = (
+            resolved[ids].astype(object).where(resolved[ids].notnull(), None)
+        )
+        return resolved.drop(columns=["lengthKey"])
+
+
+song_lookup_index = SongLookupIndex()
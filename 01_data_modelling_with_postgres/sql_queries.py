@@ -6,6 +6,7 @@ song_table_drop = "DROP TABLE IF EXISTS songs;"
 artist_table_drop = "DROP TABLE IF EXISTS artists;"
 time_table_drop = "DROP TABLE IF EXISTS times;"
 valid_plan_level_drop = "DROP TABLE IF EXISTS valid_plan_levels"
+loaded_file_drop = "DROP TABLE IF EXISTS loaded_files;"
 
 # CREATE TABLES
 
@@ -22,15 +23,15 @@ INSERT INTO valid_plan_levels (level) VALUES
 songplay_table_create = """
 CREATE TABLE IF NOT EXISTS songplays (
     songplay_id SERIAL,
-    start_time timestamp without time zone REFERENCES times (start_time) ON UPDATE CASCADE,
-    user_id integer REFERENCES users (user_id) ON UPDATE CASCADE,
-    level VARCHAR(255) REFERENCES valid_plan_levels (level) ON UPDATE CASCADE,
-    song_id VARCHAR(255) REFERENCES songs (song_id) ON UPDATE CASCADE,
-    artist_id VARCHAR(255) REFERENCES artists (artist_id) ON UPDATE CASCADE,
+    start_time timestamp without time zone,
+    user_id integer,
+    level VARCHAR(255),
+    song_id VARCHAR(255),
+    artist_id VARCHAR(255),
     session_id integer NOT NULL,
     location TEXT NOT NULL,
     user_agent TEXT NOT NULL
-)
+) PARTITION BY RANGE (start_time)
 """
 
 user_table_create = """
@@ -39,7 +40,7 @@ CREATE TABLE IF NOT EXISTS users (
     first_name VARCHAR(255) NOT NULL,
     last_name VARCHAR(255) NOT NULL,
     gender VARCHAR(255) NOT NULL,
-    level VARCHAR(255) REFERENCES valid_plan_levels (level) ON UPDATE CASCADE
+    level VARCHAR(255)
 )
 """
 
@@ -47,7 +48,7 @@ song_table_create = """
 CREATE TABLE IF NOT EXISTS songs (
     song_id VARCHAR(255) PRIMARY KEY,
     title VARCHAR(255) NOT NULL,
-    artist_id VARCHAR(255) REFERENCES artists (artist_id) ON UPDATE CASCADE,
+    artist_id VARCHAR(255),
     year integer NOT NULL ,
     duration decimal(9, 5) NOT NULL
 )
@@ -76,6 +77,75 @@ CREATE TABLE IF NOT EXISTS times (
 
 """
 
+loaded_file_create = """
+CREATE TABLE IF NOT EXISTS loaded_files (
+    path TEXT PRIMARY KEY,
+    size bigint NOT NULL,
+    mtime double precision NOT NULL,
+    content_hash VARCHAR(64) NOT NULL,
+    loaded_at timestamp without time zone NOT NULL DEFAULT now()
+)
+"""
+
+# CONSTRAINTS AND INDEXES
+#
+# Kept out of the CREATE TABLEs so `create_tables.py --bulk-load` can add them
+# after the data is in. The dimension primary keys stay in the CREATE TABLEs,
+# the ON CONFLICT upserts need them while loading.
+
+# Partitioned, so the partition key has to be part of it
+songplay_primary_key_add = """
+ALTER TABLE songplays ADD CONSTRAINT songplays_pkey
+    PRIMARY KEY (songplay_id, start_time);
+"""
+
+# Tables the ETL loads, and how many rows one holds, for `benchmark.py`
+loaded_tables = ["songs", "artists", "users", "times", "songplays"]
+
+table_rows_select = """
+SELECT count(*) FROM {table};
+"""
+
+songplay_duplicate_ids_select = """
+SELECT count(*) FROM (
+    SELECT songplay_id FROM songplays GROUP BY songplay_id HAVING count(*) > 1
+) as duplicates;
+"""
+
+# (table, column, referenced table, referenced column)
+foreign_keys = [
+    ("users", "level", "valid_plan_levels", "level"),
+    ("songs", "artist_id", "artists", "artist_id"),
+    ("songplays", "start_time", "times", "start_time"),
+    ("songplays", "user_id", "users", "user_id"),
+    ("songplays", "level", "valid_plan_levels", "level"),
+    ("songplays", "song_id", "songs", "song_id"),
+    ("songplays", "artist_id", "artists", "artist_id"),
+]
+
+foreign_key_add = """
+ALTER TABLE {table} ADD CONSTRAINT {table}_{column}_fkey
+    FOREIGN KEY ({column}) REFERENCES {ref_table} ({ref_column}) ON UPDATE CASCADE;
+"""
+
+foreign_key_orphans_select = """
+SELECT count(*) FROM {table} as t
+WHERE t.{column} IS NOT NULL
+AND NOT EXISTS (
+    SELECT 1 FROM {ref_table} as r WHERE r.{ref_column} = t.{column}
+);
+"""
+
+# Serve the title/name/duration filters in `song_select` and the songplay
+# staging upsert
+song_lookup_index_create = """
+CREATE INDEX IF NOT EXISTS songs_title_duration_idx ON songs (title, duration);
+"""
+
+artist_name_index_create = """
+CREATE INDEX IF NOT EXISTS artists_name_idx ON artists (name);
+"""
+
 # INSERT RECORDS
 
 songplay_table_insert = """
@@ -114,6 +184,58 @@ artist_table_insert = """
 
 time_table_insert = "INSERT INTO times (start_time) VALUES (%s) ON CONFLICT DO NOTHING;"
 
+# INSERT RECORDS (batched)
+#
+# Same as above, but with a single VALUES placeholder for
+# psycopg2.extras.execute_values to write many rows in one statement.
+
+songplay_table_insert_values = """
+    INSERT INTO songplays (
+            start_time,
+            user_id,
+            level,
+            song_id,
+            artist_id,
+            session_id,
+            location,
+            user_agent
+    )
+    VALUES %s
+    ON CONFLICT
+    DO NOTHING;
+"""
+
+user_table_insert_values = """
+    INSERT INTO users (user_id, first_name, last_name, gender, level) VALUES %s
+    ON CONFLICT (user_id) DO UPDATE SET level=EXCLUDED.level;
+"""
+
+song_table_insert_values = """
+    INSERT INTO songs (song_id, title, artist_id, year, duration) VALUES %s
+    ON CONFLICT DO NOTHING;
+"""
+
+artist_table_insert_values = """
+    INSERT INTO artists (artist_id, name, location, latitude, longitude) VALUES %s
+    ON CONFLICT (artist_id)
+    DO NOTHING;
+"""
+
+time_table_insert_values = (
+    "INSERT INTO times (start_time) VALUES %s ON CONFLICT DO NOTHING;"
+)
+
+loaded_file_upsert = """
+    INSERT INTO loaded_files (path, size, mtime, content_hash) VALUES %s
+    ON CONFLICT (path) DO UPDATE SET
+        size=EXCLUDED.size,
+        mtime=EXCLUDED.mtime,
+        content_hash=EXCLUDED.content_hash,
+        loaded_at=now();
+"""
+
+loaded_file_select = "SELECT path, size, mtime, content_hash FROM loaded_files;"
+
 # FIND SONGS BY song title, artist name, and song duration
 
 song_select = """
@@ -130,6 +252,476 @@ song_select = """
         AND s.duration = %s
 """
 
+# ALL SONGS with the fields used to match log events, for the in-memory lookup
+
+song_lookup_select = """
+    SELECT
+        s.title,
+        a.name,
+        s.duration,
+        s.song_id,
+        a.artist_id
+    FROM
+        songs as s
+    INNER JOIN
+        artists as a ON a.artist_id = s.artist_id
+"""
+
+# STAGING TABLES (COPY load mode)
+#
+# Temp tables only live for the session, and ON COMMIT DELETE ROWS empties them
+# after every commit so each file/batch starts from a clean slate.
+
+time_staging_create = """
+CREATE TEMP TABLE IF NOT EXISTS times_staging (
+    start_time timestamp without time zone
+) ON COMMIT DELETE ROWS;
+"""
+
+user_staging_create = """
+CREATE TEMP TABLE IF NOT EXISTS users_staging (
+    user_id integer,
+    first_name VARCHAR(255),
+    last_name VARCHAR(255),
+    gender VARCHAR(255),
+    level VARCHAR(255),
+    start_time timestamp without time zone
+) ON COMMIT DELETE ROWS;
+"""
+
+artist_staging_create = """
+CREATE TEMP TABLE IF NOT EXISTS artists_staging (
+    artist_id VARCHAR(255),
+    name VARCHAR(255),
+    location VARCHAR(255),
+    latitude double precision,
+    longitude double precision
+) ON COMMIT DELETE ROWS;
+"""
+
+song_staging_create = """
+CREATE TEMP TABLE IF NOT EXISTS songs_staging (
+    song_id VARCHAR(255),
+    title VARCHAR(255),
+    artist_id VARCHAR(255),
+    year integer,
+    duration double precision
+) ON COMMIT DELETE ROWS;
+"""
+
+songplay_staging_create = """
+CREATE TEMP TABLE IF NOT EXISTS songplays_staging (
+    start_time timestamp without time zone,
+    user_id integer,
+    level VARCHAR(255),
+    song TEXT,
+    artist TEXT,
+    length double precision,
+    session_id integer,
+    location TEXT,
+    user_agent TEXT
+) ON COMMIT DELETE ROWS;
+"""
+
+# UPSERT FROM STAGING
+#
+# Set-based versions of the INSERT RECORDS queries above, keeping the same
+# ON CONFLICT rules. DISTINCT ON is needed because a single INSERT can't
+# touch the same conflicting row twice.
+
+time_staging_upsert = """
+    INSERT INTO times (start_time)
+    SELECT DISTINCT start_time FROM times_staging
+    ON CONFLICT DO NOTHING;
+"""
+
+user_staging_upsert = """
+    INSERT INTO users (user_id, first_name, last_name, gender, level)
+    SELECT DISTINCT ON (user_id) user_id, first_name, last_name, gender, level
+    FROM users_staging
+    ORDER BY user_id, start_time DESC
+    ON CONFLICT (user_id) DO UPDATE SET level=EXCLUDED.level;
+"""
+
+artist_staging_upsert = """
+    INSERT INTO artists (artist_id, name, location, latitude, longitude)
+    SELECT DISTINCT ON (artist_id) artist_id, name, location, latitude, longitude
+    FROM artists_staging
+    ORDER BY artist_id
+    ON CONFLICT (artist_id)
+    DO NOTHING;
+"""
+
+song_staging_upsert = """
+    INSERT INTO songs (song_id, title, artist_id, year, duration)
+    SELECT DISTINCT ON (song_id) song_id, title, artist_id, year, duration
+    FROM songs_staging
+    ORDER BY song_id
+    ON CONFLICT DO NOTHING;
+"""
+
+songplay_staging_upsert = """
+    INSERT INTO songplays (
+            start_time,
+            user_id,
+            level,
+            song_id,
+            artist_id,
+            session_id,
+            location,
+            user_agent
+    )
+    SELECT
+        sp.start_time,
+        sp.user_id,
+        sp.level,
+        match.song_id,
+        match.artist_id,
+        sp.session_id,
+        sp.location,
+        sp.user_agent
+    FROM
+        songplays_staging as sp
+    LEFT JOIN LATERAL (
+        SELECT
+            s.song_id,
+            a.artist_id
+        FROM
+            songs as s
+        INNER JOIN
+            artists as a ON a.artist_id = s.artist_id
+        WHERE
+            s.title = sp.song
+            AND a.name = sp.artist
+            AND s.duration = round(sp.length::numeric, 5)
+        LIMIT 1
+    ) as match ON true
+    ON CONFLICT
+    DO NOTHING;
+"""
+
+# SONGPLAY PARTITIONS
+#
+# `songplays` is range partitioned by month of `start_time`, into
+# `songplays_YYYY_MM` tables. Partition names are built from dates, never from
+# user input.
+
+songplay_partition_names_select = """
+SELECT c.relname
+FROM pg_inherits as i
+INNER JOIN pg_class as c ON c.oid = i.inhrelid
+WHERE i.inhparent = 'songplays'::regclass;
+"""
+
+songplay_partitions_select = """
+SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples::bigint
+FROM pg_inherits as i
+INNER JOIN pg_class as c ON c.oid = i.inhrelid
+WHERE i.inhparent = 'songplays'::regclass
+ORDER BY c.relname;
+"""
+
+songplay_partition_create = """
+CREATE TABLE IF NOT EXISTS {name} PARTITION OF songplays
+    FOR VALUES FROM (%(start)s) TO (%(end)s);
+"""
+
+songplay_partition_attach = """
+ALTER TABLE songplays ATTACH PARTITION {name}
+    FOR VALUES FROM (%(start)s) TO (%(end)s);
+"""
+
+songplay_partition_detach = "ALTER TABLE songplays DETACH PARTITION {name};"
+
+songplay_partition_truncate = "TRUNCATE {name};"
+
+staging_event_months_select = """
+SELECT DISTINCT date_trunc('month', start_time)::date FROM staging_next_songs;
+"""
+
+# AGGREGATES
+#
+# Running totals over `songplays`, refreshed from the rows inserted since the
+# last refresh. `songplay_id` is the watermark: every refresh folds in the rows
+# between the last refreshed id and the highest id at refresh time.
+
+songplays_by_hour_create = """
+CREATE TABLE IF NOT EXISTS songplays_by_hour (
+    start_hour timestamp without time zone PRIMARY KEY,
+    plays bigint NOT NULL
+)
+"""
+
+songplays_by_level_create = """
+CREATE TABLE IF NOT EXISTS songplays_by_level (
+    level VARCHAR(255) PRIMARY KEY,
+    plays bigint NOT NULL
+)
+"""
+
+song_play_counts_create = """
+CREATE TABLE IF NOT EXISTS song_play_counts (
+    song_id VARCHAR(255) PRIMARY KEY,
+    plays bigint NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS song_play_counts_plays_idx ON song_play_counts (plays);
+"""
+
+artist_play_counts_create = """
+CREATE TABLE IF NOT EXISTS artist_play_counts (
+    artist_id VARCHAR(255) PRIMARY KEY,
+    plays bigint NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS artist_play_counts_plays_idx ON artist_play_counts (plays);
+"""
+
+aggregate_watermark_create = """
+CREATE TABLE IF NOT EXISTS aggregate_watermarks (
+    name VARCHAR(255) PRIMARY KEY,
+    last_songplay_id bigint NOT NULL
+);
+
+INSERT INTO aggregate_watermarks (name, last_songplay_id) VALUES ('songplays', 0)
+ON CONFLICT DO NOTHING;
+"""
+
+# Locks the watermark, so concurrent refreshes take turns
+aggregate_watermark_select = """
+SELECT last_songplay_id FROM aggregate_watermarks
+WHERE name = 'songplays'
+FOR UPDATE;
+"""
+
+aggregate_watermark_update = """
+UPDATE aggregate_watermarks SET last_songplay_id = %(high)s
+WHERE name = 'songplays';
+"""
+
+songplay_max_id_select = "SELECT coalesce(max(songplay_id), 0) FROM songplays;"
+
+# Each one takes the %(low)s < songplay_id <= %(high)s window of new rows
+songplays_by_hour_refresh = """
+    INSERT INTO songplays_by_hour (start_hour, plays)
+    SELECT date_trunc('hour', start_time), count(*)
+    FROM songplays
+    WHERE songplay_id > %(low)s AND songplay_id <= %(high)s
+    GROUP BY 1
+    ON CONFLICT (start_hour)
+    DO UPDATE SET plays = songplays_by_hour.plays + EXCLUDED.plays;
+"""
+
+songplays_by_level_refresh = """
+    INSERT INTO songplays_by_level (level, plays)
+    SELECT level, count(*)
+    FROM songplays
+    WHERE songplay_id > %(low)s AND songplay_id <= %(high)s AND level IS NOT NULL
+    GROUP BY 1
+    ON CONFLICT (level)
+    DO UPDATE SET plays = songplays_by_level.plays + EXCLUDED.plays;
+"""
+
+song_play_counts_refresh = """
+    INSERT INTO song_play_counts (song_id, plays)
+    SELECT song_id, count(*)
+    FROM songplays
+    WHERE songplay_id > %(low)s AND songplay_id <= %(high)s AND song_id IS NOT NULL
+    GROUP BY 1
+    ON CONFLICT (song_id)
+    DO UPDATE SET plays = song_play_counts.plays + EXCLUDED.plays;
+"""
+
+artist_play_counts_refresh = """
+    INSERT INTO artist_play_counts (artist_id, plays)
+    SELECT artist_id, count(*)
+    FROM songplays
+    WHERE songplay_id > %(low)s AND songplay_id <= %(high)s AND artist_id IS NOT NULL
+    GROUP BY 1
+    ON CONFLICT (artist_id)
+    DO UPDATE SET plays = artist_play_counts.plays + EXCLUDED.plays;
+"""
+
+top_songs_select = """
+    SELECT s.title, a.name, c.plays
+    FROM song_play_counts as c
+    INNER JOIN songs as s ON s.song_id = c.song_id
+    INNER JOIN artists as a ON a.artist_id = s.artist_id
+    ORDER BY c.plays DESC
+    LIMIT %s;
+"""
+
+top_artists_select = """
+    SELECT a.name, c.plays
+    FROM artist_play_counts as c
+    INNER JOIN artists as a ON a.artist_id = c.artist_id
+    ORDER BY c.plays DESC
+    LIMIT %s;
+"""
+
+# (aggregate table, refresh query)
+aggregate_refresh_queries = [
+    ("songplays_by_hour", songplays_by_hour_refresh),
+    ("songplays_by_level", songplays_by_level_refresh),
+    ("song_play_counts", song_play_counts_refresh),
+    ("artist_play_counts", artist_play_counts_refresh),
+]
+
+# RAW STAGING (sql load mode)
+#
+# Song and log files are copied into these line by line, untouched, and all of
+# the transformation happens in the INSERT ... SELECTs below. UNLOGGED skips
+# the WAL: the rows only live until the end of the transaction that loads them.
+
+staging_songs_create = """
+CREATE UNLOGGED TABLE IF NOT EXISTS staging_songs (
+    data jsonb
+)
+"""
+
+staging_events_create = """
+CREATE UNLOGGED TABLE IF NOT EXISTS staging_events (
+    data jsonb
+)
+"""
+
+# Typed columns over the raw JSON, with the same cleaning as the pandas path
+staging_song_records_create = """
+CREATE OR REPLACE VIEW staging_song_records AS
+SELECT
+    data->>'song_id' as song_id,
+    data->>'title' as title,
+    data->>'artist_id' as artist_id,
+    (data->>'year')::integer as year,
+    (data->>'duration')::double precision as duration,
+    data->>'artist_name' as artist_name,
+    data->>'artist_location' as artist_location,
+    (data->>'artist_latitude')::double precision as artist_latitude,
+    (data->>'artist_longitude')::double precision as artist_longitude
+FROM staging_songs
+WHERE data IS NOT NULL
+"""
+
+# start_time is naive UTC whatever the session's TimeZone, the same as
+# `etl.datetime_from_mills_column` gives the pandas load modes, and the months
+# partitions are picked by
+staging_next_songs_create = """
+CREATE OR REPLACE VIEW staging_next_songs AS
+SELECT
+    timestamp 'epoch' + (data->>'ts')::bigint * interval '1 millisecond'
+        as start_time,
+    NULLIF(data->>'userId', '')::integer as user_id,
+    data->>'firstName' as first_name,
+    data->>'lastName' as last_name,
+    data->>'gender' as gender,
+    data->>'level' as level,
+    data->>'song' as song,
+    data->>'artist' as artist,
+    (data->>'length')::double precision as length,
+    (data->>'sessionId')::integer as session_id,
+    data->>'location' as location,
+    data->>'userAgent' as user_agent
+FROM staging_events
+WHERE data->>'page' = 'NextSong'
+"""
+
+# Every line of the file lands in the single jsonb column: the quote and
+# delimiter characters never show up in the JSON
+raw_staging_copy = """
+COPY {table} (data) FROM STDIN WITH (FORMAT csv, QUOTE e'\\x01', DELIMITER e'\\x02')
+"""
+
+# TRANSFORM FROM RAW STAGING (sql load mode)
+#
+# Same ON CONFLICT rules and first/last wins as the pandas path.
+
+artist_table_transform = """
+    INSERT INTO artists (artist_id, name, location, latitude, longitude)
+    SELECT DISTINCT ON (artist_id)
+        artist_id,
+        artist_name,
+        artist_location,
+        artist_latitude,
+        artist_longitude
+    FROM staging_song_records
+    ORDER BY artist_id
+    ON CONFLICT (artist_id)
+    DO NOTHING;
+"""
+
+song_table_transform = """
+    INSERT INTO songs (song_id, title, artist_id, year, duration)
+    SELECT DISTINCT ON (song_id) song_id, title, artist_id, year, duration
+    FROM staging_song_records
+    ORDER BY song_id
+    ON CONFLICT DO NOTHING;
+"""
+
+time_table_transform = """
+    INSERT INTO times (start_time)
+    SELECT DISTINCT start_time FROM staging_next_songs
+    ORDER BY start_time
+    ON CONFLICT DO NOTHING;
+"""
+
+user_table_transform = """
+    INSERT INTO users (user_id, first_name, last_name, gender, level)
+    SELECT DISTINCT ON (user_id) user_id, first_name, last_name, gender, level
+    FROM staging_next_songs
+    ORDER BY user_id, start_time DESC
+    ON CONFLICT (user_id) DO UPDATE SET level=EXCLUDED.level;
+"""
+
+# Rows that can't be matched to a song, left out of `songplays`
+songplay_unmatchable_select = """
+    SELECT count(*) FROM staging_next_songs
+    WHERE song IS NULL OR artist IS NULL OR length IS NULL;
+"""
+
+songplay_table_transform = """
+    INSERT INTO songplays (
+            start_time,
+            user_id,
+            level,
+            song_id,
+            artist_id,
+            session_id,
+            location,
+            user_agent
+    )
+    SELECT
+        sp.start_time,
+        sp.user_id,
+        sp.level,
+        match.song_id,
+        match.artist_id,
+        sp.session_id,
+        sp.location,
+        sp.user_agent
+    FROM
+        staging_next_songs as sp
+    LEFT JOIN LATERAL (
+        SELECT
+            s.song_id,
+            a.artist_id
+        FROM
+            songs as s
+        INNER JOIN
+            artists as a ON a.artist_id = s.artist_id
+        WHERE
+            s.title = sp.song
+            AND a.name = sp.artist
+            AND s.duration = round(sp.length::numeric, 5)
+        LIMIT 1
+    ) as match ON true
+    WHERE
+        sp.song IS NOT NULL
+        AND sp.artist IS NOT NULL
+        AND sp.length IS NOT NULL
+    ON CONFLICT
+    DO NOTHING;
+"""
+
 # QUERY LISTS
 
 create_table_queries = [
@@ -139,4 +731,27 @@ create_table_queries = [
     song_table_create,
     time_table_create,
     songplay_table_create,
+    loaded_file_create,
+    songplays_by_hour_create,
+    songplays_by_level_create,
+    song_play_counts_create,
+    artist_play_counts_create,
+    aggregate_watermark_create,
+    staging_songs_create,
+    staging_events_create,
+    staging_song_records_create,
+    staging_next_songs_create,
+]
+
+create_index_queries = [
+    song_lookup_index_create,
+    artist_name_index_create,
+]
+
+create_staging_table_queries = [
+    time_staging_create,
+    user_staging_create,
+    artist_staging_create,
+    song_staging_create,
+    songplay_staging_create,
 ]
@@ -0,0 +1,113 @@
+import time
+
+from metrics import run_metrics
+from partitions import ensure_load_partitions
+from sql_queries import (artist_table_transform, raw_staging_copy,
+                         song_table_transform, songplay_table_transform,
+                         songplay_unmatchable_select, staging_event_months_select,
+                         time_table_transform, user_table_transform)
+
+
+def copy_raw_files(cursor, table, filepaths):
+    """Streams files line by line into a raw staging table, without parsing
+    them.
+
+    :param cursor: psycopg2 cursor
+    :param table: str - `staging_songs` or `staging_events`
+    :param filepaths: list[str]
+
+    """
+    with run_metrics.time_stage("copy_raw"):
+        for filepath in filepaths:
+            with open(filepath, encoding="utf8") as f:
+                cursor.copy_expert(raw_staging_copy.format(table=table), f)
+
+
+def run_transform(cursor, table, query):
+    """Runs an INSERT ... SELECT from staging and records the rows it wrote
+    against `table` in the run metrics.
+
+    :param cursor: psycopg2 cursor
+    :param table: str - table the query inserts into
+    :param query: str
+
+    """
+    start = time.perf_counter()
+    cursor.execute(query)
+    run_metrics.record_load(table, cursor.rowcount, time.perf_counter() - start)
+
+
+def clear_staging(cursor, table):
+    """Empties a raw staging table before the transaction ends.
+
+    DELETE, not TRUNCATE: a DELETE only sees this transaction's rows, so
+    concurrent workers never block on, or wipe, each other's staged files.
+
+    :param cursor: psycopg2 cursor
+    :param table: str
+
+    """
+    cursor.execute(f"DELETE FROM {table}")
+
+
+def process_song_files(cur, filepaths):
+    """Copies song files into `staging_songs` and builds `artists` and `songs`
+    from them in SQL.
+
+    :param cur: psycopg2 cursor
+    :param filepaths: list[str]
+
+    """
+    copy_raw_files(cur, "staging_songs", filepaths)
+
+    with run_metrics.time_stage("transform_songs"):
+        run_transform(cur, "artists", artist_table_transform)
+        run_transform(cur, "songs", song_table_transform)
+
+    clear_staging(cur, "staging_songs")
+
+
+def process_song_file(cur, filepath):
+    """Single file version of `process_song_files`.
+
+    :param cur: psycopg2 cursor
+    :param filepath: str
+
+    """
+    process_song_files(cur, [filepath])
+
+
+def process_log_files(cur, filepaths):
+    """Copies log files into `staging_events` and builds `times`, `users` and
+    `songplays` from the "NextSong" events in SQL, matching songs and artists
+    with a join.
+
+    :param cur: psycopg2 cursor
+    :param filepaths: list[str]
+
+    """
+    copy_raw_files(cur, "staging_events", filepaths)
+
+    with run_metrics.time_stage("transform_events"):
+        run_transform(cur, "times", time_table_transform)
+        run_transform(cur, "users", user_table_transform)
+
+        cur.execute(songplay_unmatchable_select)
+        (unmatchable,) = cur.fetchone()
+        run_metrics.record_skipped("songplays", unmatchable)
+
+        cur.execute(staging_event_months_select)
+        ensure_load_partitions(cur, [month for (month,) in cur.fetchall()])
+        run_transform(cur, "songplays", songplay_table_transform)
+
+    clear_staging(cur, "staging_events")
+
+
+def process_log_file(cur, filepath):
+    """Single file version of `process_log_files`.
+
+    :param cur: psycopg2 cursor
+    :param filepath: str
+
+    """
+    process_log_files(cur, [filepath])
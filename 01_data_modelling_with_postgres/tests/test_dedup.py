@@ -0,0 +1,82 @@
+import pandas as pd
+import pytest
+
+from dedup import RunDeduplicator
+from metrics import run_metrics
+
+
+@pytest.fixture(autouse=True)
+def fresh_metrics():
+    run_metrics.drain()
+    yield
+    run_metrics.drain()
+
+
+def events(*rows):
+    return pd.DataFrame(rows, columns=["ts", "startTime", "userId", "level"])
+
+
+def test_new_start_times_drops_duplicates_within_a_file():
+    dedup = RunDeduplicator()
+    new = dedup.new_start_times(events((1, "a", "7", "free"), (1, "a", "7", "free")))
+    assert new["ts"].tolist() == [1]
+    assert run_metrics.deduplicated["times"] == 1
+
+
+def test_confirmed_times_are_not_written_again():
+    dedup = RunDeduplicator()
+    dedup.new_start_times(events((1, "a", "7", "free")))
+    dedup.confirm()
+
+    new = dedup.new_start_times(events((1, "a", "7", "free"), (2, "b", "7", "free")))
+    assert new["ts"].tolist() == [2]
+
+
+def test_pending_times_are_not_written_twice_before_confirm():
+    dedup = RunDeduplicator()
+    dedup.new_start_times(events((1, "a", "7", "free")))
+    assert dedup.new_start_times(events((1, "a", "7", "free"))).empty
+
+
+def test_discarded_times_are_written_again():
+    dedup = RunDeduplicator()
+    dedup.new_start_times(events((1, "a", "7", "free")))
+    dedup.discard()
+
+    assert dedup.new_start_times(events((1, "a", "7", "free")))["ts"].tolist() == [1]
+    assert dedup.written_times == set()
+
+
+def test_changed_users_keeps_the_latest_row_per_user():
+    dedup = RunDeduplicator()
+    changed = dedup.changed_users(
+        events((1, "a", "7", "free"), (2, "b", "7", "paid"), (3, "c", "8", "free"))
+    )
+    assert list(zip(changed["userId"], changed["level"])) == [
+        ("7", "paid"),
+        ("8", "free"),
+    ]
+
+
+def test_confirmed_users_are_only_written_again_when_their_level_changes():
+    dedup = RunDeduplicator()
+    dedup.changed_users(events((1, "a", "7", "free"), (2, "b", "8", "free")))
+    dedup.confirm()
+
+    changed = dedup.changed_users(events((3, "c", "7", "free"), (4, "d", "8", "paid")))
+    assert changed["userId"].tolist() == ["8"]
+    assert dedup.user_levels == {"7": "free", "8": "free"}
+
+    dedup.confirm()
+    assert dedup.user_levels == {"7": "free", "8": "paid"}
+
+
+def test_discarded_users_are_written_again():
+    dedup = RunDeduplicator()
+    dedup.changed_users(events((1, "a", "7", "free")))
+    dedup.discard()
+
+    assert dedup.changed_users(events((2, "b", "7", "free")))["userId"].tolist() == [
+        "7"
+    ]
+    assert dedup.user_levels == {}
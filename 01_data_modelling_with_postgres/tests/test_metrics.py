@@ -0,0 +1,105 @@
+import json
+
+import pytest
+
+from metrics import PROMETHEUS_PREFIX, RunMetrics, percentile
+
+
+def test_percentile_of_no_samples_is_zero():
+    assert percentile([], 0.5) == 0.0
+
+
+@pytest.mark.parametrize(
+    "q, expected", [(0.0, 1), (0.1, 1), (0.5, 5), (0.95, 10), (1.0, 10)]
+)
+def test_percentile_is_nearest_rank(q, expected):
+    assert percentile([7, 3, 10, 1, 9, 2, 8, 4, 6, 5], q) == expected
+
+
+def test_stage_and_gauge_summaries():
+    metrics = RunMetrics()
+    metrics.stage_seconds["read_json"].extend([0.1, 0.2, 0.3, 0.4])
+    for depth in [0, 2, 4]:
+        metrics.record_gauge("pipeline_queue_depth", depth)
+
+    stage = metrics.stage_summary("read_json")
+    assert stage["count"] == 4
+    assert stage["seconds"] == pytest.approx(1.0)
+    assert (stage["p50"], stage["p95"]) == (0.2, 0.4)
+
+    assert metrics.gauge_summary("pipeline_queue_depth") == {
+        "count": 3,
+        "max": 4,
+        "p50": 2,
+        "p95": 4,
+    }
+    assert metrics.stage_summary("missing") == {
+        "count": 0,
+        "seconds": 0.0,
+        "p50": 0.0,
+        "p95": 0.0,
+    }
+
+
+def test_merge_and_drain():
+    worker = RunMetrics()
+    worker.record_load("songs", 10, 1.0)
+    worker.record_skipped("songplays", 2)
+    worker.stage_seconds["read_json"].append(0.5)
+
+    parent = RunMetrics()
+    parent.record_load("songs", 5, 1.0)
+    parent.merge(worker.drain())
+
+    assert parent.rows["songs"] == 15
+    assert parent.rows_per_second("songs") == 7.5
+    assert parent.skipped["songplays"] == 2
+    assert parent.stage_seconds["read_json"] == [0.5]
+    assert worker.total_rows() == 0
+    assert not worker.stage_seconds
+
+
+def test_prometheus_output():
+    metrics = RunMetrics()
+    metrics.record_load("songs", 100, 2.0)
+    metrics.record_deduplicated("times", 3)
+    metrics.stage_seconds["read_json"].extend([0.1, 0.3])
+    metrics.record_gauge("pipeline_queue_depth", 2)
+
+    lines = metrics.to_prometheus().splitlines()
+    p = PROMETHEUS_PREFIX
+
+    assert f"# TYPE {p}_rows_total counter" in lines
+    assert f'{p}_rows_total{{table="songs"}} 100' in lines
+    assert f'{p}_rows_total{{table="times"}} 0' in lines
+    assert f'{p}_rows_deduplicated_total{{table="times"}} 3' in lines
+    assert f'{p}_rows_per_second{{table="songs"}} 50.0' in lines
+    assert f'{p}_stage_seconds{{stage="read_json",quantile="0.5"}} 0.1' in lines
+    assert f'{p}_stage_seconds{{stage="read_json",quantile="0.95"}} 0.3' in lines
+    assert f'{p}_stage_seconds_count{{stage="read_json"}} 2' in lines
+    assert f'{p}_gauge_max{{gauge="pipeline_queue_depth"}} 2' in lines
+    assert lines[-1].startswith(f"{p}_peak_memory_bytes ")
+
+    # every sample has a TYPE line for its metric family before it
+    declared = set()
+    for line in lines:
+        if line.startswith("# TYPE "):
+            declared.add(line.split()[2])
+        elif not line.startswith("#"):
+            name = line.split("{")[0].split()[0]
+            family = name.removesuffix("_sum").removesuffix("_count")
+            assert family in declared, line
+
+
+def test_written_files_match_the_summary(tmp_path):
+    metrics = RunMetrics()
+    metrics.record_load("songs", 100, 2.0)
+
+    json_path = tmp_path / "metrics.json"
+    metrics.write_json(str(json_path))
+    assert json.loads(json_path.read_text())["tables"]["songs"]["rows"] == 100
+
+    prom_path = tmp_path / "metrics.prom"
+    metrics.write_prometheus(str(prom_path))
+    assert prom_path.read_text() == metrics.to_prometheus()
+    assert not list(tmp_path.glob("*.tmp"))
@@ -0,0 +1,80 @@
+import pytest
+
+from metrics import run_metrics
+from transactions import CommitPolicy
+
+
+class FakeConnection:
+    def __init__(self):
+        self.commits = 0
+
+    def commit(self):
+        self.commits += 1
+
+
+@pytest.fixture(autouse=True)
+def fresh_metrics():
+    run_metrics.drain()
+    yield
+    run_metrics.drain()
+
+
+def test_commits_after_every_file_by_default():
+    policy = CommitPolicy()
+    assert not policy.due()
+    policy.add_files(1)
+    assert policy.due()
+
+
+def test_commits_every_n_files():
+    conn = FakeConnection()
+    policy = CommitPolicy(every_files=3)
+
+    for _ in range(7):
+        policy.add_files(1)
+        policy.maybe_commit(conn)
+
+    assert conn.commits == 2
+    assert policy.pending_files == 1
+
+
+def test_commits_once_enough_rows_were_written():
+    conn = FakeConnection()
+    policy = CommitPolicy(every_files=0, every_rows=100)
+
+    run_metrics.record_load("songplays", 60, 0.1)
+    policy.add_files(5)
+    policy.maybe_commit(conn)
+    assert conn.commits == 0
+
+    run_metrics.record_load("users", 40, 0.1)
+    policy.maybe_commit(conn)
+    assert conn.commits == 1
+
+
+def test_rows_are_counted_from_the_last_commit():
+    conn = FakeConnection()
+    run_metrics.record_load("songplays", 500, 0.1)
+    policy = CommitPolicy(every_files=0, every_rows=100)
+
+    run_metrics.record_load("songplays", 99, 0.1)
+    assert not policy.due()
+
+    run_metrics.record_load("songplays", 1, 0.1)
+    policy.commit(conn)
+    assert not policy.due()
+    assert policy.pending_files == 0
+
+
+def test_whichever_limit_is_hit_first():
+    policy = CommitPolicy(every_files=10, every_rows=100)
+    policy.add_files(1)
+    run_metrics.record_load("songplays", 100, 0.1)
+    assert policy.due()
+
+
+def test_never_due_without_limits():
+    policy = CommitPolicy(every_files=0)
+    policy.add_files(1000)
+    run_metrics.record_load("songplays", 10**6, 0.1)
+    assert not policy.due()
@@ -0,0 +1,63 @@
+from datetime import date
+
+import pytest
+
+from utils import chunked, in_date_range
+
+NOVEMBER = (date(2018, 11, 5), date(2018, 11, 20))
+
+
+def test_in_date_range_keeps_everything_without_bounds():
+    assert in_date_range(["1999"])
+    assert in_date_range(["2018", "11", "2018-11-01-events.json"])
+
+
+@pytest.mark.parametrize(
+    "parts, expected",
+    [
+        (["2017"], False),
+        (["2018"], True),
+        (["2019"], False),
+        (["2018", "10"], False),
+        (["2018", "11"], True),
+        (["2018", "12"], False),
+        (["2018", "11", "2018-11-04-events.json"], False),
+        (["2018", "11", "2018-11-05-events.json"], True),
+        (["2018", "11", "2018-11-20-events.json"], True),
+        (["2018", "11", "2018-11-21-events.json"], False),
+    ],
+)
+def test_in_date_range_checks_years_months_and_days_inclusively(parts, expected):
+    assert in_date_range(parts, *NOVEMBER) is expected
+
+
+def test_in_date_range_open_ended():
+    assert in_date_range(
+        ["2018", "11", "2018-11-30-events.json"], since=date(2018, 11, 5)
+    )
+    assert not in_date_range(
+        ["2018", "11", "2018-11-04-events.json"], since=date(2018, 11, 5)
+    )
+    assert in_date_range(
+        ["2018", "11", "2018-11-01-events.json"], until=date(2018, 11, 5)
+    )
+    assert not in_date_range(["2019"], until=date(2018, 11, 5))
+
+
+def test_in_date_range_keeps_paths_outside_the_layout():
+    assert in_date_range(["notes"], *NOVEMBER)
+    assert in_date_range(["2018", "11", "events.json"], *NOVEMBER)
+
+
+def test_chunked_splits_into_full_chunks_and_a_remainder():
+    assert list(chunked(range(7), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
+
+
+def test_chunked_consumes_iterators_lazily():
+    chunks = chunked(iter(range(4)), 2)
+    assert next(chunks) == [0, 1]
+    assert list(chunks) == [[2, 3]]
+
+
+def test_chunked_empty():
+    assert list(chunked([], 3)) == []
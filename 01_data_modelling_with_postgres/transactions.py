@@ -0,0 +1,81 @@
+import psycopg2
+
+from log import config_log
+from metrics import run_metrics
+
+logging = config_log()
+
+SAVEPOINT_NAME = "file_load"
+
+
+class CommitPolicy:
+    """Decides when a long running load commits: after every `every_files`
+    files, and/or once `every_rows` rows have been written since the last
+    commit, whichever comes first. `every_files` of 0 leaves it to `every_rows`.
+    """
+
+    def __init__(self, every_files=1, every_rows=None):
+        self.every_files = every_files
+        self.every_rows = every_rows
+        self.pending_files = 0
+        self.rows_at_last_commit = run_metrics.total_rows()
+
+    def add_files(self, number_of_files):
+        """Counts files that were processed since the last commit.
+
+        :param number_of_files: int
+
+        """
+        self.pending_files += number_of_files
+
+    def due(self):
+        """Checks whether enough files or rows are pending to commit."""
+        if self.every_files and self.pending_files >= self.every_files:
+            return True
+        pending_rows = run_metrics.total_rows() - self.rows_at_last_commit
+        return bool(self.every_rows) and pending_rows >= self.every_rows
+
+    def commit(self, conn):
+        """Commits and resets the pending counts.
+
+        :param conn: psycopg2 connection
+
+        """
+        conn.commit()
+        self.pending_files = 0
+        self.rows_at_last_commit = run_metrics.total_rows()
+
+    def maybe_commit(self, conn):
+        """Commits if the policy says it's time to.
+
+        :param conn: psycopg2 connection
+
+        """
+        if self.due():
+            self.commit(conn)
+
+
+def run_in_savepoint(cur, func, *args):
+    """Runs `func(cur, *args)` inside a savepoint.
+
+    If it fails, everything it did is rolled back to the savepoint and the rest
+    of the transaction is kept. Lost connections are re-raised, since there's
+    nothing left to roll back to.
+
+    Returns None on success, or the error message.
+
+    :param cur: psycopg2 cursor
+    :param func: function(cur, *args)
+
+    """
+    cur.execute(f"SAVEPOINT {SAVEPOINT_NAME}")
+    try:
+        func(cur, *args)
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        raise
+    except Exception as e:
+        cur.execute(f"ROLLBACK TO SAVEPOINT {SAVEPOINT_NAME}")
+        return f"{type(e).__name__}: {e}"
+
+    cur.execute(f"RELEASE SAVEPOINT {SAVEPOINT_NAME}")
+    return None
@@ -1,33 +1,119 @@
-import glob
+import itertools
 import os
-from typing import AnyStr, Iterator
+import re
+from datetime import date
 
-from pydash import flat_map, map_
+# Leading YYYY-MM-DD of a log file name, e.g. "2018-11-01-events.json"
+DATE_PREFIX = re.compile(r"^(\d{4})-(\d{2})-(\d{2})")
 
 
-def join_json_paths_and_filenames(
-    walk_iterator: Iterator[tuple[AnyStr, list[AnyStr], list[AnyStr]]]
-):
+def absolute_path(filepath):
     """
-    Takes an Iterator (usually a call to os.walk) and returns a list of relative
-    filepaths for all files found.
+    Takes a list of filepaths and makes them all absolute.
     """
-    root, _, _ = walk_iterator
-    return glob.glob(os.path.join(root, "*.json"))
+    return os.path.abspath(filepath)
 
 
-def absolute_path(filepath):
+def in_date_range(relative_parts, since=None, until=None):
     """
-    Takes a list of filepaths and makes them all absolute.
+    Checks a directory or file against an inclusive date range, going by the
+    `log_data/YYYY/MM/YYYY-MM-DD-events.json` layout. Anything that doesn't
+    look like part of that layout is kept.
+
+    :param relative_parts: list[str] - path parts below the root being walked,
+        e.g. ["2018"], ["2018", "11"] or ["2018", "11", "2018-11-01-events.json"]
+    :param since: datetime.date - optional, first day to keep
+    :param until: datetime.date - optional, last day to keep
     """
-    return os.path.abspath(filepath)
+    if since is None and until is None:
+        return True
+
+    name = relative_parts[-1]
+    depth = len(relative_parts)
+    lowest, highest = since or date.min, until or date.max
+
+    if depth == 1 and name.isdigit() and len(name) == 4:
+        return lowest.year <= int(name) <= highest.year
+
+    if depth == 2 and name.isdigit() and relative_parts[0].isdigit():
+        month = (int(relative_parts[0]), int(name))
+        return (lowest.year, lowest.month) <= month <= (highest.year, highest.month)
+
+    match = DATE_PREFIX.match(name)
+    if match:
+        return lowest <= date(*map(int, match.groups())) <= highest
+
+    return True
+
+
+def iter_json_files_in_path(filepath, since=None, until=None):
+    """Lazily yields the absolute path of every JSON file below a filepath.
+
+    Uses os.scandir, so the first files come out before the whole tree has
+    been walked, and directory entries are sorted so files come out in a
+    stable (for log data: chronological) order. With `since`/`until`, year and
+    month directories outside the range are never entered.
 
+    :param filepath: str - path to walk for possible files
+    :param since: datetime.date - optional, see `in_date_range`
+    :param until: datetime.date - optional, see `in_date_range`
+    """
+    root = absolute_path(filepath)
+    if not os.path.isdir(root):
+        return
+
+    stack = [(root, [])]
+
+    while stack:
+        directory, parts = stack.pop()
+        with os.scandir(directory) as entries:
+            entries = sorted(entries, key=lambda entry: entry.name)
 
-def get_all_json_files_in_path(filepath):
+        subdirectories = []
+        for entry in entries:
+            entry_parts = parts + [entry.name]
+            if not in_date_range(entry_parts, since, until):
+                continue
+            if entry.is_dir():
+                subdirectories.append((entry.path, entry_parts))
+            elif entry.name.endswith(".json") and entry.is_file():
+                yield entry.path
+
+        # reversed so they come off the stack in sorted order
+        stack.extend(reversed(subdirectories))
+
+
+def get_all_json_files_in_path(filepath, since=None, until=None):
     """Get all JSON files in a a given filepath
 
     :param filepath: str - path to walk for possible files
+    :param since: datetime.date - optional, see `in_date_range`
+    :param until: datetime.date - optional, see `in_date_range`
+    """
+    return list(iter_json_files_in_path(filepath, since, until))
+
+
+def chunked(iterable, size):
+    """Yields lists of up to `size` items from an iterable.
+
+    :param iterable: Iterable
+    :param size: int - maximum number of items per chunk
+    """
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+def read_json_lines_files(filepaths):
+    """Reads many line-delimited JSON files and returns them as one bytestring,
+    so the whole lot can be parsed in a single pass (see `json_parsers.parse`).
+
+    :param filepaths: list[str]
     """
-    files_with_paths = flat_map(os.walk(filepath), join_json_paths_and_filenames)
-    with_absolute_paths = map_(files_with_paths, absolute_path)
-    return with_absolute_paths
+    contents = []
+    for filepath in filepaths:
+        with open(filepath, "rb") as f:
+            data = f.read().strip()
+        if data:
+            contents.append(data)
+    return b"\n".join(contents)